@@ -0,0 +1,128 @@
+"""
+Stale-while-revalidate cache for the admin analytics endpoints.
+
+    @router.get("/analytics/heatmap")
+    @swr_cache("heatmap", ttl=300)
+    async def get_heatmap(): ...
+
+Results are stored in Redis as JSON together with the time they were
+computed. Within `ttl` seconds a request is a plain hit. After that the
+stale value is still served immediately, and one background task per key
+(guarded by a SET NX lock shared across workers) recomputes it. Only a
+request that finds nothing at all computes in-line. Entries are dropped
+entirely after `ttl + MAX_STALE` seconds.
+
+Every response carries `X-Cache: HIT | STALE | MISS` and `Age` (seconds
+since the value was computed).
+"""
+import asyncio
+import functools
+import json
+import time
+from typing import Dict, Optional
+
+from fastapi.responses import JSONResponse
+
+from database import get_redis
+
+KEY_PREFIX = "analytics:cache:"
+LOCK_PREFIX = "analytics:lock:"
+
+# How long a stale entry may still be served while it is being refreshed
+MAX_STALE = 3600
+# A refresh that takes longer than this loses its lock
+REFRESH_LOCK_TTL = 60
+
+# Registered endpoint name -> TTL, for the invalidation endpoint
+CACHED_ENDPOINTS = {}
+
+# Cache key -> its running background refresh (the event loop only holds tasks weakly)
+_refreshing: Dict[str, asyncio.Task] = {}
+
+
+def cache_key(name: str, kwargs: dict) -> str:
+    args = ",".join(f"{k}={kwargs[k]}" for k in sorted(kwargs))
+    return f"{KEY_PREFIX}{name}:{args}"
+
+
+async def _store(redis, key: str, data, ttl: int):
+    payload = json.dumps({"computed_at": time.time(), "data": data}, default=str)
+    await redis.set(key, payload, ex=ttl + MAX_STALE)
+
+
+def _response(data, status: str, age: float) -> JSONResponse:
+    return JSONResponse(content=data, headers={"X-Cache": status, "Age": str(int(age))})
+
+
+def swr_cache(name: str, ttl: int):
+    """Cache an analytics endpoint under `name` with a freshness of `ttl` seconds."""
+    CACHED_ENDPOINTS[name] = ttl
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(**kwargs):
+            redis = await get_redis()
+            if not redis:
+                return await func(**kwargs)
+
+            key = cache_key(name, kwargs)
+            try:
+                cached = await redis.get(key)
+            except Exception as e:
+                print(f"Redis Error while reading analytics cache: {e}")
+                return await func(**kwargs)
+
+            if cached is None:
+                data = jsonable(await func(**kwargs))
+                try:
+                    await _store(redis, key, data, ttl)
+                except Exception as e:
+                    print(f"Redis Error while writing analytics cache: {e}")
+                return _response(data, "MISS", 0)
+
+            entry = json.loads(cached)
+            age = time.time() - entry["computed_at"]
+            if age < ttl:
+                return _response(entry["data"], "HIT", age)
+
+            # Stale: serve it now, let exactly one worker recompute
+            if key not in _refreshing:
+                try:
+                    if await redis.set(LOCK_PREFIX + key, "1", nx=True, ex=REFRESH_LOCK_TTL):
+                        task = asyncio.create_task(_refresh(redis, key, func, kwargs, ttl))
+                        _refreshing[key] = task
+                        task.add_done_callback(lambda _: _refreshing.pop(key, None))
+                except Exception as e:
+                    print(f"Redis Error while locking analytics refresh: {e}")
+            return _response(entry["data"], "STALE", age)
+
+        return wrapper
+    return decorator
+
+
+def jsonable(data):
+    """Round-trip through JSON so a MISS returns exactly what later hits will."""
+    return json.loads(json.dumps(data, default=str))
+
+
+async def _refresh(redis, key: str, func, kwargs: dict, ttl: int):
+    try:
+        await _store(redis, key, jsonable(await func(**kwargs)), ttl)
+    except Exception as e:
+        print(f"Analytics cache refresh failed for {key}: {e}")
+    finally:
+        try:
+            await redis.delete(LOCK_PREFIX + key)
+        except Exception:
+            pass
+
+
+async def invalidate(redis, name: Optional[str] = None) -> int:
+    """Drop cached results of one endpoint (all variants), or of every endpoint."""
+    if not redis:
+        return 0
+    pattern = f"{KEY_PREFIX}{name}:*" if name else f"{KEY_PREFIX}*"
+    keys = [key async for key in redis.scan_iter(match=pattern)]
+    if keys:
+        await redis.delete(*keys)
+    return len(keys)
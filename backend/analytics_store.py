@@ -0,0 +1,297 @@
+"""
+Optional in-process columnar copy of the order log for the admin analytics.
+
+Enabled with ANALYTICS_STORE=1. At startup every order is loaded once into
+contiguous NumPy columns, sorted by time:
+
+    dish    int32   index into dish_ids
+    user    int32   index into user_ids
+    ts      int64   epoch seconds (UTC)
+    hour    int8    Shanghai-local hour
+    dow     int8    Shanghai-local weekday, 0 = Monday
+    price     float32 order-time price snapshot (order_logs.py), 0 if unknown
+    calories  float32 order-time calories snapshot, NaN if the dish was unknown
+
+26 bytes per order, so 10M orders take ~260 MB plus growth headroom.
+/api/portal/order appends new orders in place. Analytics become bincount /
+searchsorted over these arrays. Revenue and calories use the snapshots, like
+the rollups, so repricing a dish does not rewrite past charts; only the
+category is looked up from the engine catalog at query time.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+import pytz
+
+from logs_storage import LOGS_COLLECTION
+
+ANALYTICS_STORE_ENABLED = os.getenv("ANALYTICS_STORE", "0") == "1"
+
+# Shanghai is UTC+8 all year (no DST)
+LOCAL_OFFSET = 8 * 3600
+
+# Logs per chunk while loading; capacity grows by this factor when full
+LOAD_BATCH_SIZE = 100000
+GROWTH_FACTOR = 1.5
+
+COLUMNS = {
+    "dish": np.int32, "user": np.int32, "ts": np.int64, "hour": np.int8, "dow": np.int8,
+    "price": np.float32, "calories": np.float32,
+}
+
+
+def _epoch(ts: datetime) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=pytz.UTC)
+    return int(ts.timestamp())
+
+
+def _snapshot(price, calories) -> tuple:
+    """Column values of a log's price / calories snapshot (same rules as rollups.record_order)."""
+    return price or 0, np.nan if calories is None else calories
+
+
+class AnalyticsStore:
+    def __init__(self):
+        self._clear()
+        self.ready = False
+        self.loaded_at: Optional[datetime] = None
+        self.load_seconds = 0.0
+        # Orders placed while the initial load is running
+        self._pending: List[tuple] = []
+        self._loading = False
+        self._task: Optional[asyncio.Task] = None
+
+    # --- Building ---
+
+    def _clear(self):
+        self.dish_ids: List[str] = []
+        self.dish_index: Dict[str, int] = {}
+        self.user_ids: List[str] = []
+        self.user_index: Dict[str, int] = {}
+        self.columns = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.size = 0
+        self.is_sorted = True
+
+    def _intern(self, ids: List[str], index: Dict[str, int], key: str) -> int:
+        pos = index.get(key)
+        if pos is None:
+            pos = len(ids)
+            index[key] = pos
+            ids.append(key)
+        return pos
+
+    def _reserve(self, extra: int):
+        needed = self.size + extra
+        capacity = len(self.columns["ts"])
+        if needed <= capacity:
+            return
+        capacity = max(needed, int(capacity * GROWTH_FACTOR), 1024)
+        for name, column in self.columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def _append_arrays(self, dish: np.ndarray, user: np.ndarray, ts: np.ndarray,
+                       price: np.ndarray, calories: np.ndarray):
+        n = len(ts)
+        if n == 0:
+            return
+        self._reserve(n)
+        local = ts + LOCAL_OFFSET
+        start, end = self.size, self.size + n
+        self.columns["dish"][start:end] = dish
+        self.columns["user"][start:end] = user
+        self.columns["ts"][start:end] = ts
+        self.columns["price"][start:end] = price
+        self.columns["calories"][start:end] = calories
+        self.columns["hour"][start:end] = (local // 3600) % 24
+        # 1970-01-01 was a Thursday (weekday 3)
+        self.columns["dow"][start:end] = (local // 86400 + 3) % 7
+        if (self.size and ts[0] < self.columns["ts"][self.size - 1]) or np.any(np.diff(ts) < 0):
+            self.is_sorted = False
+        self.size = end
+
+    def _append_batch(self, dish: List[int], user: List[int], ts: List[int], snapshots: List[tuple]):
+        snapshots = np.asarray(snapshots, dtype=np.float64).reshape(-1, 2)
+        self._append_arrays(np.asarray(dish), np.asarray(user), np.asarray(ts, dtype=np.int64),
+                            snapshots[:, 0], snapshots[:, 1])
+
+    async def load(self, db):
+        """Load every order once; orders placed meanwhile are buffered and appended after."""
+        self._loading = True
+        start = time.perf_counter()
+        cutoff = datetime.now(pytz.UTC)
+        try:
+            cursor = db[LOGS_COLLECTION].find(
+                {"action": "order", "timestamp": {"$lt": cutoff}},
+                {"user_id": 1, "dish_id": 1, "timestamp": 1, "price": 1, "calories": 1}
+            ).sort("timestamp", 1).batch_size(10000)
+
+            dish, user, ts, snapshots = [], [], [], []
+            async for log in cursor:
+                dish.append(self._intern(self.dish_ids, self.dish_index, str(log["dish_id"])))
+                user.append(self._intern(self.user_ids, self.user_index, str(log["user_id"])))
+                ts.append(_epoch(log["timestamp"]))
+                snapshots.append(_snapshot(log.get("price"), log.get("calories")))
+                if len(ts) >= LOAD_BATCH_SIZE:
+                    self._append_batch(dish, user, ts, snapshots)
+                    dish, user, ts, snapshots = [], [], [], []
+            self._append_batch(dish, user, ts, snapshots)
+        except Exception as e:
+            # Not fatal: the store stays not ready and the admin charts keep using MongoDB
+            print(f"AnalyticsStore load failed: {e}")
+            self._pending = []
+            self._clear()
+            return
+        finally:
+            self._loading = False
+
+        self.ready = True
+        pending, self._pending = self._pending, []
+        for args in pending:
+            self.append(*args)
+        self.loaded_at = cutoff
+        self.load_seconds = time.perf_counter() - start
+        print(f"AnalyticsStore loaded {self.size} orders in {self.load_seconds:.2f}s "
+              f"({self.memory_report()['total_mb']} MB)")
+
+    def append(self, user_id: str, dish_id: str, timestamp: datetime, price: float = None, calories: float = None):
+        """Add one new order with its dish snapshot (called from /api/portal/order)."""
+        if self._loading:
+            self._pending.append((user_id, dish_id, timestamp, price, calories))
+            return
+        if not self.ready:
+            return
+        self._append_batch(
+            [self._intern(self.dish_ids, self.dish_index, str(dish_id))],
+            [self._intern(self.user_ids, self.user_index, str(user_id))],
+            [_epoch(timestamp)],
+            [_snapshot(price, calories)]
+        )
+
+    # --- Queries ---
+
+    def _ensure_sorted(self):
+        if not self.is_sorted:
+            order = np.argsort(self.columns["ts"][:self.size], kind="stable")
+            for name, column in self.columns.items():
+                column[:self.size] = column[:self.size][order]
+            self.is_sorted = True
+
+    def _since(self, days: int) -> slice:
+        """Rows from the start of the hour `days` days ago (same window as the rollups)."""
+        start = datetime.now(pytz.UTC) - timedelta(days=days)
+        return self._range(start, None)
+
+    def _range(self, start: Optional[datetime], end: Optional[datetime]) -> slice:
+        """Rows in [start, end), both rounded down to the hour like the rollup buckets."""
+        self._ensure_sorted()
+        ts = self.columns["ts"][:self.size]
+        lo = int(np.searchsorted(ts, _epoch(start) // 3600 * 3600)) if start else 0
+        hi = int(np.searchsorted(ts, _epoch(end) // 3600 * 3600)) if end else self.size
+        return slice(lo, max(lo, hi))
+
+    def _rows(self, days: Optional[int], start: Optional[datetime] = None, end: Optional[datetime] = None) -> slice:
+        """An explicit [start, end) if given, else the last `days` days (None = every row)."""
+        if start or end:
+            return self._range(start, end)
+        if days is None:
+            return slice(0, self.size)
+        return self._since(days)
+
+    def heatmap(self, days: int = 30, start: datetime = None, end: datetime = None) -> List[List[int]]:
+        rows = self._rows(days, start, end)
+        cells = self.columns["dow"][rows].astype(np.int64) * 24 + self.columns["hour"][rows]
+        counts = np.bincount(cells, minlength=7 * 24)
+        return [[int(c % 24), int(c // 24), int(counts[c])] for c in np.flatnonzero(counts)]
+
+    def sales_trend(self, days: int = 6, start: datetime = None, end: datetime = None) -> Dict:
+        rows = self._rows(days, start, end)
+        local_hours = (self.columns["ts"][rows] + LOCAL_OFFSET) // 3600
+        if len(local_hours) == 0:
+            return {"dates": [], "counts": []}
+        first = local_hours[0]
+        counts = np.bincount(local_hours - first)
+        hours = np.flatnonzero(counts)
+        labels = (hours + first).astype("datetime64[h]").astype(str)
+        return {
+            "dates": [f"{label[:10]} {label[11:13]}:00" for label in labels],
+            "counts": counts[hours].tolist()
+        }
+
+    def _daily(self, rows: slice, weights: np.ndarray, mask: np.ndarray = None):
+        days = (self.columns["ts"][rows] + LOCAL_OFFSET) // 86400
+        if mask is not None:
+            days, weights = days[mask], weights[mask]
+        if len(days) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+        first = days.min()
+        counts = np.bincount(days - first)
+        totals = np.bincount(days - first, weights=weights)
+        present = np.flatnonzero(counts)
+        return present + first, totals[present], counts[present]
+
+    @staticmethod
+    def _day_labels(days: np.ndarray) -> List[str]:
+        return days.astype("datetime64[D]").astype(str).tolist()
+
+    def revenue_trend(self, days: int = 29, start: datetime = None, end: datetime = None) -> Dict:
+        rows = self._rows(days, start, end)
+        day_numbers, totals, _ = self._daily(rows, self.columns["price"][rows].astype(np.float64))
+        return {"dates": self._day_labels(day_numbers), "values": totals.tolist()}
+
+    def calories_trend(self, days: int = 6, start: datetime = None, end: datetime = None) -> Dict:
+        rows = self._rows(days, start, end)
+        calories = self.columns["calories"][rows].astype(np.float64)
+        # Orders of dishes unknown at order time have no calories and stay out of the average
+        known = ~np.isnan(calories)
+        day_numbers, totals, counts = self._daily(rows, calories, known)
+        return {"dates": self._day_labels(day_numbers), "values": np.round(totals / counts, 0).tolist()}
+
+    def category_share(self, engine, start: datetime = None, end: datetime = None) -> List[Dict]:
+        rows = self._rows(None, start, end)
+        counts = np.bincount(self.columns["dish"][rows], minlength=len(self.dish_ids))
+        category_counts = {}
+        for did, count in zip(self.dish_ids, counts.tolist()):
+            if count == 0:
+                continue
+            dish = engine.dishes.get(did)
+            category = dish.get("category", "未知") if dish else "未知"
+            category_counts[category] = category_counts.get(category, 0) + count
+        data = [{"name": cat, "value": count} for cat, count in category_counts.items()]
+        data.sort(key=lambda x: x["value"], reverse=True)
+        return data
+
+    def memory_report(self) -> Dict:
+        column_bytes = {name: int(column.nbytes) for name, column in self.columns.items()}
+        used_bytes = {name: int(column[:self.size].nbytes) for name, column in self.columns.items()}
+        total = sum(column_bytes.values())
+        return {
+            "enabled": ANALYTICS_STORE_ENABLED,
+            "ready": self.ready,
+            "orders": self.size,
+            "capacity": len(self.columns["ts"]),
+            "dishes": len(self.dish_ids),
+            "users": len(self.user_ids),
+            "column_bytes": column_bytes,
+            "used_bytes": sum(used_bytes.values()),
+            "bytes_per_order": sum(np.dtype(dtype).itemsize for dtype in COLUMNS.values()),
+            "total_mb": round(total / 1024 / 1024, 2),
+            "loaded_at": self.loaded_at.isoformat() if self.loaded_at else None,
+            "load_seconds": round(self.load_seconds, 2),
+        }
+
+
+analytics_store = AnalyticsStore()
+
+
+async def start_analytics_store(db):
+    """Start the initial load in the background when the store is enabled."""
+    if ANALYTICS_STORE_ENABLED and analytics_store._task is None:
+        # Keep a reference: the event loop only holds tasks weakly
+        analytics_store._task = asyncio.create_task(analytics_store.load(db))
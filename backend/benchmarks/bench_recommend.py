@@ -0,0 +1,227 @@
+"""
+Micro-benchmarks for the recommendation hot path, fully offline.
+
+Synthetic catalogs are made from the seed.py dishes (breakfast items and main
+dishes, jittered price/calories, spread over a few canteens); synthetic
+histories follow the seed.py meal-time mix (breakfast 15%, lunch 45%,
+dinner 30%, snack 10%). For every catalog size x orders per user it times:
+
+    build         VectorEngine(dishes)
+    user_vector   calculate_user_vector(history)
+    scoring       relevance() over the lunch partitions
+    mmr           top_candidates() + mmr_select()
+    recommend     the full engine.recommend() call
+    collaborative CollaborativeEngine.score() (per catalog size only)
+
+and reports p50/p99/mean in ms plus the peak traced allocation (tracemalloc,
+measured in a separate run so it does not skew the timings).
+
+Usage (from the repo root):
+    python backend/benchmarks/bench_recommend.py
+    python backend/benchmarks/bench_recommend.py --dishes 50 5000 --orders 10 1000
+    python backend/benchmarks/bench_recommend.py --save                 # write the baseline
+    python backend/benchmarks/bench_recommend.py --compare              # diff against it
+
+--compare exits with status 1 when a p50 is more than --tolerance times
+its baseline value.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+from bson import ObjectId
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from seed import BREAKFAST_DISHES, MAIN_DISHES
+from vector_engine import VectorEngine
+from collaborative_engine import CollaborativeEngine
+from meal_periods import PERIOD_COURSES, TZ_SHANGHAI
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results", "baseline.json")
+CANTEENS = ["main", "east", "west", "north"]
+
+# (share, first hour, last hour, breakfast?) as in seed.py
+MEAL_MIX = [(0.15, 7, 9, True), (0.45, 11, 13, False), (0.30, 17, 19, False), (0.10, 14, 16, False)]
+
+
+# --- Synthetic data ---
+
+def make_catalog(n: int, rng: random.Random):
+    """n dishes shaped like the seed catalog: ~20% breakfast, the rest main dishes."""
+    dishes = []
+    for i in range(n):
+        template = rng.choice(BREAKFAST_DISHES) if rng.random() < 0.2 else rng.choice(MAIN_DISHES)
+        dishes.append({
+            "_id": ObjectId(),
+            "name": f"{template['name']}#{i}",
+            "category": template["category"],
+            "price": round(template["price"] * rng.uniform(0.8, 1.25), 1),
+            "calories": int(template["calories"] * rng.uniform(0.8, 1.25)),
+            "tags": list(template["tags"]),
+            "canteen": CANTEENS[i % min(len(CANTEENS), max(1, n // 50))],
+        })
+    return dishes
+
+
+def make_history(dishes, n_orders: int, rng: random.Random):
+    """Orders over the last 30 days, newest first like the recommend query."""
+    breakfast = [d for d in dishes if "早餐" in d["tags"]] or dishes
+    main = [d for d in dishes if "早餐" not in d["tags"]] or dishes
+    now_shanghai = datetime.now(TZ_SHANGHAI)
+    shares = [m[0] for m in MEAL_MIX]
+    orders = []
+    for _ in range(n_orders):
+        _, first, last, is_breakfast = rng.choices(MEAL_MIX, weights=shares)[0]
+        if is_breakfast:
+            pool = breakfast if rng.random() < 0.95 else main
+        else:
+            pool = main if rng.random() < 0.98 else breakfast
+        local = (now_shanghai - timedelta(days=rng.randint(1, 30))).replace(
+            hour=rng.randint(first, last), minute=rng.randint(0, 59), second=0, microsecond=0)
+        orders.append({"dish_id": rng.choice(pool)["_id"], "timestamp": local.astimezone(pytz.UTC)})
+    orders.sort(key=lambda o: o["timestamp"], reverse=True)
+    return orders
+
+
+def make_collaborative(dishes, n_users: int, orders_per_user: int, rng: random.Random):
+    """CollaborativeEngine over n_users synthetic users with orders_per_user orders each."""
+    engine = CollaborativeEngine()
+    n = len(dishes)
+    users = np.repeat(np.arange(n_users), orders_per_user)
+    # Each user favours a window of the catalog so neighbourhoods exist
+    centres = np.array([rng.randrange(n) for _ in range(n_users)])
+    spread = max(1, min(n, 40))
+    picks = (np.repeat(centres, orders_per_user) + np.random.default_rng(rng.randrange(1 << 30)).integers(0, spread, len(users))) % n
+    keys, counts = np.unique(users * n + picks, return_counts=True)
+    engine.user_ids = [str(ObjectId()) for _ in range(n_users)]
+    engine.user_index = {uid: i for i, uid in enumerate(engine.user_ids)}
+    engine.dish_ids = [str(d["_id"]) for d in dishes]
+    engine.dish_index = {did: i for i, did in enumerate(engine.dish_ids)}
+    engine.build(keys // n, keys % n, counts)
+    return engine
+
+
+# --- Measurement ---
+
+def measure(fn, repeat: int):
+    """Timings (ms) of repeat calls, then the peak allocation of one traced call."""
+    fn()  # warm-up
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "p50_ms": round(float(np.percentile(times, 50)), 4),
+        "p99_ms": round(float(np.percentile(times, 99)), 4),
+        "mean_ms": round(float(np.mean(times)), 4),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def bench_catalog(n_dishes: int, orders_grid, args, rng: random.Random):
+    dishes = make_catalog(n_dishes, rng)
+    results = {}
+    results[f"build/{n_dishes}"] = measure(lambda: VectorEngine(dishes), max(3, args.repeat // 10))
+
+    engine = VectorEngine(dishes)
+    ranges = engine.partition_ranges(None, PERIOD_COURSES["lunch"])
+    for n_orders in orders_grid:
+        history = make_history(dishes, n_orders, rng)
+        exclude = {str(o["dish_id"]) for o in history[:5]}
+        user_vector = engine.calculate_user_vector(history)
+        relevance = engine.relevance(user_vector, ranges)
+        mask = engine.exclude_mask(exclude, ranges)
+
+        def mmr():
+            candidates = engine._to_global(engine.top_candidates(relevance, mask), ranges)
+            return engine.mmr_select(candidates, user_vector, 8, 0.75)
+
+        key = f"{n_dishes}/{n_orders}"
+        results[f"user_vector/{key}"] = measure(lambda: engine.calculate_user_vector(history), args.repeat)
+        results[f"scoring/{key}"] = measure(lambda: engine.relevance(user_vector, ranges), args.repeat)
+        results[f"mmr/{key}"] = measure(mmr, args.repeat)
+        results[f"recommend/{key}"] = measure(
+            lambda: engine.recommend(user_vector, top_k=8, diversity_alpha=0.75, exclude_ids=exclude, ranges=ranges),
+            args.repeat)
+
+    cf = make_collaborative(dishes, args.cf_users, args.cf_orders, rng)
+    targets = [cf.user_ids[rng.randrange(len(cf.user_ids))] for _ in range(16)]
+    cycle = itertools.cycle(targets)
+    results[f"collaborative/{n_dishes}"] = measure(lambda: cf.score(next(cycle)), args.repeat)
+    return results
+
+
+def print_results(results, baseline=None):
+    print(f"{'benchmark':<34} | {'p50 ms':>10} | {'p99 ms':>10} | {'peak KB':>10} | vs baseline")
+    for name, r in results.items():
+        delta = ""
+        if baseline and name in baseline:
+            delta = f"{r['p50_ms'] / max(baseline[name]['p50_ms'], 1e-6):.2f}x"
+        print(f"{name:<34} | {r['p50_ms']:>10.3f} | {r['p99_ms']:>10.3f} | {r['peak_kb']:>10.1f} | {delta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dishes", type=int, nargs="+", default=[50, 5000, 100000])
+    parser.add_argument("--orders", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--cf-users", type=int, default=5000)
+    parser.add_argument("--cf-orders", type=int, default=50, help="Orders per user in the collaborative matrix")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="Compare against the baseline")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="Allowed p50 slowdown factor with --compare")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = {}
+    for n in args.dishes:
+        results.update(bench_catalog(n, args.orders, args, rng))
+
+    baseline = None
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "created_at": datetime.now(pytz.UTC).isoformat(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("save", "compare", "baseline")},
+                "results": results,
+            }, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+
+    if baseline:
+        regressions = [name for name, r in results.items()
+                       if name in baseline and r["p50_ms"] > baseline[name]["p50_ms"] * args.tolerance]
+        if regressions:
+            print(f"Regressions (> {args.tolerance}x p50): {', '.join(regressions)}")
+            raise SystemExit(1)
+        print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark the NumPy VectorEngine against the original pure-Python engine.
+
+Usage (from the repo root):
+    python backend/benchmarks/bench_vector_engine.py
+    python backend/benchmarks/bench_vector_engine.py --sizes 50 5000 --users 20
+
+For every catalog size it reports engine build time, time per recommend()
+call and how many users got the exact same recommendation list from both.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_engine import VectorEngine
+from benchmarks.legacy_vector_engine import LegacyVectorEngine
+
+CATEGORIES = ["川菜", "湘菜", "本帮菜", "粤菜", "江浙菜", "素菜", "轻食", "汤品", "面食", "饮品", "小吃", "荤菜", "热菜"]
+TAGS = ["辣", "微辣", "重辣", "甜", "酸甜", "咸", "咸鲜", "酸", "油炸", "海鲜", "清淡", "健康", "素食", "肉食", "早餐", "主食", "经典"]
+
+
+def make_dishes(n: int, rng: random.Random):
+    return [{
+        "_id": ObjectId(),
+        "name": f"dish_{i}",
+        "category": rng.choice(CATEGORIES),
+        "price": round(rng.uniform(1.5, 40.0), 1),
+        "calories": rng.randint(80, 800),
+        "tags": rng.sample(TAGS, rng.randint(1, 3)),
+    } for i in range(n)]
+
+
+def make_history(dishes, n_orders: int, rng: random.Random):
+    now = datetime.now(pytz.UTC)
+    return [{
+        "dish_id": rng.choice(dishes)["_id"],
+        "timestamp": now - timedelta(days=rng.randint(0, 30), hours=rng.randint(0, 23)),
+    } for _ in range(n_orders)]
+
+
+def timed(fn, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def bench_size(n_dishes: int, n_users: int, rng: random.Random):
+    dishes = make_dishes(n_dishes, rng)
+    histories = [make_history(dishes, 50, rng) for _ in range(n_users)]
+
+    legacy_build, legacy = timed(lambda: LegacyVectorEngine(dishes), 1)
+    numpy_build, engine = timed(lambda: VectorEngine(dishes), 1)
+
+    legacy_ms = numpy_ms = 0.0
+    matches = 0
+    for history in histories:
+        exclude = {str(o["dish_id"]) for o in history[:5]}
+
+        u_legacy = legacy.calculate_user_vector(history)
+        u_numpy = engine.calculate_user_vector(history)
+
+        ms, expected = timed(lambda: legacy.recommend(u_legacy, top_k=8, diversity_alpha=0.75, exclude_ids=exclude), 1)
+        legacy_ms += ms
+        ms, got = timed(lambda: engine.recommend(u_numpy, top_k=8, diversity_alpha=0.75, exclude_ids=exclude), 5)
+        numpy_ms += ms
+
+        if [str(d["_id"]) for d in expected] == [str(d["_id"]) for d in got]:
+            matches += 1
+
+    legacy_ms /= n_users
+    numpy_ms /= n_users
+    print(f"{n_dishes:>8} | {legacy_build:>10.1f} | {numpy_build:>10.1f} | "
+          f"{legacy_ms:>11.3f} | {numpy_ms:>10.3f} | {legacy_ms / numpy_ms:>7.1f}x | {matches}/{n_users}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 5000, 100000])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'dishes':>8} | {'build py':>10} | {'build np':>10} | "
+          f"{'recommend py':>11} | {'recommend np':>10} | {'speedup':>8} | same result")
+    print("         |       (ms) |       (ms) |   (ms/call) |  (ms/call) |          |")
+    for n in args.sizes:
+        bench_size(n, args.users, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pytz
+
+from logs_storage import LOGS_COLLECTION
+
+
+class CollaborativeEngine:
+    """
+    In-memory user x dish order-count matrix for collaborative filtering.
+
+    - Rows (user -> dishes) are stored CSR-style: indptr / indices / data.
+    - Columns (dish -> users) are an inverted index in the same layout, so
+      scoring only touches users who share at least one dish with the target.
+    - New orders go into small pending row/column buffers and are folded
+      into the compressed arrays once enough of them pile up.
+    """
+
+    # Neighbours whose dishes are aggregated into the score
+    TOP_NEIGHBOURS = 20
+
+    # Pending (user, dish) pairs tolerated before re-compressing
+    COMPACT_THRESHOLD = 100000
+
+    def __init__(self):
+        self.user_ids: List[str] = []
+        self.user_index: Dict[str, int] = {}
+        self.dish_ids: List[str] = []
+        self.dish_index: Dict[str, int] = {}
+
+        # CSR rows: dishes of user u are indices[indptr[u]:indptr[u+1]]
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.data = np.zeros(0, dtype=np.int32)
+
+        # Inverted index: users of dish d are col_users[col_indptr[d]:col_indptr[d+1]]
+        self.col_indptr = np.zeros(1, dtype=np.int64)
+        self.col_users = np.zeros(0, dtype=np.int32)
+
+        # Distinct dishes per user, including pending pairs (Jaccard denominator)
+        self.row_nnz = np.zeros(0, dtype=np.int32)
+
+        # Orders received since the last compaction
+        self.pending_rows: Dict[int, Dict[int, int]] = {}
+        self.pending_cols: Dict[int, List[int]] = {}
+        self.pending_pairs = 0
+
+        self.order_count = 0
+        self.built_at: Optional[datetime] = None
+
+    # --- Building ---
+
+    def _intern(self, ids: List[str], index: Dict[str, int], key: str) -> int:
+        pos = index.get(key)
+        if pos is None:
+            pos = len(ids)
+            index[key] = pos
+            ids.append(key)
+        return pos
+
+    def build(self, users: np.ndarray, dishes: np.ndarray, counts: np.ndarray):
+        """(Re)build the compressed arrays from parallel (user, dish, count) arrays."""
+        n_users, n_dishes = len(self.user_ids), len(self.dish_ids)
+        users = np.asarray(users, dtype=np.int32)
+        dishes = np.asarray(dishes, dtype=np.int32)
+        counts = np.asarray(counts, dtype=np.int32)
+
+        order = np.lexsort((dishes, users))
+        users, dishes, counts = users[order], dishes[order], counts[order]
+        self.indptr = np.zeros(n_users + 1, dtype=np.int64)
+        np.cumsum(np.bincount(users, minlength=n_users), out=self.indptr[1:])
+        self.indices = dishes
+        self.data = counts
+
+        order = np.lexsort((users, dishes))
+        self.col_indptr = np.zeros(n_dishes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(dishes, minlength=n_dishes), out=self.col_indptr[1:])
+        self.col_users = users[order]
+
+        self.row_nnz = np.diff(self.indptr).astype(np.int32)
+        self.order_count = int(counts.sum())
+        self.pending_rows = {}
+        self.pending_cols = {}
+        self.pending_pairs = 0
+        self.built_at = datetime.now(pytz.UTC)
+
+    async def load(self, db, before: datetime = None):
+        """Load (user, dish, count) pairs from every order in logs_behavior (placed before `before`)."""
+        match = {"action": "order"}
+        if before is not None:
+            match["timestamp"] = {"$lt": before}
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {"user_id": "$user_id", "dish_id": "$dish_id"},
+                "count": {"$sum": 1}
+            }}
+        ]
+        users, dishes, counts = [], [], []
+        async for pair in db[LOGS_COLLECTION].aggregate(pipeline, allowDiskUse=True):
+            users.append(self._intern(self.user_ids, self.user_index, str(pair["_id"]["user_id"])))
+            dishes.append(self._intern(self.dish_ids, self.dish_index, str(pair["_id"]["dish_id"])))
+            counts.append(pair["count"])
+        self.build(users, dishes, counts)
+
+    def compact(self):
+        """Fold pending orders into the compressed arrays."""
+        n_base = len(self.indptr) - 1
+        base_users = np.repeat(np.arange(n_base, dtype=np.int32), np.diff(self.indptr))
+        users = [base_users]
+        dishes = [self.indices]
+        counts = [self.data]
+        for u, row in self.pending_rows.items():
+            users.append(np.full(len(row), u, dtype=np.int32))
+            dishes.append(np.fromiter(row.keys(), dtype=np.int32, count=len(row)))
+            counts.append(np.fromiter(row.values(), dtype=np.int32, count=len(row)))
+
+        # Pending counts for pairs that already exist are merged by summing duplicates
+        users, dishes, counts = np.concatenate(users), np.concatenate(dishes), np.concatenate(counts)
+        n_dishes = max(len(self.dish_ids), 1)
+        keys = users.astype(np.int64) * n_dishes + dishes
+        unique, inverse = np.unique(keys, return_inverse=True)
+        merged = np.bincount(inverse, weights=counts).astype(np.int32)
+        self.build(unique // n_dishes, unique % n_dishes, merged)
+
+    # --- Incremental updates ---
+
+    def _in_base_row(self, u: int, d: int) -> bool:
+        if u >= len(self.indptr) - 1:
+            return False
+        row = self.indices[self.indptr[u]:self.indptr[u + 1]]
+        pos = np.searchsorted(row, d)
+        return pos < len(row) and row[pos] == d
+
+    def add_order(self, user_id: str, dish_id: str):
+        u = self._intern(self.user_ids, self.user_index, str(user_id))
+        d = self._intern(self.dish_ids, self.dish_index, str(dish_id))
+        if u >= len(self.row_nnz):
+            self.row_nnz = np.concatenate([self.row_nnz, np.zeros(u + 1 - len(self.row_nnz), dtype=np.int32)])
+
+        pending = self.pending_rows.setdefault(u, {})
+        if d not in pending and not self._in_base_row(u, d):
+            # A new (user, dish) pair: the user joins the dish's inverted list
+            self.pending_cols.setdefault(d, []).append(u)
+            self.row_nnz[u] += 1
+            self.pending_pairs += 1
+        pending[d] = pending.get(d, 0) + 1
+        self.order_count += 1
+
+        if self.pending_pairs >= self.COMPACT_THRESHOLD:
+            self.compact()
+
+    # --- Scoring ---
+
+    def user_row(self, u: int) -> Dict[int, int]:
+        """Dish -> order count for one user, base plus pending."""
+        row = {}
+        if u < len(self.indptr) - 1:
+            start, end = self.indptr[u], self.indptr[u + 1]
+            row = dict(zip(self.indices[start:end].tolist(), self.data[start:end].tolist()))
+        for d, c in self.pending_rows.get(u, {}).items():
+            row[d] = row.get(d, 0) + c
+        return row
+
+    def _dish_users(self, d: int) -> List[np.ndarray]:
+        parts = []
+        if d < len(self.col_indptr) - 1:
+            parts.append(self.col_users[self.col_indptr[d]:self.col_indptr[d + 1]])
+        if d in self.pending_cols:
+            parts.append(np.asarray(self.pending_cols[d], dtype=np.int32))
+        return parts
+
+    def neighbours(self, u: int, target_dishes: List[int], metric: str = "jaccard", top_n: int = None):
+        """
+        Exact top-N most similar users by dish set, over every user who
+        shares at least one dish. Returns (user indices, similarities).
+        """
+        top_n = top_n or self.TOP_NEIGHBOURS
+        n_users = len(self.user_ids)
+        parts = [p for d in target_dishes for p in self._dish_users(d)]
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        # |T ∩ R_v| for every user v in one pass over the touched columns
+        intersection = np.bincount(np.concatenate(parts), minlength=n_users)
+        intersection[u] = 0
+        candidates = np.flatnonzero(intersection)
+        if len(candidates) == 0:
+            return candidates, np.zeros(0)
+
+        inter = intersection[candidates].astype(np.float64)
+        other = self.row_nnz[candidates].astype(np.float64)
+        if metric == "cosine":
+            sims = inter / np.sqrt(len(target_dishes) * other)
+        else:
+            sims = inter / (len(target_dishes) + other - inter)
+
+        if len(candidates) > top_n:
+            # Partial selection; ties at the cut-off go to the earliest users
+            cutoff = -np.partition(-sims, top_n - 1)[top_n - 1]
+            above = np.flatnonzero(sims > cutoff)
+            ties = np.flatnonzero(sims == cutoff)[:top_n - len(above)]
+            top = np.concatenate([above, ties])
+            candidates, sims = candidates[top], sims[top]
+        order = np.lexsort((candidates, -sims))
+        return candidates[order], sims[order]
+
+    def score(self, user_id: str, metric: str = "jaccard") -> Dict[str, float]:
+        """
+        Collaborative filtering scores {dish_id: 0-1} for dishes the user has
+        not ordered yet, weighted by neighbour similarity and order counts.
+        """
+        u = self.user_index.get(str(user_id))
+        if u is None:
+            return {}
+        target = self.user_row(u)
+        if not target:
+            return {}
+
+        target_dishes = list(target.keys())
+        neighbours, sims = self.neighbours(u, target_dishes, metric)
+
+        scores = np.zeros(len(self.dish_ids), dtype=np.float64)
+        for v, sim in zip(neighbours.tolist(), sims.tolist()):
+            row = self.user_row(v)
+            dishes = np.fromiter(row.keys(), dtype=np.int64, count=len(row))
+            counts = np.fromiter(row.values(), dtype=np.float64, count=len(row))
+            scores[dishes] += sim * counts
+        scores[target_dishes] = 0.0
+
+        # Normalize scores to 0-1 range
+        max_score = scores.max() if len(scores) else 0.0
+        if max_score <= 0:
+            return {}
+        hits = np.flatnonzero(scores)
+        return {self.dish_ids[d]: float(scores[d] / max_score) for d in hits}
+
+    def stats(self) -> Dict:
+        memory = sum(a.nbytes for a in (self.indptr, self.indices, self.data, self.col_indptr, self.col_users, self.row_nnz))
+        return {
+            "users": len(self.user_ids),
+            "dishes": len(self.dish_ids),
+            "pairs": int(len(self.indices)) + self.pending_pairs,
+            "orders": self.order_count,
+            "pending_pairs": self.pending_pairs,
+            "array_mb": round(memory / 1024 / 1024, 2),
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+        }
+
+
+class CollaborativeManager:
+    """
+    Loads the CollaborativeEngine lazily and keeps it current.
+    A catalog version change (e.g. a re-seed) triggers a full reload.
+    Orders placed while a load runs are buffered and added once it finishes.
+    """
+
+    def __init__(self):
+        self.engine: Optional[CollaborativeEngine] = None
+        self.catalog_version: Optional[int] = None
+        self.load_seconds = 0.0
+        self._lock = asyncio.Lock()
+        # Orders placed while a load is running
+        self._pending: List[tuple] = []
+        self._loading = False
+
+    async def get(self, db, catalog_version: int = None) -> CollaborativeEngine:
+        if self.engine is None or catalog_version != self.catalog_version:
+            async with self._lock:
+                if self.engine is None or catalog_version != self.catalog_version:
+                    start = time.perf_counter()
+                    # Milliseconds, like the timestamps MongoDB stores
+                    cutoff = datetime.now(pytz.UTC)
+                    cutoff = cutoff.replace(microsecond=cutoff.microsecond // 1000 * 1000)
+                    engine = CollaborativeEngine()
+                    self._loading = True
+                    try:
+                        await engine.load(db, before=cutoff)
+                    finally:
+                        self._loading = False
+                        pending, self._pending = self._pending, []
+                    # Orders before the cutoff are already in the loaded pairs
+                    for user_id, dish_id, timestamp in pending:
+                        if timestamp >= cutoff:
+                            engine.add_order(user_id, dish_id)
+                    self.engine = engine
+                    self.catalog_version = catalog_version
+                    self.load_seconds = time.perf_counter() - start
+                    print(f"CollaborativeEngine loaded: {engine.stats()} in {self.load_seconds:.2f}s")
+        return self.engine
+
+    def record_order(self, user_id: str, dish_id: str, timestamp: datetime):
+        # Before the first load there is nothing to update: the load reads this order from the logs
+        if self._loading:
+            self._pending.append((user_id, dish_id, timestamp))
+        if self.engine is not None:
+            self.engine.add_order(user_id, dish_id)
+
+    def invalidate(self):
+        """Drop the matrix (e.g. after logs were deleted); reloaded on next use."""
+        self.engine = None
+
+
+cf_manager = CollaborativeManager()
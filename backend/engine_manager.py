@@ -0,0 +1,127 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Optional
+
+import pytz
+
+from vector_engine import VectorEngine
+
+# Redis key holding the catalog version. Anything that writes to `dishes`
+# (seed.py, admin tools) must bump it so running workers swap their engine.
+CATALOG_VERSION_KEY = "catalog:version"
+
+# How often (seconds) a request is allowed to poll Redis for a new version
+CATALOG_CHECK_INTERVAL = 5.0
+
+
+async def bump_catalog_version(redis) -> Optional[int]:
+    """
+    Mark the dish catalog as changed. Returns the new version.
+    Versions are millisecond timestamps rather than a counter so that a
+    FLUSHALL followed by a re-seed can never reproduce an old version.
+    """
+    if not redis:
+        return None
+    try:
+        version = int(time.time() * 1000)
+        await redis.set(CATALOG_VERSION_KEY, version)
+        return version
+    except Exception as e:
+        print(f"Redis Error while bumping catalog version: {e}")
+        return None
+
+
+class EngineManager:
+    """
+    Holds one long-lived VectorEngine per process.
+
+    The engine is built at startup and only rebuilt when the catalog version
+    in Redis changes (or on an explicit rebuild). The new engine is fully
+    constructed before the reference is swapped, so requests always see a
+    complete engine and never block on a rebuild they don't need.
+    """
+
+    def __init__(self):
+        self.engine: Optional[VectorEngine] = None
+        self.catalog_version: int = 0
+        self.generation: int = 0  # Number of builds in this process
+        self.built_at: Optional[datetime] = None
+        self.build_seconds: float = 0.0
+        self._last_check = 0.0
+        self._lock = asyncio.Lock()
+
+    async def _read_version(self, redis) -> int:
+        if not redis:
+            return self.catalog_version
+        try:
+            value = await redis.get(CATALOG_VERSION_KEY)
+            return int(value) if value else 0
+        except Exception as e:
+            print(f"Redis Error while reading catalog version: {e}")
+            return self.catalog_version
+
+    async def rebuild(self, db, redis, version: Optional[int] = None, force: bool = True) -> VectorEngine:
+        """Load the catalog and atomically swap in a fresh engine."""
+        async with self._lock:
+            if version is None:
+                version = await self._read_version(redis)
+            if not force and self.engine is not None and version == self.catalog_version:
+                # Someone else rebuilt while we were waiting for the lock
+                return self.engine
+
+            start = time.perf_counter()
+            # Stream the whole catalog; there is no cap on the number of dishes
+            all_dishes = [dish async for dish in db.dishes.find()]
+            engine = VectorEngine(all_dishes)
+            engine.catalog_version = version
+
+            # Swap
+            self.engine = engine
+            self.catalog_version = version
+            self.generation += 1
+            self.built_at = datetime.now(pytz.UTC)
+            self.build_seconds = time.perf_counter() - start
+            self._last_check = time.monotonic()
+
+            print(f"VectorEngine built: catalog v{version}, {len(all_dishes)} dishes "
+                  f"in {self.build_seconds * 1000:.1f} ms")
+            return engine
+
+    async def get_engine(self, db, redis) -> VectorEngine:
+        """
+        Return the current engine, rebuilding it first if the catalog
+        version has moved since the last build.
+        """
+        if self.engine is None:
+            return await self.rebuild(db, redis, force=False)
+
+        now = time.monotonic()
+        if now - self._last_check >= CATALOG_CHECK_INTERVAL:
+            self._last_check = now
+            version = await self._read_version(redis)
+            if version != self.catalog_version:
+                return await self.rebuild(db, redis, version, force=False)
+
+        return self.engine
+
+    def status(self) -> dict:
+        return {
+            "catalog_version": self.catalog_version,
+            "generation": self.generation,
+            "built_at": self.built_at.isoformat() if self.built_at else None,
+            "build_ms": round(self.build_seconds * 1000, 2),
+            "dish_count": len(self.engine.dishes) if self.engine else 0,
+            "partitions": {
+                f"{canteen}/{course}": end - start
+                for (canteen, course), (start, end) in self.engine.partitions.items()
+            } if self.engine else {},
+        }
+
+
+engine_manager = EngineManager()
+
+
+async def get_engine() -> VectorEngine:
+    from database import db
+    return await engine_manager.get_engine(db.db, db.redis_client)
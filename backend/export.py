@@ -0,0 +1,244 @@
+"""
+Streaming export of logs_behavior for the data team.
+
+Logs in [start, end) are read with a batched cursor and encoded one batch at
+a time, so memory stays at roughly one batch regardless of the range size.
+The HTTP endpoint (/api/admin/export/logs) hands the generator to a
+StreamingResponse: the next batch is only fetched once the client has taken
+the previous chunk, so a slow reader throttles the cursor instead of
+buffering rows. Dish names / categories come from the in-memory catalog map;
+price and calories come from the log's own snapshot (order_logs.py) when it
+has one.
+
+Formats: csv, ndjson, parquet (parquet needs the optional pyarrow package).
+
+Usage:
+    python backend/export.py --start 2024-05-01 --end 2024-06-01 --format csv --output logs.csv
+    python backend/export.py --start 2024-05-01 --format ndjson --output - | gzip > logs.ndjson.gz
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import sys
+import time
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+import pytz
+
+from logs_storage import LOGS_COLLECTION
+from meal_periods import TZ_SHANGHAI
+
+# Logs fetched per cursor batch and encoded per output chunk
+EXPORT_BATCH_SIZE = 5000
+
+EXPORT_FIELDS = [
+    "timestamp", "user_id", "dish_id", "dish_name", "category", "price", "calories",
+    "action", "local_date", "local_hour", "dow",
+]
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def parse_time(value: Optional[str]) -> Optional[datetime]:
+    """ISO date or datetime; values without a timezone are Shanghai local time."""
+    if not value:
+        return None
+    ts = datetime.fromisoformat(value)
+    if ts.tzinfo is None:
+        ts = TZ_SHANGHAI.localize(ts)
+    return ts.astimezone(pytz.UTC)
+
+
+def catalog_map(dishes: Dict[str, Dict]) -> Dict[str, Dict]:
+    """dish_id -> the few fields the export needs, from a {dish_id: dish} catalog."""
+    return {
+        did: {"name": d.get("name"), "category": d.get("category"),
+              "price": d.get("price"), "calories": d.get("calories")}
+        for did, d in dishes.items()
+    }
+
+
+async def load_catalog(db) -> Dict[str, Dict]:
+    return catalog_map({str(d["_id"]): d async for d in db.dishes.find()})
+
+
+async def log_batches(db, catalog: Dict[str, Dict], start: Optional[datetime] = None,
+                      end: Optional[datetime] = None, action: Optional[str] = "order",
+                      batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[Dict]]:
+    """Yield export rows in lists of at most batch_size, oldest first."""
+    query = {}
+    if action:
+        query["action"] = action
+    if start or end:
+        query["timestamp"] = {}
+        if start:
+            query["timestamp"]["$gte"] = start
+        if end:
+            query["timestamp"]["$lt"] = end
+    cursor = db[LOGS_COLLECTION].find(query).sort("timestamp", 1).batch_size(batch_size)
+
+    batch = []
+    async for log in cursor:
+        dish_id = str(log["dish_id"])
+        dish = catalog.get(dish_id, {})
+        ts = log["timestamp"]
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=pytz.UTC)
+        price = log.get("price")
+        calories = log.get("calories")
+        batch.append({
+            "timestamp": ts,
+            "user_id": str(log["user_id"]),
+            "dish_id": dish_id,
+            "dish_name": dish.get("name"),
+            "category": log.get("category") or dish.get("category"),
+            "price": price if price is not None else dish.get("price"),
+            "calories": calories if calories is not None else dish.get("calories"),
+            "action": log.get("action"),
+            "local_date": log.get("local_date"),
+            "local_hour": log.get("local_hour"),
+            "dow": log.get("dow"),
+        })
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def encode_csv(batches: AsyncIterator[List[Dict]]) -> AsyncIterator[bytes]:
+    # BOM so Excel opens the Chinese dish names correctly
+    yield ("\ufeff" + ",".join(EXPORT_FIELDS) + "\r\n").encode("utf-8")
+    async for batch in batches:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in batch:
+            writer.writerow([
+                row["timestamp"].isoformat() if field == "timestamp" else ("" if row[field] is None else row[field])
+                for field in EXPORT_FIELDS
+            ])
+        yield buffer.getvalue().encode("utf-8")
+
+
+async def encode_ndjson(batches: AsyncIterator[List[Dict]]) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        lines = [json.dumps({**row, "timestamp": row["timestamp"].isoformat()}, ensure_ascii=False) for row in batch]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object whose contents are drained after every row group."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+async def encode_parquet(batches: AsyncIterator[List[Dict]]) -> AsyncIterator[bytes]:
+    """One Parquet row group per batch; only the current row group is held in memory."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("timestamp", pa.timestamp("ms", tz="UTC")),
+        ("user_id", pa.string()), ("dish_id", pa.string()),
+        ("dish_name", pa.string()), ("category", pa.string()),
+        ("price", pa.float64()), ("calories", pa.int64()),
+        ("action", pa.string()), ("local_date", pa.string()),
+        ("local_hour", pa.int8()), ("dow", pa.int8()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        async for batch in batches:
+            columns = {field: [row[field] for row in batch] for field in EXPORT_FIELDS}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson, "parquet": encode_parquet}
+
+
+def export_stream(db, catalog: Dict[str, Dict], fmt: str, start: Optional[datetime] = None,
+                  end: Optional[datetime] = None, action: Optional[str] = "order",
+                  batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    """Encoded chunks of the export, one per cursor batch."""
+    return ENCODERS[fmt](log_batches(db, catalog, start, end, action, batch_size))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Stream logs_behavior to CSV / NDJSON / Parquet")
+    parser.add_argument("--start", help="Inclusive start (ISO date/datetime, Shanghai time unless offset given)")
+    parser.add_argument("--end", help="Exclusive end")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--action", default="order", help="Only this action ('' for all)")
+    parser.add_argument("--output", default="-", help="Output file, '-' for stdout")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.format == "parquet" and not parquet_available():
+        parser.error("Parquet export needs pyarrow (pip install pyarrow)")
+
+    import resource  # POSIX only; just for the peak RSS report
+    from database import db as database_instance
+
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    # With --output - stdout is the export itself: every print (the connect messages too) goes to stderr
+    with contextlib.redirect_stdout(sys.stderr):
+        await database_instance.connect_db()
+        try:
+            start_time = time.time()
+            written = 0
+            catalog = await load_catalog(database_instance.db)
+            stream = export_stream(database_instance.db, catalog, args.format, parse_time(args.start),
+                                   parse_time(args.end), args.action or None, args.batch_size)
+            async for chunk in stream:
+                out.write(chunk)
+                written += len(chunk)
+            out.flush()
+            peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(f"Exported {written / 1024 / 1024:.1f} MB in {time.time() - start_time:.2f} seconds "
+                  f"(peak RSS {peak_mb:.0f} MB)")
+        finally:
+            if args.output != "-":
+                out.close()
+            await database_instance.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
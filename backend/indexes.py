@@ -0,0 +1,84 @@
+"""
+Declarative MongoDB indexes, ensured at startup (main.py) and by the CLIs
+that bulk-write (rollups rebuild, seed).
+
+Each entry maps a collection to the IndexModels it must have. create_indexes
+is idempotent, so ensuring them on every start is cheap once they exist.
+Add a new query shape here together with its entry in query_plans.py, which
+checks that every router query is served by one of these indexes.
+
+Usage:
+    python backend/indexes.py           # create missing indexes
+    python backend/indexes.py --list    # show the indexes present per collection
+"""
+import argparse
+import asyncio
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from item_similarity import NEIGHBOR_COLLECTION
+from logs_storage import LOGS_COLLECTION, ensure_logs_collection
+from materialize import MATERIALIZED_COLLECTION
+from rollups import ROLLUP_COLLECTION
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    LOGS_COLLECTION: [
+        # Per-user history, cooldowns ($in users + time range), clear history
+        IndexModel([("user_id", ASCENDING), ("action", ASCENDING), ("timestamp", DESCENDING)]),
+        # Time-window matches (traffic, popularity, active users, analytics store load)
+        IndexModel([("action", ASCENDING), ("timestamp", ASCENDING)]),
+        # Per-dish counts: the $group on dish_id is answered from the index alone
+        IndexModel([("action", ASCENDING), ("dish_id", ASCENDING)]),
+    ],
+    "users": [
+        IndexModel([("username", ASCENDING)]),
+    ],
+    ROLLUP_COLLECTION: [
+        IndexModel([("hour_start", ASCENDING), ("dish_id", ASCENDING)], unique=True),
+    ],
+    MATERIALIZED_COLLECTION: [
+        IndexModel([("computed_at", ASCENDING)]),
+    ],
+    NEIGHBOR_COLLECTION: [
+        IndexModel([("built_at", ASCENDING)]),
+    ],
+}
+
+
+async def ensure_indexes(db, collections: List[str] = None):
+    """Create every declared index that does not exist yet."""
+    # Must exist as a time-series collection before create_indexes would create it plain
+    await ensure_logs_collection(db)
+    for name, models in INDEXES.items():
+        if collections is None or name in collections:
+            await db[name].create_indexes(models)
+
+
+async def ensure_collection_indexes(collection, name: str):
+    """Create the indexes declared for `name` on another collection (e.g. a rebuild scratch copy)."""
+    await collection.create_indexes(INDEXES[name])
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Create the declared MongoDB indexes")
+    parser.add_argument("--list", action="store_true", help="Only list existing indexes")
+    args = parser.parse_args()
+
+    from database import db as database_instance
+
+    await database_instance.connect_db()
+    try:
+        db = database_instance.db
+        if not args.list:
+            await ensure_indexes(db)
+            print(f"Ensured indexes on {len(INDEXES)} collections")
+        for name in INDEXES:
+            info = await db[name].index_information()
+            print(f"{name}: {', '.join(sorted(info))}")
+    finally:
+        await database_instance.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,191 @@
+"""
+Dish-to-dish co-occurrence similarity ("people also ordered").
+
+Two dishes co-occur when the same user ordered both within the same meal
+(same Shanghai-local date and meal period). Similarity is the cosine of the
+co-occurrence count: c_ij / sqrt(n_i * n_j), where n_i is the number of
+meals containing dish i. Only the top-N neighbours of each dish are kept,
+one small document per dish in `dish_neighbors`, and the API answers from
+an in-memory dict built from that collection.
+
+Usage:
+    python backend/item_similarity.py          # rebuild dish_neighbors
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pytz
+from pymongo import ReplaceOne
+
+from logs_storage import LOGS_COLLECTION
+from order_logs import LOCAL_DATE_EXPR, LOCAL_HOUR_EXPR
+
+NEIGHBOR_COLLECTION = "dish_neighbors"
+TOP_NEIGHBORS = 20
+
+# Pair codes buffered before they are reduced with np.unique
+PAIR_BUFFER_SIZE = 1000000
+
+# In-process copies are refreshed from MongoDB at most this often (seconds)
+RELOAD_INTERVAL = 3600
+
+# Mirrors meal_periods.meal_period, evaluated inside the aggregation
+MEAL_PERIOD_EXPR = {
+    "$switch": {
+        "branches": [
+            {"case": {"$and": [{"$gte": ["$$hour", 6]}, {"$lt": ["$$hour", 10]}]}, "then": "breakfast"},
+            {"case": {"$and": [{"$gte": ["$$hour", 10]}, {"$lt": ["$$hour", 14]}]}, "then": "lunch"},
+            {"case": {"$and": [{"$gte": ["$$hour", 17]}, {"$lt": ["$$hour", 21]}]}, "then": "dinner"},
+        ],
+        "default": "other"
+    }
+}
+
+
+def _reduce_pairs(codes: np.ndarray, counts: np.ndarray):
+    unique, inverse = np.unique(codes, return_inverse=True)
+    return unique, np.bincount(inverse, weights=counts).astype(np.int64)
+
+
+async def build_neighbors(db, top_n: int = TOP_NEIGHBORS) -> int:
+    """Recompute dish_neighbors from logs_behavior. Returns the number of dishes written."""
+    pipeline = [
+        {"$match": {"action": "order"}},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "date": LOCAL_DATE_EXPR,
+                "period": {"$let": {
+                    "vars": {"hour": LOCAL_HOUR_EXPR},
+                    "in": MEAL_PERIOD_EXPR
+                }}
+            },
+            "dishes": {"$addToSet": "$dish_id"}
+        }},
+        {"$project": {"_id": 0, "dishes": 1}}
+    ]
+
+    dish_ids: List = []
+    dish_index: Dict = {}
+    meal_counts: List[int] = []
+    pair_codes = np.zeros(0, dtype=np.int64)
+    pair_counts = np.zeros(0, dtype=np.int64)
+    buffer: List[int] = []
+
+    # Codes are i * MAX_DISHES + j with i < j; 2**31 dishes is plenty
+    MAX_DISHES = 1 << 31
+
+    async for meal in db[LOGS_COLLECTION].aggregate(pipeline, allowDiskUse=True):
+        rows = []
+        for did in meal["dishes"]:
+            idx = dish_index.get(did)
+            if idx is None:
+                idx = dish_index[did] = len(dish_ids)
+                dish_ids.append(did)
+                meal_counts.append(0)
+            meal_counts[idx] += 1
+            rows.append(idx)
+        if len(rows) < 2:
+            continue
+        rows.sort()
+        for a in range(len(rows)):
+            for b in range(a + 1, len(rows)):
+                buffer.append(rows[a] * MAX_DISHES + rows[b])
+        if len(buffer) >= PAIR_BUFFER_SIZE:
+            pair_codes, pair_counts = _reduce_pairs(
+                np.concatenate([pair_codes, np.asarray(buffer, dtype=np.int64)]),
+                np.concatenate([pair_counts, np.ones(len(buffer), dtype=np.int64)])
+            )
+            buffer = []
+
+    pair_codes, pair_counts = _reduce_pairs(
+        np.concatenate([pair_codes, np.asarray(buffer, dtype=np.int64)]),
+        np.concatenate([pair_counts, np.ones(len(buffer), dtype=np.int64)])
+    )
+
+    # Both directions of every pair, then cosine normalization
+    first, second = pair_codes // MAX_DISHES, pair_codes % MAX_DISHES
+    src = np.concatenate([first, second])
+    dst = np.concatenate([second, first])
+    co = np.concatenate([pair_counts, pair_counts])
+    n = np.asarray(meal_counts, dtype=np.float64)
+    sim = co / np.sqrt(n[src] * n[dst]) if len(co) else np.zeros(0)
+
+    # Group by source dish, best first
+    order = np.lexsort((-co, -sim, src))
+    src, dst, co, sim = src[order], dst[order], co[order], sim[order]
+    bounds = np.searchsorted(src, np.arange(len(dish_ids) + 1))
+
+    built_at = datetime.now(pytz.UTC)
+    ops = []
+    for i, did in enumerate(dish_ids):
+        start, end = bounds[i], min(bounds[i + 1], bounds[i] + top_n)
+        ops.append(ReplaceOne({"_id": did}, {
+            "_id": did,
+            "neighbors": [
+                {"dish_id": dish_ids[j], "score": round(float(s), 6), "count": int(c)}
+                for j, s, c in zip(dst[start:end].tolist(), sim[start:end].tolist(), co[start:end].tolist())
+            ],
+            "meal_count": meal_counts[i],
+            "built_at": built_at
+        }, upsert=True))
+
+    for start in range(0, len(ops), 1000):
+        await db[NEIGHBOR_COLLECTION].bulk_write(ops[start:start + 1000], ordered=False)
+    # Dishes that no longer appear in any order
+    await db[NEIGHBOR_COLLECTION].delete_many({"built_at": {"$lt": built_at}})
+    return len(ops)
+
+
+class SimilarityIndex:
+    """dish_id -> precomputed neighbour list, held in memory for O(1) lookups."""
+
+    def __init__(self):
+        self.neighbors: Dict[str, List[Dict]] = {}
+        self.loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    async def load(self, db):
+        neighbors = {}
+        async for doc in db[NEIGHBOR_COLLECTION].find():
+            neighbors[str(doc["_id"])] = [
+                {"dish_id": str(n["dish_id"]), "score": n["score"], "count": n["count"]}
+                for n in doc["neighbors"]
+            ]
+        self.neighbors = neighbors
+        self.loaded_at = time.monotonic()
+
+    async def get(self, db, dish_id: str) -> List[Dict]:
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > RELOAD_INTERVAL:
+            async with self._lock:
+                if self.loaded_at is None or time.monotonic() - self.loaded_at > RELOAD_INTERVAL:
+                    await self.load(db)
+        return self.neighbors.get(dish_id, [])
+
+    async def rebuild(self, db) -> int:
+        """Run the batch job in-process and swap in the result."""
+        count = await build_neighbors(db)
+        await self.load(db)
+        return count
+
+
+similarity_index = SimilarityIndex()
+
+
+async def main():
+    from database import db as database_instance
+
+    await database_instance.connect_db()
+    try:
+        start = time.time()
+        count = await build_neighbors(database_instance.db)
+        print(f"Built neighbours for {count} dishes in {time.time() - start:.2f} seconds")
+    finally:
+        await database_instance.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,214 @@
+"""
+Live push channel for the admin dashboard and the portal crowd meter.
+
+/api/portal/order keeps a few Redis counters current and publishes the
+order on LIVE_CHANNEL:
+
+    live:minute:{epoch_minute}          orders per UTC minute (kept 2 hours)
+    live:hour:{local_date}:{hour}       orders per Shanghai-local hour (kept 2 days)
+    rank:daily:sales                    the existing leaderboard ZSET
+
+Each process runs one broadcaster (`live_feed`). It listens on the channel
+and at most MAX_UPDATES_PER_SECOND times a second, if an order arrived (or
+IDLE_REFRESH seconds passed, so the order rate decays), reads every counter
+in one pipeline and hands the snapshot to all connected clients. A client
+queue holds only the latest snapshot, and each client waits 1 / rate between
+sends, so updates are coalesced: 500 open dashboards cost one counter read
+per tick, never 500 aggregations.
+
+Clients connect with Server-Sent Events (GET /api/portal/live) or a
+WebSocket (/api/portal/live/ws), optionally with ?rate= to receive fewer
+updates per second.
+"""
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+import pytz
+
+from meal_periods import local_fields
+
+LIVE_CHANNEL = "live:orders"
+LEADERBOARD_KEY = "rank:daily:sales"
+LEADERBOARD_SIZE = 10
+
+# Upper bound of snapshots per second, per process and per client
+MAX_UPDATES_PER_SECOND = 2.0
+# Lowest ?rate= a client may ask for (one update every 10 s)
+MIN_UPDATES_PER_SECOND = 0.1
+# Seconds between snapshots when no order arrives
+IDLE_REFRESH = 10.0
+# Minutes in the order-rate window
+RATE_WINDOW_MINUTES = 5
+
+MINUTE_TTL = 2 * 3600
+HOUR_TTL = 2 * 86400
+
+
+def minute_key(epoch_minute: int) -> str:
+    return f"live:minute:{epoch_minute}"
+
+
+def hour_key(local_date: str, hour: int) -> str:
+    return f"live:hour:{local_date}:{hour:02d}"
+
+
+async def record_order(redis, dish_id: str, timestamp: datetime):
+    """Bump the live counters and wake the broadcasters (called from /api/portal/order)."""
+    if not redis:
+        return
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=pytz.UTC)
+    fields = local_fields(timestamp)
+    try:
+        pipe = redis.pipeline()
+        key = minute_key(int(timestamp.timestamp()) // 60)
+        pipe.incr(key)
+        pipe.expire(key, MINUTE_TTL)
+        key = hour_key(fields["local_date"], fields["local_hour"])
+        pipe.incr(key)
+        pipe.expire(key, HOUR_TTL)
+        pipe.publish(LIVE_CHANNEL, dish_id)
+        await pipe.execute()
+    except Exception as e:
+        print(f"Redis Error while publishing live update: {e}")
+
+
+class LiveFeed:
+    def __init__(self):
+        self.clients: Set[asyncio.Queue] = set()
+        self.latest: Optional[Dict] = None
+        self.dirty = True
+        self.ticks = 0
+        self._ranks: Dict[str, int] = {}
+        self._refreshed_at = 0.0
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self, redis):
+        """Start listening and ticking (once per process)."""
+        if self._tasks or not redis:
+            return
+        self._tasks = [asyncio.create_task(self._listen(redis)), asyncio.create_task(self._tick(redis))]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        if self.latest:
+            queue.put_nowait(self.latest)
+        self.clients.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.clients.discard(queue)
+
+    async def _listen(self, redis):
+        while True:
+            try:
+                pubsub = redis.pubsub()
+                await pubsub.subscribe(LIVE_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.dirty = True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Live feed subscription error: {e}")
+                await asyncio.sleep(1)
+
+    async def _tick(self, redis):
+        while True:
+            await asyncio.sleep(1 / MAX_UPDATES_PER_SECOND)
+            if not self.clients:
+                continue
+            if not self.dirty and time.monotonic() - self._refreshed_at < IDLE_REFRESH:
+                continue
+            self.dirty = False
+            try:
+                self.latest = await self.snapshot(redis)
+            except Exception as e:
+                print(f"Live feed snapshot error: {e}")
+                continue
+            self._refreshed_at = time.monotonic()
+            self.ticks += 1
+            for queue in list(self.clients):
+                # Keep only the newest snapshot for clients that have not caught up
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(self.latest)
+
+    async def snapshot(self, redis) -> Dict:
+        """Order rate, leaderboard and current-hour traffic from one pipelined read."""
+        from database import get_database
+        from engine_manager import get_engine
+        from traffic_forecast import traffic_forecaster
+
+        now = datetime.now(pytz.UTC)
+        fields = local_fields(now)
+        current_minute = int(now.timestamp()) // 60
+        pipe = redis.pipeline()
+        pipe.mget([minute_key(current_minute - i) for i in range(RATE_WINDOW_MINUTES)])
+        pipe.get(hour_key(fields["local_date"], fields["local_hour"]))
+        pipe.zrevrange(LEADERBOARD_KEY, 0, LEADERBOARD_SIZE - 1, withscores=True)
+        minutes, hour_orders, top = await pipe.execute()
+        per_minute = [int(v or 0) for v in reversed(minutes)]
+
+        engine = await get_engine()
+        leaderboard = []
+        ranks = {}
+        for rank, (dish_id, count) in enumerate(top):
+            dish = engine.dishes.get(dish_id) or {}
+            leaderboard.append({
+                "dish_id": dish_id,
+                "name": dish.get("name"),
+                "count": int(count),
+                "rank": rank + 1,
+                "previous_rank": self._ranks.get(dish_id),
+            })
+            ranks[dish_id] = rank + 1
+        changed = ranks != self._ranks
+        self._ranks = ranks
+
+        forecast = await traffic_forecaster.forecast(await get_database())
+        return {
+            "timestamp": now.isoformat(),
+            "order_rate": {
+                "per_minute": per_minute,
+                "last_minutes": RATE_WINDOW_MINUTES,
+                "orders": sum(per_minute),
+            },
+            "leaderboard": leaderboard,
+            "leaderboard_changed": changed,
+            "current_hour": {
+                "hour": fields["local_hour"],
+                "orders": int(hour_orders or 0),
+                "predicted": int(forecast["hourly"][fields["local_hour"]]),
+            },
+        }
+
+
+live_feed = LiveFeed()
+
+
+async def sse_events(request, rate: float = MAX_UPDATES_PER_SECOND):
+    """Server-Sent Events of live_feed snapshots, at most `rate` per second."""
+    rate = min(max(rate, MIN_UPDATES_PER_SECOND), MAX_UPDATES_PER_SECOND)
+    queue = live_feed.subscribe()
+    try:
+        while not await request.is_disconnected():
+            try:
+                snapshot = await asyncio.wait_for(queue.get(), timeout=IDLE_REFRESH * 2)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: snapshot\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+            # Snapshots published meanwhile replace each other in the queue
+            await asyncio.sleep(1 / rate)
+    finally:
+        live_feed.unsubscribe(queue)
@@ -0,0 +1,165 @@
+"""
+Where order logs live.
+
+By default logs are documents in the plain `logs_behavior` collection. With
+LOGS_STORAGE=timeseries they go to `logs_behavior_ts` instead, a MongoDB
+time-series collection:
+
+    timeField:   timestamp
+    metaField:   meta = {"dish_id": ObjectId, "action": "order"}
+    granularity: hours
+
+MongoDB groups documents with equal meta into buckets that cover a time span
+and keeps each bucket's min/max timestamp, so a timestamp range only opens
+the buckets that overlap it (bucket pruning). This helps every raw-log scan
+(exports, rollup / popularity / profile rebuilds, the analytics store load).
+user_id stays a plain field: with a per-user meta nearly every bucket would
+hold a single order. Documents keep the same top-level fields as before
+(user_id, dish_id, action, snapshots, local time), so every query works
+unchanged in both modes. Time-series mode needs MongoDB 7.0+ for the
+secondary indexes, updates and deletes on those fields.
+
+Every module reads and writes db[LOGS_COLLECTION].
+
+Usage (copy logs_behavior into the time-series collection, then set
+LOGS_STORAGE=timeseries and restart):
+    python backend/logs_storage.py migrate
+    python backend/logs_storage.py migrate --batch-size 20000
+    python backend/logs_storage.py verify
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Dict
+
+from pymongo import InsertOne
+
+from meal_periods import local_fields
+
+LOGS_STORAGE = os.getenv("LOGS_STORAGE", "collection")
+TIMESERIES = LOGS_STORAGE == "timeseries"
+
+PLAIN_COLLECTION = "logs_behavior"
+TIMESERIES_COLLECTION = "logs_behavior_ts"
+LOGS_COLLECTION = TIMESERIES_COLLECTION if TIMESERIES else PLAIN_COLLECTION
+
+TIMESERIES_OPTIONS = {"timeField": "timestamp", "metaField": "meta", "granularity": "hours"}
+
+# Progress of the migration, so an interrupted run resumes where it stopped
+MIGRATIONS_COLLECTION = "migrations"
+MIGRATION_ID = "logs_behavior_to_timeseries"
+MIGRATE_BATCH_SIZE = 10000
+
+
+def log_meta(log: Dict) -> Dict:
+    return {"dish_id": log["dish_id"], "action": log.get("action")}
+
+
+def to_timeseries(log: Dict) -> Dict:
+    """Copy of a plain log in time-series shape (adds meta and any missing local time fields)."""
+    doc = dict(log)
+    doc["meta"] = log_meta(log)
+    if "local_date" not in doc:
+        doc.update(local_fields(doc["timestamp"]))
+    return doc
+
+
+async def ensure_logs_collection(db):
+    """Create the time-series collection in time-series mode (an insert would create a plain one)."""
+    if not TIMESERIES:
+        return
+    if TIMESERIES_COLLECTION not in await db.list_collection_names():
+        await db.create_collection(TIMESERIES_COLLECTION, timeseries=TIMESERIES_OPTIONS)
+
+
+async def migrate(db, batch_size: int = MIGRATE_BATCH_SIZE) -> int:
+    """
+    Copy logs_behavior into logs_behavior_ts in _id order. The last copied _id
+    is checkpointed after each batch; on resume, logs already in the target
+    are skipped, so no log is copied twice. Returns logs copied by this run.
+    """
+    if TIMESERIES_COLLECTION not in await db.list_collection_names():
+        await db.create_collection(TIMESERIES_COLLECTION, timeseries=TIMESERIES_OPTIONS)
+    source, target = db[PLAIN_COLLECTION], db[TIMESERIES_COLLECTION]
+    progress = await db[MIGRATIONS_COLLECTION].find_one({"_id": MIGRATION_ID}) or {}
+    last_id = progress.get("last_id")
+    resumed = last_id is not None or await target.estimated_document_count() > 0
+    copied = 0
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = await source.find(query).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+        if resumed:
+            # The previous run may have died between insert and checkpoint (or
+            # the checkpoint is gone): skip logs already copied, until a batch
+            # has none, since copies are made in _id order
+            ids = [log["_id"] for log in batch]
+            span = {"$gte": min(log["timestamp"] for log in batch), "$lte": max(log["timestamp"] for log in batch)}
+            done = {doc["_id"] async for doc in target.find({"timestamp": span, "_id": {"$in": ids}}, {"_id": 1})}
+            batch = [log for log in batch if log["_id"] not in done]
+            resumed = bool(done)
+        if batch:
+            await target.bulk_write([InsertOne(to_timeseries(log)) for log in batch], ordered=False)
+        copied += len(batch)
+        await db[MIGRATIONS_COLLECTION].update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {"last_id": last_id, "updated_at": datetime.utcnow()}, "$inc": {"copied": len(batch)}},
+            upsert=True
+        )
+        print(f"   Copied {copied} logs...")
+    return copied
+
+
+async def verify(db) -> Dict:
+    """Compare total and per-day order counts of both collections."""
+    pipeline = [{"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+                            "count": {"$sum": 1}}}]
+    counts = {}
+    for name in (PLAIN_COLLECTION, TIMESERIES_COLLECTION):
+        counts[name] = {row["_id"]: row["count"] async for row in db[name].aggregate(pipeline, allowDiskUse=True)}
+    plain, ts = counts[PLAIN_COLLECTION], counts[TIMESERIES_COLLECTION]
+    mismatched = sorted(day for day in set(plain) | set(ts) if plain.get(day, 0) != ts.get(day, 0))
+    return {
+        "source": sum(plain.values()),
+        "target": sum(ts.values()),
+        "days": len(plain),
+        "mismatched_days": mismatched,
+        "ok": not mismatched,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Move order logs into a time-series collection")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = sub.add_parser("migrate", help="Copy logs_behavior into logs_behavior_ts (resumable)")
+    migrate_parser.add_argument("--batch-size", type=int, default=MIGRATE_BATCH_SIZE)
+    sub.add_parser("verify", help="Compare counts per UTC day of both collections")
+    args = parser.parse_args()
+
+    from database import db as database_instance
+
+    await database_instance.connect_db()
+    try:
+        db = database_instance.db
+        if args.command == "migrate":
+            start = time.time()
+            count = await migrate(db, args.batch_size)
+            print(f"Copied {count} logs in {time.time() - start:.2f} seconds")
+        report = await verify(db)
+        print(f"Source {report['source']} logs, time-series {report['target']} logs over {report['days']} days")
+        if not report["ok"]:
+            print(f"Counts differ on {len(report['mismatched_days'])} days: {', '.join(report['mismatched_days'][:10])}")
+            sys.exit(1)
+        print("Counts match")
+    finally:
+        await database_instance.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,6 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from database import db
+from engine_manager import engine_manager
+from item_similarity import similarity_index
+from popularity import ensure_built as ensure_popularity
+from indexes import ensure_indexes
+from analytics_store import start_analytics_store
+from traffic_forecast import traffic_forecaster
+from live_feed import live_feed
 from routers import portal, recommend, admin, student
 
 app = FastAPI(title="Cafeteria System API")
@@ -22,9 +29,36 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup():
     await db.connect_db()
+    try:
+        await ensure_indexes(db.db)
+    except Exception as e:
+        print(f"Creating indexes failed at startup: {e}")
+    # Build the recommendation engine once, up front
+    try:
+        await engine_manager.rebuild(db.db, db.redis_client)
+    except Exception as e:
+        # Not fatal: the first recommendation request will retry the build
+        print(f"VectorEngine build failed at startup: {e}")
+    try:
+        await ensure_popularity(db.db, db.redis_client, engine_manager.engine)
+    except Exception as e:
+        print(f"Building popularity tables failed at startup: {e}")
+    try:
+        await similarity_index.load(db.db)
+    except Exception as e:
+        print(f"Loading dish neighbours failed at startup: {e}")
+    try:
+        await traffic_forecaster.sync(db.db)
+    except Exception as e:
+        print(f"Loading traffic profile failed at startup: {e}")
+    # Optional columnar analytics store (ANALYTICS_STORE=1), loaded in the background
+    await start_analytics_store(db.db)
+    # One live-update broadcaster per process (live_feed.py)
+    live_feed.start(db.redis_client)
 
 @app.on_event("shutdown")
 async def shutdown():
+    await live_feed.stop()
     await db.close_db()
 
 app.include_router(portal.router, prefix="/api/portal", tags=["Portal"])
@@ -0,0 +1,204 @@
+"""
+Nightly materialized recommendation lists.
+
+For every user who ordered in the last --days days the job computes the
+/recommend/{user_id} list of each meal period (all canteens) and stores it,
+one document per user, in `recommendations_materialized`:
+
+    {
+        "_id": user_id,
+        "catalog_version": <engine catalog version>,
+        "computed_at": datetime,
+        "periods": {"breakfast": [dish_id, ...], "lunch": [...], ...}
+    }
+
+Scoring is sharded over a ProcessPoolExecutor. The VectorEngine is handed to
+each worker once through the pool initializer (inherited copy-on-write when
+the pool forks) and is only read there; shards carry nothing but user IDs,
+profile vectors and cooldowns.
+
+The online endpoints serve a stored list while the catalog version matches
+and the user has not ordered since computed_at, and score live otherwise.
+Cooldowns are taken at job time, so a dish can stay excluded until the next
+run even after its 3 days are over.
+
+Usage:
+    python backend/materialize.py [--days 30] [--workers 4] [--shard-size 2000]
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import numpy as np
+import pytz
+from pymongo import ReplaceOne
+
+from logs_storage import LOGS_COLLECTION
+from meal_periods import MEAL_PERIODS, PERIOD_COURSES, apply_meal_context
+from user_profiles import PROFILE_COLLECTION, get_profile_vectors, get_cooldowns
+
+MATERIALIZED_COLLECTION = "recommendations_materialized"
+
+# Same parameters as /recommend/{user_id}
+TOP_K = 8
+DIVERSITY_ALPHA = 0.75
+
+# Users per task sent to a worker process
+SHARD_SIZE = 2000
+
+# Engine of the current worker process, set by _init_worker
+_worker_engine = None
+
+
+def _init_worker(engine):
+    global _worker_engine
+    _worker_engine = engine
+
+
+def _score_shard(user_ids: List[str], vectors: np.ndarray, cooldowns: List[set]) -> Dict[str, Dict[str, List[str]]]:
+    """Runs in a worker: {user_id: {period: [dish_id, ...]}} for one shard."""
+    engine = _worker_engine
+    lists = {uid: {} for uid in user_ids}
+    for period in MEAL_PERIODS:
+        ranges = engine.partition_ranges(None, PERIOD_COURSES[period])
+        period_vectors = np.array([apply_meal_context(v.copy(), period) for v in vectors])
+        results = engine.recommend_batch(period_vectors, TOP_K, DIVERSITY_ALPHA, cooldowns, ranges=ranges)
+        for uid, recommendations in zip(user_ids, results):
+            lists[uid][period] = [str(d["_id"]) for d in recommendations]
+    return lists
+
+
+async def _active_users(db, since: datetime):
+    pipeline = [
+        {"$match": {"action": "order", "timestamp": {"$gte": since}}},
+        {"$group": {"_id": "$user_id"}}
+    ]
+    async for row in db[LOGS_COLLECTION].aggregate(pipeline, allowDiskUse=True):
+        yield row["_id"]
+
+
+async def materialize(db, engine, days: int = 30, workers: int = None, shard_size: int = SHARD_SIZE) -> int:
+    """Recompute the stored lists of every active user. Returns the number of users written."""
+    # Taken before any profile is read: an order placed while the job runs
+    # moves last_order_at past computed_at and the stored list is ignored
+    computed_at = datetime.now(pytz.UTC)
+    loop = asyncio.get_running_loop()
+    written = 0
+
+    async def write(lists):
+        nonlocal written
+        ops = [ReplaceOne({"_id": oid}, {
+            "_id": oid,
+            "catalog_version": engine.catalog_version,
+            "computed_at": computed_at,
+            "periods": periods
+        }, upsert=True) for oid, periods in lists]
+        if ops:
+            await db[MATERIALIZED_COLLECTION].bulk_write(ops, ordered=False)
+            written += len(ops)
+
+    async def submit(pool, shard):
+        profiles = await get_profile_vectors(db, engine, shard)
+        cooldowns = await get_cooldowns(db, shard, computed_at)
+        warm = [oid for oid in shard if str(oid) in profiles]
+        if not warm:
+            return None
+        user_ids = [str(oid) for oid in warm]
+        vectors = np.array([profiles[uid] for uid in user_ids])
+        future = loop.run_in_executor(pool, _score_shard, user_ids, vectors, [cooldowns[uid] for uid in user_ids])
+        return warm, future
+
+    async def drain(pending):
+        warm, future = pending
+        lists = await future
+        await write([(oid, lists[str(oid)]) for oid in warm])
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(engine,)) as pool:
+        in_flight = []
+        shard = []
+        async for oid in _active_users(db, computed_at - timedelta(days=days)):
+            shard.append(oid)
+            if len(shard) >= shard_size:
+                pending = await submit(pool, shard)
+                if pending:
+                    in_flight.append(pending)
+                shard = []
+                # Keep every worker busy without reading all users up front
+                while len(in_flight) >= workers * 2:
+                    await drain(in_flight.pop(0))
+        if shard:
+            pending = await submit(pool, shard)
+            if pending:
+                in_flight.append(pending)
+        for pending in in_flight:
+            await drain(pending)
+
+    # Users who are no longer active (or belong to an old catalog)
+    await db[MATERIALIZED_COLLECTION].delete_many({"computed_at": {"$lt": computed_at}})
+    return written
+
+
+async def get_materialized(db, engine, user_oids: List, period: str) -> Dict[str, List[Dict]]:
+    """
+    Stored lists for the given users and meal period that are still valid,
+    as dish dicts keyed by str(user_id). Users whose list is missing, was
+    computed for another catalog version or predates their last order are
+    absent from the result.
+    """
+    if not user_oids:
+        return {}
+    docs = await db[MATERIALIZED_COLLECTION].find(
+        {"_id": {"$in": user_oids}, "catalog_version": engine.catalog_version},
+        {"computed_at": 1, f"periods.{period}": 1}
+    ).to_list(length=None)
+    if not docs:
+        return {}
+
+    profiles = await db[PROFILE_COLLECTION].find(
+        {"_id": {"$in": [d["_id"] for d in docs]}},
+        {"last_order_at": 1}
+    ).to_list(length=None)
+    last_order = {p["_id"]: p.get("last_order_at") for p in profiles}
+
+    results = {}
+    for doc in docs:
+        last = last_order.get(doc["_id"])
+        # No profile means the history was cleared since the run
+        if last is None or last > doc["computed_at"]:
+            continue
+        dish_ids = doc.get("periods", {}).get(period)
+        if dish_ids is None:
+            continue
+        results[str(doc["_id"])] = [engine.dishes[did] for did in dish_ids if did in engine.dishes]
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Precompute recommendation lists for active users")
+    parser.add_argument("--days", type=int, default=30, help="Users who ordered within this many days")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    args = parser.parse_args()
+
+    from database import db as database_instance
+    from engine_manager import engine_manager
+
+    await database_instance.connect_db()
+    db = database_instance.db
+    try:
+        engine = await engine_manager.rebuild(db, database_instance.redis_client)
+        start = time.time()
+        count = await materialize(db, engine, args.days, args.workers, args.shard_size)
+        print(f"Materialized recommendations for {count} users "
+              f"(catalog v{engine.catalog_version}) in {time.time() - start:.2f} seconds")
+    finally:
+        await database_instance.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
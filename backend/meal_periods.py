@@ -0,0 +1,66 @@
+from datetime import datetime
+import pytz
+
+# All local-time logic in the system uses Shanghai time
+TZ_SHANGHAI = pytz.timezone('Asia/Shanghai')
+
+# Meal periods by local hour: breakfast 6-10, lunch 10-14, dinner 17-21
+MEAL_PERIODS = ["breakfast", "lunch", "dinner", "other"]
+
+
+# Catalog courses served in each meal period (see VectorEngine.partition_key)
+PERIOD_COURSES = {
+    "breakfast": ["breakfast"],
+    "lunch": ["main"],
+    "dinner": ["main"],
+    "other": ["breakfast", "main"],
+}
+
+
+def meal_period(hour: int) -> str:
+    """Map a Shanghai-local hour (0-23) to its meal period."""
+    if 6 <= hour < 10:
+        return "breakfast"
+    if 10 <= hour < 14:
+        return "lunch"
+    if 17 <= hour < 21:
+        return "dinner"
+    return "other"
+
+
+def current_hour() -> int:
+    return datetime.now(TZ_SHANGHAI).hour
+
+
+def local_fields(ts: datetime) -> dict:
+    """Shanghai-local date, hour and weekday (0 = Monday) of a timestamp (naive = UTC)."""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=pytz.UTC)
+    local = ts.astimezone(TZ_SHANGHAI)
+    return {
+        "local_date": local.strftime("%Y-%m-%d"),
+        "local_hour": local.hour,
+        "dow": local.weekday(),
+    }
+
+
+def apply_meal_context(user_vector, period: str):
+    """
+    Context Awareness: Adjust user vector based on time of day
+    This is a "Query Expansion" technique in VSM
+    """
+    # Modify the vector temporarily for this request
+    # Indices: 0:spicy, 1:sweet, 2:salty, 3:sour, 4:oily, 5:fresh, 6:price, 7:cal, 8:pop
+    
+    if period == "breakfast":
+        # Reduce preference for spicy/oily, increase fresh/sweet(porridge)
+        user_vector[0] *= 0.5 # Spicy
+        user_vector[4] *= 0.3 # Oily
+        user_vector[1] *= 1.2 # Sweet
+    elif period == "dinner":
+        # Slight preference for lighter food (lower calories)
+        # In our vector, index 7 is "High Calories". So we want to lower it?
+        # Actually index 7 is normalized calories. If user likes high cal, this is high.
+        # To recommend low cal, we should lower this component in the user vector
+        user_vector[7] *= 0.8
+    return user_vector
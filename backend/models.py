@@ -41,6 +41,13 @@ class LogBehavior(BaseModel):
     dish_id: PyObjectId
     action: str # view, order, like
     timestamp: datetime = Field(default_factory=datetime.now)
+    # Order enrichment (order_logs.py): dish snapshot + Shanghai-local time
+    price: Optional[float] = None
+    calories: Optional[int] = None
+    category: Optional[str] = None
+    local_date: Optional[str] = None
+    local_hour: Optional[int] = None
+    dow: Optional[int] = None
 
     model_config = {
         "json_encoders": {datetime: lambda v: v.isoformat()}
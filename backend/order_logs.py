@@ -0,0 +1,137 @@
+"""
+Enriched order logs.
+
+Every order in the logs collection (logs_storage.py) carries, besides user / dish / UTC timestamp,
+a snapshot of the dish at order time and its Shanghai-local time fields:
+
+    {
+        "user_id": ObjectId, "dish_id": ObjectId, "action": "order",
+        "timestamp": datetime,       # UTC
+        "price": 12.0,               # dish snapshot (None if the dish was unknown)
+        "calories": 550,
+        "category": "川菜",
+        "local_date": "2024-05-01",  # Shanghai local date / hour / weekday
+        "local_hour": 12,
+        "dow": 2                     # 0 = Monday
+    }
+
+Aggregations group on these plain fields instead of joining `dishes` or
+converting every timestamp to Asia/Shanghai. The LOCAL_*_EXPR expressions
+fall back to the timezone conversion for logs that have not been backfilled
+yet.
+
+Usage:
+    python backend/order_logs.py backfill
+    python backend/order_logs.py backfill --batch-size 2000 --no-rollups
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from pymongo import UpdateOne
+
+from logs_storage import LOGS_COLLECTION, TIMESERIES, log_meta
+from meal_periods import local_fields
+
+# Logs updated per bulk_write during the backfill
+BACKFILL_BATCH_SIZE = 5000
+
+SNAPSHOT_FIELDS = ("price", "calories", "category")
+
+# Local time of a log, with a fallback for logs written before enrichment
+LOCAL_DATE_EXPR = {"$ifNull": ["$local_date", {
+    "$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp", "timezone": "Asia/Shanghai"}}]}
+LOCAL_HOUR_EXPR = {"$ifNull": ["$local_hour", {"$hour": {"date": "$timestamp", "timezone": "Asia/Shanghai"}}]}
+LOCAL_DOW_EXPR = {"$ifNull": ["$dow", {
+    "$subtract": [{"$isoDayOfWeek": {"date": "$timestamp", "timezone": "Asia/Shanghai"}}, 1]}]}
+
+
+def dish_snapshot(dish: Optional[Dict]) -> Dict:
+    """Price, calories and category of a dish document (all None when unknown)."""
+    if not dish:
+        return {field: None for field in SNAPSHOT_FIELDS}
+    return {
+        "price": dish.get("price"),
+        "calories": dish.get("calories", 0),
+        "category": dish.get("category"),
+    }
+
+
+def enrich(log: Dict, dish: Optional[Dict]) -> Dict:
+    """Add the dish snapshot and local time fields to a log dict in place."""
+    log.update(dish_snapshot(dish))
+    log.update(local_fields(log["timestamp"]))
+    return log
+
+
+def build_order_log(user_oid, dish_oid, dish: Optional[Dict], timestamp: datetime) -> Dict:
+    log = enrich({
+        "user_id": user_oid,
+        "dish_id": dish_oid,
+        "action": "order",
+        "timestamp": timestamp,
+    }, dish)
+    if TIMESERIES:
+        # Bucket key of the time-series collection (see logs_storage.py)
+        log["meta"] = log_meta(log)
+    return log
+
+
+async def backfill(db, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Enrich every order log that has no local_date yet, in _id order. Safe to
+    interrupt and re-run: finished logs no longer match. Snapshots use the
+    current catalog (historical prices are not known). Returns logs updated.
+    """
+    dishes = {d["_id"]: d async for d in db.dishes.find()}
+    updated = 0
+    last_id = None
+    while True:
+        query = {"action": "order", "local_date": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db[LOGS_COLLECTION].find(
+            query, {"dish_id": 1, "timestamp": 1}
+        ).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+        ops = []
+        for log in batch:
+            fields = {**dish_snapshot(dishes.get(log["dish_id"])), **local_fields(log["timestamp"])}
+            ops.append(UpdateOne({"_id": log["_id"]}, {"$set": fields}))
+        await db[LOGS_COLLECTION].bulk_write(ops, ordered=False)
+        updated += len(ops)
+        last_id = batch[-1]["_id"]
+        print(f"   Enriched {updated} logs...")
+    return updated
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Maintain enriched order logs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = sub.add_parser("backfill", help="Add dish snapshots and local time fields to old logs")
+    backfill_parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    backfill_parser.add_argument("--no-rollups", action="store_true",
+                                 help="Do not rebuild order_rollups_hourly afterwards")
+    args = parser.parse_args()
+
+    from database import db as database_instance
+    from rollups import rebuild as rebuild_rollups
+
+    await database_instance.connect_db()
+    try:
+        start = time.time()
+        count = await backfill(database_instance.db, args.batch_size)
+        print(f"Backfilled {count} logs in {time.time() - start:.2f} seconds")
+        if not args.no_rollups:
+            # Buckets built before the backfill have no revenue / calories / category
+            buckets = await rebuild_rollups(database_instance.db)
+            print(f"Rebuilt {buckets} hourly buckets")
+    finally:
+        await database_instance.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,184 @@
+"""
+Popularity rankings per meal period and day of week, kept in Redis.
+
+One ZSET per (canteen, meal period, Shanghai-local weekday), dish_id -> order
+count, plus one across all canteens:
+
+    pop:{canteen}:{period}:{dow}     e.g. pop:all:lunch:0 (Monday lunch)
+
+Every order increments its slot (ZINCRBY), so the tables are always current.
+`rebuild` recomputes them from the last POPULARITY_DAYS of logs; run it
+nightly so old orders age out. Cold-start lists are then a ZREVRANGE of the
+top entries, filtered for cooldown and catalog partition.
+
+Usage:
+    python backend/popularity.py [--days 28]
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+import pytz
+
+from logs_storage import LOGS_COLLECTION
+from meal_periods import TZ_SHANGHAI, meal_period
+from order_logs import LOCAL_HOUR_EXPR, LOCAL_DOW_EXPR
+from recommend_cache import ALL_CANTEENS
+
+POPULARITY_DAYS = 28
+KEY_PREFIX = "pop:"
+BUILT_AT_KEY = "pop:built_at"
+
+
+def popularity_key(period: str, dow: int, canteen: Optional[str] = None) -> str:
+    return f"{KEY_PREFIX}{canteen or ALL_CANTEENS}:{period}:{dow}"
+
+
+def local_slot(ts: datetime) -> Tuple[str, int]:
+    """(meal period, weekday 0=Monday) of a timestamp in Shanghai local time."""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=pytz.UTC)
+    local = ts.astimezone(TZ_SHANGHAI)
+    return meal_period(local.hour), local.weekday()
+
+
+def current_slot() -> Tuple[str, int]:
+    return local_slot(datetime.now(pytz.UTC))
+
+
+def _canteen_of(engine, dish_id: str) -> Optional[str]:
+    dish = engine.dishes.get(dish_id) if engine else None
+    return engine.partition_key(dish)[0] if dish else None
+
+
+async def record_order(redis, engine, dish_id: str, timestamp: datetime):
+    """Count one order in its meal-period/weekday slot."""
+    if not redis:
+        return
+    period, dow = local_slot(timestamp)
+    try:
+        pipe = redis.pipeline()
+        pipe.zincrby(popularity_key(period, dow), 1, dish_id)
+        canteen = _canteen_of(engine, dish_id)
+        if canteen:
+            pipe.zincrby(popularity_key(period, dow, canteen), 1, dish_id)
+        await pipe.execute()
+    except Exception as e:
+        print(f"Redis Error while updating popularity: {e}")
+
+
+async def rebuild(db, redis, engine, days: int = POPULARITY_DAYS) -> int:
+    """Recompute every table from recent logs and swap them in atomically. Returns the number of tables."""
+    since = datetime.now(pytz.UTC) - timedelta(days=days)
+    pipeline = [
+        {"$match": {"action": "order", "timestamp": {"$gte": since}}},
+        {"$group": {
+            "_id": {
+                "dish_id": "$dish_id",
+                "hour": LOCAL_HOUR_EXPR,
+                "dow": LOCAL_DOW_EXPR
+            },
+            "count": {"$sum": 1}
+        }}
+    ]
+    tables: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    async for row in db[LOGS_COLLECTION].aggregate(pipeline, allowDiskUse=True):
+        dish_id = str(row["_id"]["dish_id"])
+        period = meal_period(row["_id"]["hour"])
+        dow = row["_id"]["dow"]
+        tables[popularity_key(period, dow)][dish_id] += row["count"]
+        canteen = _canteen_of(engine, dish_id)
+        if canteen:
+            tables[popularity_key(period, dow, canteen)][dish_id] += row["count"]
+
+    old_keys = [key async for key in redis.scan_iter(match=f"{KEY_PREFIX}*")]
+    pipe = redis.pipeline(transaction=True)
+    if old_keys:
+        pipe.delete(*old_keys)
+    for key, counts in tables.items():
+        pipe.zadd(key, counts)
+    pipe.set(BUILT_AT_KEY, datetime.now(pytz.UTC).isoformat())
+    await pipe.execute()
+    return len(tables)
+
+
+async def ensure_built(db, redis, engine):
+    """Build the tables once if they are missing (fresh Redis, after a seed)."""
+    if redis and not await redis.exists(BUILT_AT_KEY):
+        count = await rebuild(db, redis, engine)
+        print(f"Popularity tables built: {count}")
+
+
+async def top_popular(redis, engine, period: str, dow: int, canteen: Optional[str] = None,
+                      ranges: Optional[List[Tuple[int, int]]] = None, exclude_ids: Set[str] = None,
+                      k: int = 8) -> List[Dict]:
+    """
+    The k most ordered dishes of the slot that are in the catalog partitions
+    and not excluded, read page by page from the ZSET (O(k + excluded)).
+    """
+    if not redis:
+        return []
+    exclude_ids = exclude_ids or set()
+    key = popularity_key(period, dow, canteen)
+    page = k + len(exclude_ids)
+    selected = []
+    start = 0
+    try:
+        while len(selected) < k:
+            members = await redis.zrevrange(key, start, start + page - 1)
+            for dish_id in members:
+                idx = engine.dish_index.get(dish_id)
+                if idx is None or dish_id in exclude_ids:
+                    continue
+                if ranges is not None and not any(s <= idx < e for s, e in ranges):
+                    continue
+                selected.append(engine.dishes[dish_id])
+                if len(selected) == k:
+                    break
+            if len(members) < page:
+                break
+            start += page
+    except Exception as e:
+        print(f"Redis Error while reading popularity: {e}")
+    return selected
+
+
+async def popularity_scores(redis, period: str, dow: int, limit: int = 50) -> Dict[str, float]:
+    """Top dishes of the slot with scores normalized to 0-1."""
+    if not redis:
+        return {}
+    try:
+        top = await redis.zrevrange(popularity_key(period, dow), 0, limit - 1, withscores=True)
+    except Exception as e:
+        print(f"Redis Error while reading popularity: {e}")
+        return {}
+    if not top or top[0][1] <= 0:
+        return {}
+    max_count = top[0][1]
+    return {dish_id: count / max_count for dish_id, count in top}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Rebuild the meal-period popularity tables")
+    parser.add_argument("--days", type=int, default=POPULARITY_DAYS)
+    args = parser.parse_args()
+
+    from database import db as database_instance
+    from engine_manager import engine_manager
+
+    await database_instance.connect_db()
+    try:
+        engine = await engine_manager.rebuild(database_instance.db, database_instance.redis_client)
+        start = time.time()
+        count = await rebuild(database_instance.db, database_instance.redis_client, engine, args.days)
+        print(f"Rebuilt {count} popularity tables from the last {args.days} days "
+              f"in {time.time() - start:.2f} seconds")
+    finally:
+        await database_instance.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
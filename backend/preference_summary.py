@@ -0,0 +1,143 @@
+"""
+Running totals behind the admin user-preference radar.
+
+One small document holds, per radar dimension, the sum of the matching
+preference scores over all users and how many scores were added:
+
+    {"_id": "radar", "sums": {"辣": 812.5, ...}, "counts": {"辣": 203, ...},
+     "users": 51, "updated_at": datetime}
+
+No endpoint edits users.preferences: users and their preferences come
+from seed.py, which adds them to the totals with `add_users` (one $inc).
+/api/admin/analytics/user_radar then reads one document: O(dimensions)
+however many users there are. `rebuild` recomputes the totals from every
+user in batches and replaces the document; run it after changing users
+outside seed.py, or nightly.
+
+Usage:
+    python backend/preference_summary.py
+    python backend/preference_summary.py --batch-size 5000
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+import pytz
+
+SUMMARY_COLLECTION = "preference_summary"
+SUMMARY_ID = "radar"
+
+RADAR_DIMENSIONS = ["辣", "甜", "咸", "酸", "鲜", "油"]
+# Shown for a dimension no user has a score for
+DEFAULT_SCORE = 3.0
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def dimension_of(key: str) -> Optional[str]:
+    """Radar dimension a preference key counts towards (exact match, or any key mentioning 辣)."""
+    if key in RADAR_DIMENSIONS:
+        return key
+    if "辣" in key:
+        return "辣"
+    return None
+
+
+def contributions(preferences: Optional[Dict[str, float]]) -> Tuple[Dict[str, float], Dict[str, int]]:
+    """Per-dimension (sums, counts) of one user's preferences."""
+    sums, counts = {}, {}
+    for key, value in (preferences or {}).items():
+        dimension = dimension_of(key)
+        if dimension:
+            sums[dimension] = sums.get(dimension, 0.0) + value
+            counts[dimension] = counts.get(dimension, 0) + 1
+    return sums, counts
+
+
+async def _increment(db, sums: Dict[str, float], counts: Dict[str, int], users: int = 0):
+    inc = {f"sums.{d}": v for d, v in sums.items() if v}
+    inc.update({f"counts.{d}": n for d, n in counts.items() if n})
+    if users:
+        inc["users"] = users
+    if not inc:
+        return
+    await db[SUMMARY_COLLECTION].update_one(
+        {"_id": SUMMARY_ID},
+        {"$inc": inc, "$set": {"updated_at": datetime.now(pytz.UTC)}},
+        upsert=True
+    )
+
+
+async def add_users(db, users: Iterable[Dict]):
+    """Add newly inserted user documents to the totals with one update."""
+    sums = {d: 0.0 for d in RADAR_DIMENSIONS}
+    counts = {d: 0 for d in RADAR_DIMENSIONS}
+    added = 0
+    for user in users:
+        user_sums, user_counts = contributions(user.get("preferences"))
+        for d, v in user_sums.items():
+            sums[d] += v
+        for d, n in user_counts.items():
+            counts[d] += n
+        added += 1
+    await _increment(db, sums, counts, added)
+
+
+async def rebuild(db, batch_size: int = REBUILD_BATCH_SIZE) -> Dict:
+    """Recompute the totals from every user, batch_size users at a time, and replace the summary."""
+    sums = {d: 0.0 for d in RADAR_DIMENSIONS}
+    counts = {d: 0 for d in RADAR_DIMENSIONS}
+    users = 0
+    cursor = db.users.find({}, {"preferences": 1}).batch_size(batch_size)
+    async for user in cursor:
+        user_sums, user_counts = contributions(user.get("preferences"))
+        for d, v in user_sums.items():
+            sums[d] += v
+        for d, n in user_counts.items():
+            counts[d] += n
+        users += 1
+    summary = {"sums": sums, "counts": counts, "users": users, "updated_at": datetime.now(pytz.UTC)}
+    await db[SUMMARY_COLLECTION].replace_one({"_id": SUMMARY_ID}, summary, upsert=True)
+    return summary
+
+
+async def radar(db) -> Dict:
+    """ECharts radar indicators and the mean score per dimension."""
+    summary = await db[SUMMARY_COLLECTION].find_one({"_id": SUMMARY_ID})
+    if summary is None:
+        summary = await rebuild(db)
+    values = []
+    for d in RADAR_DIMENSIONS:
+        count = summary.get("counts", {}).get(d, 0)
+        values.append(round(summary.get("sums", {}).get(d, 0.0) / count, 1) if count > 0 else DEFAULT_SCORE)
+    indicators = [{"name": d, "max": 5} for d in RADAR_DIMENSIONS]
+    return {"indicators": indicators, "values": values}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Recompute the user-preference radar totals")
+    parser.add_argument("--batch-size", type=int, default=REBUILD_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from database import db as database_instance
+
+    await database_instance.connect_db()
+    try:
+        db = database_instance.db
+        before = await db[SUMMARY_COLLECTION].find_one({"_id": SUMMARY_ID}) or {}
+        start = time.time()
+        summary = await rebuild(db, args.batch_size)
+        print(f"Summed the preferences of {summary['users']} users in {time.time() - start:.2f} seconds")
+        for d in RADAR_DIMENSIONS:
+            old_sum = before.get("sums", {}).get(d, 0.0)
+            old_count = before.get("counts", {}).get(d, 0)
+            if abs(old_sum - summary["sums"][d]) > 1e-6 or old_count != summary["counts"][d]:
+                print(f"   {d}: sum {old_sum:g} -> {summary['sums'][d]:g}, count {old_count} -> {summary['counts'][d]}")
+    finally:
+        await database_instance.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
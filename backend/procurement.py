@@ -0,0 +1,106 @@
+"""
+Ingredient procurement forecast for the admin dashboard.
+
+Daily sales of every dish are laid out as one dish×day matrix Y (missing
+days are 0). All trend lines are solved together with closed-form ordinary
+least squares over the day index x = 0..n-1:
+
+    slope     = (Y - mean(Y)) · (x - mean(x)) / Σ(x - mean(x))²
+    intercept = mean(Y) - slope * mean(x)
+
+which is exactly what a per-dish LinearRegression fit gives. Forecasts for
+days n..n+horizon-1 are clipped at 0 and summed per dish, then turned into
+ingredient amounts with one matrix product against a dish×ingredient matrix
+built from DISH_INGREDIENTS_MAP (dishes not in the map use "default").
+"""
+from datetime import date, timedelta
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from ingredient_map import DISH_INGREDIENTS_MAP
+
+# Days of history the trends are fitted on
+HISTORY_DAYS = 14
+MAX_HORIZON = 14
+
+
+def sales_matrix(rows: List[Dict], dates: List[str]) -> Tuple[List[str], np.ndarray]:
+    """
+    rows: [{"_id": {"dish_id", "date"}, "daily_count"}] -> (dish_ids, dish×day matrix).
+    Dates outside `dates` are ignored.
+    """
+    date_index = {d: i for i, d in enumerate(dates)}
+    dish_index: Dict[str, int] = {}
+    dish_pos, day_pos, counts = [], [], []
+    for row in rows:
+        day = date_index.get(row["_id"]["date"])
+        if day is None:
+            continue
+        did = str(row["_id"]["dish_id"])
+        dish_pos.append(dish_index.setdefault(did, len(dish_index)))
+        day_pos.append(day)
+        counts.append(row["daily_count"])
+
+    Y = np.zeros((len(dish_index), len(dates)), dtype=np.float64)
+    np.add.at(Y, (np.asarray(dish_pos, dtype=np.int64), np.asarray(day_pos, dtype=np.int64)), counts)
+    return list(dish_index), Y
+
+
+def fit_trends(Y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Least-squares (slope, intercept) of every row of Y against its column index."""
+    n = Y.shape[1]
+    if n < 2:
+        # Not enough days for a trend: flat line at the mean
+        return np.zeros(Y.shape[0]), Y.mean(axis=1)
+    x = np.arange(n, dtype=np.float64)
+    xc = x - x.mean()
+    y_mean = Y.mean(axis=1)
+    slope = (Y @ xc) / (xc @ xc)
+    return slope, y_mean - slope * x.mean()
+
+
+def forecast(Y: np.ndarray, horizon: int = 1) -> np.ndarray:
+    """Predicted sales per dish over the next `horizon` days, shape (dishes, horizon)."""
+    slope, intercept = fit_trends(Y)
+    future = np.arange(Y.shape[1], Y.shape[1] + horizon, dtype=np.float64)
+    return np.maximum(intercept[:, None] + slope[:, None] * future[None, :], 0)
+
+
+def ingredient_matrix(dish_names: List[str]) -> Tuple[List[str], np.ndarray]:
+    """(ingredient names, dish×ingredient kg-per-serving matrix)."""
+    recipes = [DISH_INGREDIENTS_MAP.get(name, DISH_INGREDIENTS_MAP["default"]) for name in dish_names]
+    ingredients = sorted({ing for recipe in recipes for ing in recipe})
+    column = {ing: j for j, ing in enumerate(ingredients)}
+    M = np.zeros((len(dish_names), len(ingredients)), dtype=np.float64)
+    for i, recipe in enumerate(recipes):
+        for ing, amount in recipe.items():
+            M[i, column[ing]] = amount
+    return ingredients, M
+
+
+def history_dates(today: date, days: int = HISTORY_DAYS) -> List[str]:
+    """Local dates of the `days` days ending today, oldest first."""
+    return [(today - timedelta(days=days - 1 - i)).strftime("%Y-%m-%d") for i in range(days)]
+
+
+def procurement_plan(rows: List[Dict], dates: List[str], dish_names: Dict[str, str],
+                     horizon: int = 1, top_n: int = 10) -> Dict:
+    """Top ingredient needs over the next `horizon` days from daily dish sales."""
+    dish_ids, Y = sales_matrix(rows, dates)
+    if not dish_ids:
+        return {"ingredients": [], "quantities": [], "units": [], "horizon": horizon, "daily": []}
+
+    per_dish = forecast(Y, horizon)                    # (dishes, horizon)
+    ingredients, M = ingredient_matrix([dish_names.get(did, "") for did in dish_ids])
+    daily_needs = per_dish.T @ M                       # (horizon, ingredients)
+    totals = daily_needs.sum(axis=0)
+
+    top = np.argsort(-totals, kind="stable")[:top_n]
+    return {
+        "ingredients": [ingredients[j] for j in top],
+        "quantities": [round(float(totals[j]), 1) for j in top],
+        "units": ["kg"] * len(top),
+        "horizon": horizon,
+        "daily": [[round(float(v), 1) for v in daily_needs[:, j]] for j in top],
+    }
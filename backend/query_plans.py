@@ -0,0 +1,215 @@
+"""
+Query-plan check: runs explain("executionStats") on every query shape the
+routers issue and fails when one falls back to a collection scan or
+examines too many documents per document returned.
+
+Run it against a local mongod with realistic data (e.g. after seed.py):
+
+    python backend/query_plans.py
+    python backend/query_plans.py --max-ratio 1.5 --verbose
+
+Exit status is 1 when any query fails. Queries that read a whole collection
+on purpose (full_scan=True) are reported but never fail. When a router
+gains a query, add its shape to `query_catalog` and, if needed, an index to
+indexes.py.
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import pytz
+
+from indexes import ensure_indexes
+from logs_storage import LOGS_COLLECTION
+from materialize import MATERIALIZED_COLLECTION
+from preference_summary import SUMMARY_COLLECTION, SUMMARY_ID
+from traffic_forecast import FORECAST_DAYS
+from rollups import ROLLUP_COLLECTION
+from user_profiles import PROFILE_COLLECTION
+
+# Default limit for totalDocsExamined / nReturned
+MAX_DOCS_EXAMINED_RATIO = 2.0
+
+
+def find(collection: str, filter: Dict, sort: Dict = None, limit: int = None, projection: Dict = None) -> Dict:
+    command = {"find": collection, "filter": filter}
+    if sort:
+        command["sort"] = sort
+    if limit:
+        command["limit"] = limit
+    if projection:
+        command["projection"] = projection
+    return command
+
+
+def aggregate(collection: str, pipeline: List[Dict]) -> Dict:
+    return {"aggregate": collection, "pipeline": pipeline, "cursor": {}}
+
+
+def query_catalog(user_id, dish_id, now: datetime) -> List[Dict]:
+    """Every query shape issued per request, with sample values filled in."""
+    from routers.admin import (
+        rollup_since, rollup_window, dashboard_pipeline, CHART_WINDOWS, SALES_TREND_STAGES,
+        DAILY_STAGES, HEATMAP_STAGES, CATEGORY_SHARE_STAGES, PROCUREMENT_STAGES
+    )
+    from procurement import HISTORY_DAYS
+    from user_profiles import COOLDOWN_DAYS
+
+    def rollup(chart: str, stages: List[Dict]) -> List[Dict]:
+        window = CHART_WINDOWS[chart]
+        return ([rollup_since(window)] if window is not None else []) + stages
+
+    # ?start=&end= on the chart and dashboard endpoints (last week's range)
+    range_start, range_end = now - timedelta(days=14), now - timedelta(days=7)
+
+    def ranged(stages: List[Dict]) -> List[Dict]:
+        return rollup_window(None, range_start, range_end) + stages
+
+    user_orders = {"user_id": user_id, "action": "order"}
+    lookup_dish = {"$lookup": {"from": "dishes", "localField": "dish_id", "foreignField": "_id", "as": "dish"}}
+    return [
+        # portal.py
+        {"name": "portal.dish_by_id", "command": find("dishes", {"_id": dish_id}, limit=1)},
+        {"name": "portal.leaderboard_fallback", "command": aggregate(LOGS_COLLECTION, [
+            {"$match": {"action": "order"}},
+            {"$group": {"_id": "$dish_id", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}}, {"$limit": 10}])},
+        # student.py
+        {"name": "student.history", "command": find(LOGS_COLLECTION, user_orders, sort={"timestamp": -1}, limit=50)},
+        {"name": "student.ai_chat_recent", "command": find(LOGS_COLLECTION, user_orders,
+                                                           sort={"timestamp": -1}, limit=10)},
+        {"name": "student.demo_users", "command": find("users", {"username": {"$regex": "^demo_"}}, limit=10)},
+        {"name": "student.top_tags", "command": aggregate(LOGS_COLLECTION, [
+            {"$match": user_orders}, lookup_dish, {"$unwind": "$dish"}, {"$unwind": "$dish.tags"},
+            {"$group": {"_id": "$dish.tags", "count": {"$sum": 1}}}, {"$sort": {"count": -1}}, {"$limit": 3}])},
+        {"name": "student.clear_history", "command": find(LOGS_COLLECTION, {"user_id": user_id})},
+        # recommend.py / user_profiles.py / materialize.py
+        {"name": "recommend.cooldown", "command": find(LOGS_COLLECTION, {
+            **user_orders, "timestamp": {"$gt": now - timedelta(days=COOLDOWN_DAYS)}})},
+        {"name": "recommend.batch_cooldowns", "command": find(LOGS_COLLECTION, {
+            "user_id": {"$in": [user_id]}, "action": "order",
+            "timestamp": {"$gt": now - timedelta(days=COOLDOWN_DAYS)}})},
+        {"name": "recommend.user_history", "command": aggregate(LOGS_COLLECTION, [
+            {"$match": user_orders}, lookup_dish, {"$unwind": "$dish"},
+            {"$sort": {"timestamp": -1}}, {"$limit": 50}])},
+        {"name": "recommend.top10", "command": aggregate(LOGS_COLLECTION, [
+            {"$match": user_orders}, {"$group": {"_id": "$dish_id", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}}, {"$limit": 10}])},
+        # one dishes.find_one per top10 row
+        {"name": "recommend.top10_dish", "command": find("dishes", {"_id": dish_id}, limit=1)},
+        {"name": "recommend.popularity_fallback", "command": aggregate(LOGS_COLLECTION, [
+            {"$match": {"action": "order"}}, {"$group": {"_id": "$dish_id", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}}, {"$limit": 50}])},
+        {"name": "recommend.profiles", "command": find(PROFILE_COLLECTION, {"_id": {"$in": [user_id]}})},
+        {"name": "recommend.materialized", "command": find(MATERIALIZED_COLLECTION, {"_id": {"$in": [user_id]}})},
+        # admin.py
+        {"name": "admin.sales_trend", "command": aggregate(ROLLUP_COLLECTION, rollup("sales_trend", SALES_TREND_STAGES))},
+        {"name": "admin.revenue", "command": aggregate(ROLLUP_COLLECTION, rollup("revenue", DAILY_STAGES))},
+        {"name": "admin.heatmap", "command": aggregate(ROLLUP_COLLECTION, rollup("heatmap", HEATMAP_STAGES))},
+        {"name": "admin.calories_trend", "command": aggregate(ROLLUP_COLLECTION, rollup("calories_trend", DAILY_STAGES))},
+        {"name": "admin.dashboard", "command": aggregate(ROLLUP_COLLECTION, dashboard_pipeline())},
+        {"name": "admin.sales_trend_range", "command": aggregate(ROLLUP_COLLECTION, ranged(SALES_TREND_STAGES))},
+        {"name": "admin.revenue_range", "command": aggregate(ROLLUP_COLLECTION, ranged(DAILY_STAGES))},
+        {"name": "admin.heatmap_range", "command": aggregate(ROLLUP_COLLECTION, ranged(HEATMAP_STAGES))},
+        {"name": "admin.category_share_range", "command": aggregate(ROLLUP_COLLECTION, ranged(CATEGORY_SHARE_STAGES))},
+        {"name": "admin.calories_trend_range", "command": aggregate(ROLLUP_COLLECTION, ranged(DAILY_STAGES))},
+        {"name": "admin.dashboard_range", "command": aggregate(ROLLUP_COLLECTION, dashboard_pipeline(
+            start=range_start, end=range_end))},
+        {"name": "admin.procurement_guidance", "command": aggregate(ROLLUP_COLLECTION, [
+            rollup_since(HISTORY_DAYS - 1)] + PROCUREMENT_STAGES)},
+        # traffic_forecast.py (shared by both traffic endpoints)
+        {"name": "traffic.sync", "command": aggregate(ROLLUP_COLLECTION, [
+            {"$match": {"hour_start": {"$gte": now - timedelta(days=FORECAST_DAYS + 1)}}},
+            {"$group": {"_id": {"date": "$local_date", "hour": "$local_hour"}, "count": {"$sum": "$count"}}}])},
+        {"name": "admin.export_logs", "command": find(LOGS_COLLECTION, {
+            "action": "order", "timestamp": {"$gte": now - timedelta(days=7), "$lt": now}}, sort={"timestamp": 1})},
+        {"name": "admin.category_share", "full_scan": True,
+         "command": aggregate(ROLLUP_COLLECTION, CATEGORY_SHARE_STAGES)},
+        {"name": "admin.user_radar", "command": find(SUMMARY_COLLECTION, {"_id": SUMMARY_ID}, limit=1)},
+    ]
+
+
+def _walk(node):
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def summarize(explain: Dict) -> Dict:
+    """Plan stages, COLLSCAN flag and docs examined / returned of an explain() result."""
+    stages = set()
+    for plan in (n["winningPlan"] for n in _walk(explain) if "winningPlan" in n):
+        stages.update(n["stage"] for n in _walk(plan) if isinstance(n.get("stage"), str))
+    examined = returned = 0
+    for stats in (n for n in _walk(explain) if "executionSuccess" in n and "totalDocsExamined" in n):
+        examined += stats["totalDocsExamined"]
+        returned += stats["nReturned"]
+    return {
+        "stages": sorted(stages),
+        "collscan": "COLLSCAN" in stages,
+        "docs_examined": examined,
+        "returned": returned,
+        "ratio": examined / max(returned, 1),
+    }
+
+
+async def check(db, max_ratio: float = MAX_DOCS_EXAMINED_RATIO, verbose: bool = False) -> List[str]:
+    """Explain every catalogued query; returns the names of the failing ones."""
+    order = await db[LOGS_COLLECTION].find_one({"action": "order"})
+    if not order:
+        raise RuntimeError("logs_behavior has no orders; seed the database first")
+    queries = query_catalog(order["user_id"], order["dish_id"], datetime.now(pytz.UTC))
+
+    failures = []
+    for query in queries:
+        explain = await db.command("explain", query["command"], verbosity="executionStats")
+        summary = summarize(explain)
+        problems = []
+        if not query.get("full_scan"):
+            if summary["collscan"]:
+                problems.append("COLLSCAN")
+            if summary["ratio"] > max_ratio:
+                problems.append(f"examined/returned {summary['ratio']:.1f} > {max_ratio}")
+        status = "FAIL" if problems else ("SCAN" if query.get("full_scan") else "ok")
+        print(f"{status:4}  {query['name']:32} examined={summary['docs_examined']:<8} "
+              f"returned={summary['returned']:<8} {'; '.join(problems)}")
+        if verbose:
+            print(f"      stages: {', '.join(summary['stages'])}")
+        if problems:
+            failures.append(query["name"])
+    return failures
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Check the query plans of every router query")
+    parser.add_argument("--max-ratio", type=float, default=MAX_DOCS_EXAMINED_RATIO,
+                        help="Fail when docs examined per doc returned exceeds this")
+    parser.add_argument("--no-ensure", action="store_true", help="Do not create missing indexes first")
+    parser.add_argument("--verbose", action="store_true", help="Print the plan stages of every query")
+    args = parser.parse_args()
+
+    from database import db as database_instance
+
+    await database_instance.connect_db()
+    try:
+        db = database_instance.db
+        if not args.no_ensure:
+            await ensure_indexes(db)
+        failures = await check(db, args.max_ratio, args.verbose)
+    finally:
+        await database_instance.close_db()
+
+    if failures:
+        print(f"\n{len(failures)} queries need an index: {', '.join(failures)}")
+        sys.exit(1)
+    print("\nAll queries use an index")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
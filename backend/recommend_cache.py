@@ -0,0 +1,81 @@
+import json
+from typing import Dict, List, Optional
+
+from meal_periods import MEAL_PERIODS
+
+# Final recommendation lists, keyed by user, meal period, canteen and catalog version
+REC_CACHE_TTL = 600  # seconds
+HITS_KEY = "rec:cache:hits"
+MISSES_KEY = "rec:cache:misses"
+
+
+# Cache key segment for lists drawn from every canteen
+ALL_CANTEENS = "all"
+
+
+def cache_key(user_id: str, period: str, catalog_version: int, canteen: Optional[str] = None) -> str:
+    return f"rec:{user_id}:{period}:{canteen or ALL_CANTEENS}:{catalog_version}"
+
+
+async def get_cached(redis, user_ids: List[str], period: str, catalog_version: int,
+                     canteen: Optional[str] = None) -> Dict[str, list]:
+    """
+    Look up cached lists for the given users (one MGET) and count hits and
+    misses. Returns only the users that were found.
+    """
+    if not redis or not user_ids:
+        return {}
+    try:
+        values = await redis.mget([cache_key(uid, period, catalog_version, canteen) for uid in user_ids])
+        found = {uid: json.loads(v) for uid, v in zip(user_ids, values) if v is not None}
+        pipe = redis.pipeline()
+        if found:
+            pipe.incrby(HITS_KEY, len(found))
+        if len(found) < len(user_ids):
+            pipe.incrby(MISSES_KEY, len(user_ids) - len(found))
+        await pipe.execute()
+        return found
+    except Exception as e:
+        print(f"Redis Error while reading recommendation cache: {e}")
+        return {}
+
+
+async def set_cached(redis, results: Dict[str, list], period: str, catalog_version: int,
+                     canteen: Optional[str] = None):
+    if not redis or not results:
+        return
+    try:
+        pipe = redis.pipeline()
+        for uid, recommendations in results.items():
+            pipe.setex(cache_key(uid, period, catalog_version, canteen), REC_CACHE_TTL, json.dumps(recommendations, default=str))
+        await pipe.execute()
+    except Exception as e:
+        print(f"Redis Error while writing recommendation cache: {e}")
+
+
+async def invalidate_user(redis, user_id: str, catalog_version: int, canteens: List[str] = ()):
+    """Drop a user's cached lists for every meal period and canteen (e.g. after an order)."""
+    if not redis:
+        return
+    try:
+        keys = [cache_key(user_id, p, catalog_version, c) for p in MEAL_PERIODS for c in [None, *canteens]]
+        await redis.delete(*keys)
+    except Exception as e:
+        print(f"Redis Error while invalidating recommendation cache: {e}")
+
+
+async def get_stats(redis) -> Dict:
+    hits = misses = 0
+    if redis:
+        try:
+            hits, misses = await redis.mget(HITS_KEY, MISSES_KEY)
+            hits, misses = int(hits or 0), int(misses or 0)
+        except Exception as e:
+            print(f"Redis Error while reading cache stats: {e}")
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else 0.0,
+        "ttl_seconds": REC_CACHE_TTL
+    }
@@ -0,0 +1,145 @@
+"""
+Hourly order rollups for the admin analytics.
+
+`order_rollups_hourly` holds one document per (hour, dish) with at least
+one order:
+
+    {
+        "hour_start": datetime,    # UTC start of the hour
+        "dish_id": ObjectId,
+        "local_date": "2024-05-01",  # Shanghai local date / hour / weekday
+        "local_hour": 12,
+        "dow": 2,                  # 0 = Monday
+        "category": "川菜",          # from the order logs' dish snapshot
+        "count": 17,
+        "revenue": 204.0,          # sum of snapshot prices
+        "calories": 9350,          # sum of snapshot calories
+        "calories_count": 17       # orders whose snapshot has calories (dish known)
+    }
+
+Shanghai is a whole-hour offset from UTC without DST, so every UTC hour is
+exactly one local hour. Each order upserts its bucket with `$inc`; the
+collection can be rebuilt from logs_behavior at any time. Analytics then
+aggregate buckets instead of raw logs, without joining `dishes`.
+
+Usage:
+    python backend/rollups.py rebuild
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from typing import Dict
+
+import pytz
+from pymongo import UpdateOne
+
+from logs_storage import LOGS_COLLECTION
+from meal_periods import local_fields
+
+ROLLUP_COLLECTION = "order_rollups_hourly"
+
+# Buckets written per bulk_write during a rebuild
+REBUILD_BATCH_SIZE = 5000
+
+
+def hour_start(ts: datetime) -> datetime:
+    """UTC start of the hour a timestamp falls in (naive timestamps are UTC)."""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=pytz.UTC)
+    return ts.astimezone(pytz.UTC).replace(minute=0, second=0, microsecond=0)
+
+
+def _bucket_upsert(start: datetime, dish_id, count: int, revenue: float = 0, calories: float = 0,
+                   category: str = None, calories_count: int = 0):
+    """(filter, update) adding count orders (and their revenue / calories) to a bucket."""
+    return (
+        {"hour_start": start, "dish_id": dish_id},
+        {
+            "$inc": {"count": count, "revenue": revenue, "calories": calories, "calories_count": calories_count},
+            "$setOnInsert": {**local_fields(start), "category": category}
+        }
+    )
+
+
+async def record_order(db, log: Dict):
+    """Count one enriched order log (see order_logs.py) in its (hour, dish) bucket."""
+    # Orders of dishes unknown at order time have no calories and stay out of the average
+    calories = log.get("calories")
+    await db[ROLLUP_COLLECTION].update_one(*_bucket_upsert(
+        hour_start(log["timestamp"]), log["dish_id"], 1,
+        log.get("price") or 0, calories or 0, log.get("category"), int(calories is not None)
+    ), upsert=True)
+
+
+async def rebuild(db) -> int:
+    """
+    Recompute every bucket from logs_behavior into a scratch collection and
+    swap it in. Revenue, calories and category come from the logs' dish
+    snapshots, so run `order_logs.py backfill` first on older data. Orders
+    placed while the rebuild runs may be missed; run it when traffic is
+    low. Returns the number of buckets.
+    """
+    from indexes import ensure_collection_indexes
+
+    scratch = db[f"{ROLLUP_COLLECTION}_rebuild"]
+    await scratch.drop()
+    await ensure_collection_indexes(scratch, ROLLUP_COLLECTION)
+
+    pipeline = [
+        {"$match": {"action": "order"}},
+        {"$group": {
+            "_id": {
+                "hour": {"$dateToString": {"format": "%Y-%m-%dT%H", "date": "$timestamp"}},
+                "dish_id": "$dish_id"
+            },
+            "count": {"$sum": 1},
+            "revenue": {"$sum": {"$ifNull": ["$price", 0]}},
+            "calories": {"$sum": {"$ifNull": ["$calories", 0]}},
+            "calories_count": {"$sum": {"$cond": [{"$eq": [{"$ifNull": ["$calories", None]}, None]}, 0, 1]}},
+            "category": {"$last": "$category"}
+        }}
+    ]
+    buckets = 0
+    ops = []
+    async for row in db[LOGS_COLLECTION].aggregate(pipeline, allowDiskUse=True):
+        start = datetime.strptime(row["_id"]["hour"], "%Y-%m-%dT%H").replace(tzinfo=pytz.UTC)
+        ops.append(UpdateOne(*_bucket_upsert(
+            start, row["_id"]["dish_id"], row["count"], row["revenue"], row["calories"], row["category"],
+            row["calories_count"]
+        ), upsert=True))
+        if len(ops) >= REBUILD_BATCH_SIZE:
+            await scratch.bulk_write(ops, ordered=False)
+            buckets += len(ops)
+            ops = []
+    if ops:
+        await scratch.bulk_write(ops, ordered=False)
+        buckets += len(ops)
+
+    if buckets:
+        await scratch.rename(ROLLUP_COLLECTION, dropTarget=True)
+    else:
+        await db[ROLLUP_COLLECTION].delete_many({})
+        await scratch.drop()
+    return buckets
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Maintain order_rollups_hourly")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="Recompute every bucket from logs_behavior")
+    parser.parse_args()
+
+    from database import db as database_instance
+
+    await database_instance.connect_db()
+    try:
+        start = time.time()
+        count = await rebuild(database_instance.db)
+        print(f"Rebuilt {count} hourly buckets in {time.time() - start:.2f} seconds")
+    finally:
+        await database_instance.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,472 +1,390 @@
-from fastapi import APIRouter, Depends
-from database import db, get_database
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from database import db, get_database, get_redis
+from engine_manager import get_engine
+from rollups import ROLLUP_COLLECTION, hour_start
+from analytics_store import analytics_store
+from traffic_forecast import traffic_forecaster
+from sketches import CMS_ENABLED, dish_counts, unique_users
+from meal_periods import TZ_SHANGHAI
+from preference_summary import radar as preference_radar
+from export import FORMATS, catalog_map, export_stream, parquet_available, parse_time
+from procurement import procurement_plan, history_dates, HISTORY_DAYS, MAX_HORIZON
+from analytics_cache import swr_cache, invalidate as invalidate_analytics_cache, CACHED_ENDPOINTS
 from datetime import datetime, timedelta
 import pytz
-from bson import ObjectId
 
 router = APIRouter()
 
-@router.get("/analytics/sales_trend")
-async def get_sales_trend():
-    # Last 7 days
-    end_date = datetime.now(pytz.UTC)
-    start_date = end_date - timedelta(days=6)
-    
+# All analytics read the hourly rollups (see rollups.py), never raw logs_behavior.
+# With ANALYTICS_STORE=1 the in-memory columnar store (analytics_store.py)
+# answers sales trend, revenue, heatmap, category share and calories instead
+# (revenue and calories from the same order-time snapshots).
+# Buckets carry revenue, calories and category from the order logs' dish
+# snapshots (order_logs.py), so no chart joins the catalog.
+# Chart endpoints are wrapped in swr_cache (analytics_cache.py): results are
+# served from Redis and refreshed in the background once their TTL passes.
+#
+# Each chart is a list of rollup stages plus a formatter, so the same chart
+# can run as its own endpoint or as one facet of /analytics/dashboard.
+# Charts take optional start / end parameters (rollup_window); the range is
+# matched on hour_start, so only the buckets inside it are read.
+
+def rollup_since(days: int) -> dict:
+    """$match on buckets from the start of the hour `days` days ago."""
+    start_date = datetime.now(pytz.UTC) - timedelta(days=days)
+    return {"$match": {"hour_start": {"$gte": start_date.replace(minute=0, second=0, microsecond=0)}}}
+
+def parse_range(start: str = None, end: str = None):
+    """UTC datetimes of the start / end query parameters (ISO, Shanghai time unless an offset is given)."""
+    try:
+        start_time, end_time = parse_time(start), parse_time(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start / end must be ISO dates or datetimes")
+    if start_time and end_time and start_time >= end_time:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return start_time, end_time
+
+def rollup_window(days: int = None, start: datetime = None, end: datetime = None) -> list:
+    """
+    $match stages for buckets in [start, end) (rounded down to the hour) or,
+    without either, the last `days` days (None = every bucket). Only the
+    hour_start index range is read.
+    """
+    if start or end:
+        bounds = {}
+        if start:
+            bounds["$gte"] = hour_start(start)
+        if end:
+            bounds["$lt"] = hour_start(end)
+        return [{"$match": {"hour_start": bounds}}]
+    return [rollup_since(days)] if days is not None else []
+
+async def run_rollup(stages: list) -> list:
     database = await get_database()
-    
-    pipeline = [
-        {
-            "$match": {
-                "action": "order",
-                "timestamp": {"$gte": start_date}
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "$dateToString": {
-                        "format": "%Y-%m-%d %H:00", 
-                        "date": "$timestamp",
-                        "timezone": "Asia/Shanghai"
-                    }
-                },
-                "count": {"$sum": 1}
-            }
-        },
-        {"$sort": {"_id": 1}}
-    ]
-    
-    results = await database.logs_behavior.aggregate(pipeline).to_list(length=None)
-    
-    dates = [r["_id"] for r in results]
+    return await database[ROLLUP_COLLECTION].aggregate(stages).to_list(length=None)
+
+# Time window (days) of each chart; None = all buckets
+CHART_WINDOWS = {
+    "sales_trend": 6,
+    "revenue": 29,
+    "heatmap": 30,
+    "category_share": None,
+    "calories_trend": 6,
+}
+
+SALES_TREND_STAGES = [
+    {
+        "$group": {
+            "_id": {"date": "$local_date", "hour": "$local_hour"},
+            "count": {"$sum": "$count"}
+        }
+    },
+    {"$sort": {"_id.date": 1, "_id.hour": 1}}
+]
+
+# Per day; shared by revenue and calories
+DAILY_STAGES = [
+    {
+        "$group": {
+            "_id": "$local_date",
+            "count": {"$sum": "$count"},
+            "revenue": {"$sum": "$revenue"},
+            "calories": {"$sum": "$calories"},
+            # Buckets written before calories_count existed count every order
+            "calories_count": {"$sum": {"$ifNull": ["$calories_count", "$count"]}}
+        }
+    },
+    {"$sort": {"_id": 1}}
+]
+
+HEATMAP_STAGES = [
+    {
+        "$group": {
+            "_id": {"day": "$dow", "hour": "$local_hour"},
+            "count": {"$sum": "$count"}
+        }
+    }
+]
+
+CATEGORY_SHARE_STAGES = [
+    {
+        "$group": {
+            "_id": "$category",
+            "count": {"$sum": "$count"}
+        }
+    },
+    {"$sort": {"count": -1}}
+]
+
+# Daily sales per dish, for procurement guidance
+PROCUREMENT_STAGES = [
+    {
+        "$group": {
+            "_id": {"dish_id": "$dish_id", "date": "$local_date"},
+            "daily_count": {"$sum": "$count"}
+        }
+    }
+]
+
+def format_sales_trend(results: list) -> dict:
+    dates = [f"{r['_id']['date']} {r['_id']['hour']:02d}:00" for r in results]
     counts = [r["count"] for r in results]
-    
     return {"dates": dates, "counts": counts}
 
-@router.get("/analytics/revenue")
-async def get_revenue_trend():
-    # Last 30 days
-    end_date = datetime.now(pytz.UTC)
-    start_date = end_date - timedelta(days=29)
-    
-    database = await get_database()
-    
-    # OPTIMIZATION: Pre-load all dishes into memory to avoid $lookup
-    all_dishes = await database.dishes.find({}, {"_id": 1, "price": 1}).to_list(length=1000)
-    dish_prices = {str(d["_id"]): d["price"] for d in all_dishes}
-    
-    # Simplified pipeline without expensive $lookup
-    pipeline = [
-        {
-            "$match": {
-                "action": "order",
-                "timestamp": {"$gte": start_date}
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "date": {
-                        "$dateToString": {
-                            "format": "%Y-%m-%d", 
-                            "date": "$timestamp",
-                            "timezone": "Asia/Shanghai"
-                        }
-                    },
-                    "dish_id": "$dish_id"
-                },
-                "count": {"$sum": 1}
-            }
-        },
-        {"$sort": {"_id.date": 1}}
-    ]
-    
-    results = await database.logs_behavior.aggregate(pipeline).to_list(length=None)
-    
-    # Calculate revenue in Python using pre-loaded prices
-    revenue_by_date = {}
-    for r in results:
-        date = r["_id"]["date"]
-        dish_id_str = str(r["_id"]["dish_id"])
-        count = r["count"]
-        price = dish_prices.get(dish_id_str, 0)
-        revenue_by_date[date] = revenue_by_date.get(date, 0) + (price * count)
-    
-    # Sort by date
-    sorted_dates = sorted(revenue_by_date.keys())
-    dates = sorted_dates
-    values = [revenue_by_date[d] for d in sorted_dates]
-    
-    return {"dates": dates, "values": values}
+def format_revenue(results: list) -> dict:
+    # Rows are already one per day, sorted by date
+    return {"dates": [r["_id"] for r in results], "values": [r["revenue"] for r in results]}
 
-@router.get("/analytics/heatmap")
-async def get_heatmap():
-    # Last 30 days
-    end_date = datetime.now(pytz.UTC)
-    start_date = end_date - timedelta(days=30)
-    
-    database = await get_database()
-    
-    pipeline = [
-        {
-            "$match": {
-                "action": "order",
-                "timestamp": {"$gte": start_date}
-            }
-        },
-        {
-            "$project": {
-                "dayOfWeek": {
-                    "$dayOfWeek": {
-                        "date": "$timestamp",
-                        "timezone": "Asia/Shanghai"
-                    }
-                },
-                "hour": {
-                    "$hour": {
-                        "date": "$timestamp",
-                        "timezone": "Asia/Shanghai"
-                    }
-                }
-            }
-        },
-        {
-            "$group": {
-                "_id": {"day": "$dayOfWeek", "hour": "$hour"},
-                "count": {"$sum": 1}
-            }
-        }
-    ]
-    
-    results = await database.logs_behavior.aggregate(pipeline).to_list(length=None)
-    
+def format_heatmap(results: list) -> list:
     # ECharts heatmap format: [x, y, value]
-    # x: hour (0-23), y: day (0-6, Mon-Sun)
-    # MongoDB $dayOfWeek: 1 (Sun) - 7 (Sat)
-    # Map Mongo day to ECharts day: Sun(1)->6, Mon(2)->0, ..., Sat(7)->5
-    
+    # x: hour (0-23), y: day (0-6, Mon-Sun); rollups already store dow as 0 = Monday
     data = []
     for r in results:
-        mongo_day = r["_id"]["day"]
-        hour = r["_id"]["hour"]
-        count = r["count"]
-        
-        # Convert 1-7 (Sun-Sat) to 0-6 (Mon-Sun)
-        # 1->6, 2->0, 3->1, 4->2, 5->3, 6->4, 7->5
-        echarts_day = (mongo_day - 2) % 7
-        
-        data.append([hour, echarts_day, count])
-        
+        data.append([r["_id"]["hour"], r["_id"]["day"], r["count"]])
     return data
 
-@router.get("/analytics/category_share")
-async def get_category_share():
-    database = await get_database()
-    
-    # OPTIMIZATION: Pre-load all dish categories into memory to avoid $lookup
-    all_dishes = await database.dishes.find({}, {"_id": 1, "category": 1}).to_list(length=1000)
-    dish_categories = {str(d["_id"]): d["category"] for d in all_dishes}
-    
-    # Simplified pipeline without expensive $lookup
-    pipeline = [
-        {"$match": {"action": "order"}},
-        {
-            "$group": {
-                "_id": "$dish_id",
-                "count": {"$sum": 1}
-            }
-        }
-    ]
-    
-    results = await database.logs_behavior.aggregate(pipeline).to_list(length=None)
-    
-    # Calculate category counts in Python using pre-loaded categories
+def format_category_share(results: list) -> list:
+    # Orders of dishes unknown at order time have no category
     category_counts = {}
     for r in results:
-        dish_id_str = str(r["_id"])
-        category = dish_categories.get(dish_id_str, "未知")
+        category = r["_id"] or "未知"
         category_counts[category] = category_counts.get(category, 0) + r["count"]
     
     # Sort by count descending
     data = [{"name": cat, "value": count} for cat, count in category_counts.items()]
     data.sort(key=lambda x: x["value"], reverse=True)
-    
     return data
 
+def format_calories_trend(results: list) -> dict:
+    # Average calories per order, over orders whose dish snapshot has calories
+    dates = [r["_id"] for r in results if r["calories_count"]]
+    values = [round(r["calories"] / r["calories_count"], 0) for r in results if r["calories_count"]]
+    return {"dates": dates, "values": values}
+
+def format_traffic(forecast: dict) -> dict:
+    return {
+        "hours": [f"{h}点" for h in range(24)],
+        "predicted_traffic": [int(v) for v in forecast["hourly"]],
+        "current_hour": forecast["current_hour"],
+        "day_type": forecast["day_type"]
+    }
+
+@router.get("/analytics/sales_trend")
+@swr_cache("sales_trend", ttl=60)
+async def get_sales_trend(start: str = None, end: str = None):
+    # Last 7 days unless start / end are given
+    start_time, end_time = parse_range(start, end)
+    if analytics_store.ready:
+        return analytics_store.sales_trend(days=6, start=start_time, end=end_time)
+    results = await run_rollup(rollup_window(CHART_WINDOWS["sales_trend"], start_time, end_time) + SALES_TREND_STAGES)
+    return format_sales_trend(results)
+
+@router.get("/analytics/revenue")
+@swr_cache("revenue", ttl=300)
+async def get_revenue_trend(start: str = None, end: str = None):
+    # Last 30 days unless start / end are given
+    start_time, end_time = parse_range(start, end)
+    if analytics_store.ready:
+        return analytics_store.revenue_trend(days=29, start=start_time, end=end_time)
+    results = await run_rollup(rollup_window(CHART_WINDOWS["revenue"], start_time, end_time) + DAILY_STAGES)
+    return format_revenue(results)
+
+@router.get("/analytics/heatmap")
+@swr_cache("heatmap", ttl=300)
+async def get_heatmap(start: str = None, end: str = None):
+    # Last 30 days unless start / end are given
+    start_time, end_time = parse_range(start, end)
+    if analytics_store.ready:
+        return analytics_store.heatmap(days=30, start=start_time, end=end_time)
+    results = await run_rollup(rollup_window(CHART_WINDOWS["heatmap"], start_time, end_time) + HEATMAP_STAGES)
+    return format_heatmap(results)
+
+@router.get("/analytics/category_share")
+@swr_cache("category_share", ttl=600)
+async def get_category_share(start: str = None, end: str = None):
+    # All time unless start / end are given
+    start_time, end_time = parse_range(start, end)
+    engine = await get_engine()
+    if analytics_store.ready:
+        return analytics_store.category_share(engine, start=start_time, end=end_time)
+    results = await run_rollup(rollup_window(None, start_time, end_time) + CATEGORY_SHARE_STAGES)
+    return format_category_share(results)
+
+@router.post("/analytics/cache/invalidate")
+async def invalidate_analytics(endpoint: str = None):
+    """Drop cached analytics results: one endpoint (e.g. ?endpoint=heatmap) or all of them."""
+    if endpoint and endpoint not in CACHED_ENDPOINTS:
+        raise HTTPException(status_code=404, detail=f"Unknown cached endpoint: {endpoint}")
+    redis = await get_redis()
+    deleted = await invalidate_analytics_cache(redis, endpoint)
+    return {"invalidated": endpoint or "all", "keys": deleted}
+
+@router.get("/export/logs")
+async def export_logs(start: str = None, end: str = None, format: str = "csv", action: str = "order"):
+    """
+    Stream logs in [start, end) as csv / ndjson / parquet (see export.py).
+    Times are ISO dates or datetimes, Shanghai time unless an offset is given.
+    """
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=400, detail="Parquet export needs pyarrow on the server")
+    start_time, end_time = parse_range(start, end)
+
+    engine = await get_engine()
+    media_type, extension = FORMATS[format]
+    stream = export_stream(await get_database(), catalog_map(engine.dishes), format,
+                           start_time, end_time, action or None)
+    filename = f"logs_{start or 'all'}_{end or 'now'}.{extension}".replace(":", "")
+    return StreamingResponse(stream, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@router.get("/analytics/store")
+async def get_analytics_store_report():
+    """Memory report of the in-memory columnar analytics store."""
+    return analytics_store.memory_report()
+
 @router.get("/analytics/user_radar")
+@swr_cache("user_radar", ttl=600)
 async def get_user_radar():
-    # Calculate average preference scores across all users
-    # This is a simplification. Ideally we'd aggregate user.preferences
-    
-    database = await get_database()
-    users = await database.users.find({}, {"preferences": 1}).to_list(length=1000)
-    
-    # Define standard dimensions
-    dimensions = ["辣", "甜", "咸", "酸", "鲜", "油"]
-    totals = {d: 0.0 for d in dimensions}
-    counts = {d: 0 for d in dimensions}
-    
-    for u in users:
-        prefs = u.get("preferences", {})
-        for k, v in prefs.items():
-            # Map some common tags to dimensions if needed, or just use exact matches
-            # For now assuming preferences keys match dimensions or are close
-            if k in totals:
-                totals[k] += v
-                counts[k] += 1
-            elif "辣" in k: 
-                totals["辣"] += v
-                counts["辣"] += 1
-            # ... add more mapping logic if needed
-            
-    # Default values if no data
-    values = []
-    for d in dimensions:
-        if counts[d] > 0:
-            values.append(round(totals[d] / counts[d], 1))
-        else:
-            values.append(3.0) # Default middle score
-            
-    indicators = [{"name": d, "max": 5} for d in dimensions]
-    
-    return {"indicators": indicators, "values": values}
+    # Mean preference score per radar dimension over all users, from the
+    # running totals in preference_summary.py (one document read)
+    return await preference_radar(await get_database())
 
 @router.get("/analytics/calories_trend")
-async def get_calories_trend():
-    # Last 7 days
-    end_date = datetime.now(pytz.UTC)
-    start_date = end_date - timedelta(days=6)
-    
-    database = await get_database()
-    
-    pipeline = [
-        {
-            "$match": {
-                "action": "order",
-                "timestamp": {"$gte": start_date}
-            }
-        },
-        {
-            "$lookup": {
-                "from": "dishes",
-                "localField": "dish_id",
-                "foreignField": "_id",
-                "as": "dish"
-            }
-        },
-        {"$unwind": "$dish"},
-        {
-            "$group": {
-                "_id": {
-                    "$dateToString": {
-                        "format": "%Y-%m-%d", 
-                        "date": "$timestamp",
-                        "timezone": "Asia/Shanghai"
-                    }
-                },
-                "total_calories": {"$sum": "$dish.calories"},
-                "order_count": {"$sum": 1}
-            }
-        },
-        {
-            "$project": {
-                "avg_calories": {"$divide": ["$total_calories", "$order_count"]}
-            }
-        },
-        {"$sort": {"_id": 1}}
-    ]
-    
-    results = await database.logs_behavior.aggregate(pipeline).to_list(length=None)
-    
-    dates = [r["_id"] for r in results]
-    values = [round(r["avg_calories"], 0) for r in results]
-    
-    return {"dates": dates, "values": values}
+@swr_cache("calories_trend", ttl=300)
+async def get_calories_trend(start: str = None, end: str = None):
+    # Last 7 days unless start / end are given
+    start_time, end_time = parse_range(start, end)
+    if analytics_store.ready:
+        return analytics_store.calories_trend(days=6, start=start_time, end=end_time)
+    results = await run_rollup(rollup_window(CHART_WINDOWS["calories_trend"], start_time, end_time) + DAILY_STAGES)
+    return format_calories_trend(results)
 
 @router.get("/analytics/traffic_prediction")
+@swr_cache("traffic_prediction", ttl=600)
 async def get_traffic_prediction():
     """
-    Predict daily traffic flow based on historical data (last 30 days).
-    Returns predicted traffic for each hour (0-23).
+    Predict today's traffic for each hour (0-23) from the shared in-memory
+    weekday x hour profile (traffic_forecast.py, last 4 weeks).
     """
-    # Last 30 days
-    end_date = datetime.now(pytz.UTC)
-    start_date = end_date - timedelta(days=30)
-    
-    database = await get_database()
-    
-    pipeline = [
-        {
-            "$match": {
-                "action": "order",
-                "timestamp": {"$gte": start_date}
-            }
-        },
-        {
-            "$project": {
-                "hour": {
-                    "$hour": {
-                        "date": "$timestamp",
-                        "timezone": "Asia/Shanghai"
-                    }
-                },
-                "day": {
-                    "$dayOfYear": {
-                        "date": "$timestamp",
-                        "timezone": "Asia/Shanghai"
-                    }
-                }
-            }
-        },
-        {
-            "$group": {
-                "_id": {"day": "$day", "hour": "$hour"},
-                "count": {"$sum": 1}
-            }
-        },
+    return format_traffic(await traffic_forecaster.forecast(await get_database()))
+
+def sketch_day(date: str = None):
+    """(local date, current hour) for today, or (date, None) for a given YYYY-MM-DD."""
+    if not date:
+        now = datetime.now(TZ_SHANGHAI)
+        return now.strftime("%Y-%m-%d"), now.hour
+    try:
+        return datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d"), None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD")
+
+async def sketch_dish_counts(redis, engine, local_date: str):
+    result = await dish_counts(redis, local_date, list(engine.dishes))
+    for row in (result or {}).get("counts", []):
+        row["name"] = engine.dishes[row["dish_id"]].get("name")
+    return result
+
+@router.get("/analytics/unique_users")
+async def get_unique_users(date: str = None):
+    """
+    Distinct students today (or on `date`), in each hour of it and in its ISO
+    week, from the HyperLogLogs of sketches.py: O(1) reads, 0.81% standard error.
+    """
+    local_date, hour = sketch_day(date)
+    result = await unique_users(await get_redis(), local_date, hour)
+    if result is None:
+        raise HTTPException(status_code=503, detail="Redis is unavailable")
+    return result
+
+@router.get("/analytics/dish_counts")
+async def get_dish_counts(date: str = None):
+    """
+    Orders per dish today (or on `date`) from the count-min sketch of
+    sketches.py (SKETCH_CMS=1); never under-counts, error bound in "error".
+    """
+    if not CMS_ENABLED:
+        raise HTTPException(status_code=400, detail="Per-dish sketches are off (set SKETCH_CMS=1)")
+    local_date, _ = sketch_day(date)
+    result = await sketch_dish_counts(await get_redis(), await get_engine(), local_date)
+    if result is None:
+        raise HTTPException(status_code=503, detail="Redis is unavailable")
+    return result
+
+def dashboard_pipeline(category_days: int = 30, start: datetime = None, end: datetime = None) -> list:
+    """One $match on the widest window (or [start, end)), then a $facet per chart."""
+    ranged = bool(start or end)
+    widest = max(category_days, *(w for w in CHART_WINDOWS.values() if w is not None))
+
+    def facet(chart: str, stages: list) -> list:
+        window = CHART_WINDOWS[chart]
+        window = category_days if window is None else window
+        return ([rollup_since(window)] if window < widest and not ranged else []) + stages
+
+    return [
+        *rollup_window(widest, start, end),
         {
-            "$group": {
-                "_id": "$_id.hour",
-                "avg_count": {"$avg": "$count"}
+            "$facet": {
+                "sales_trend": facet("sales_trend", SALES_TREND_STAGES),
+                "revenue": facet("revenue", DAILY_STAGES),
+                "heatmap": facet("heatmap", HEATMAP_STAGES),
+                "category_share": facet("category_share", CATEGORY_SHARE_STAGES),
+                "calories_trend": facet("calories_trend", DAILY_STAGES),
             }
-        },
-        {"$sort": {"_id": 1}}
+        }
     ]
-    
-    results = await database.logs_behavior.aggregate(pipeline).to_list(length=None)
-    
-    # Fill missing hours with 0
-    hours_data = {r["_id"]: r["avg_count"] for r in results}
-    
-    hours = list(range(24))
-    predicted_traffic = [int(hours_data.get(h, 0)) for h in hours]
-    
-    # Get current hour traffic for comparison
-    current_hour = datetime.now(pytz.timezone('Asia/Shanghai')).hour
-    
-    return {
-        "hours": [f"{h}点" for h in hours],
-        "predicted_traffic": predicted_traffic,
-        "current_hour": current_hour
+
+@router.get("/analytics/dashboard")
+@swr_cache("dashboard", ttl=60)
+async def get_dashboard(category_days: int = 30, start: str = None, end: str = None):
+    """
+    Every dashboard chart in one response from a single scan: one $match on
+    the widest window, then a $facet per chart that narrows to its own window.
+    Traffic comes from the in-memory forecaster and unique students / dish
+    counts from the Redis sketches instead; those two are left out while Redis
+    is unavailable.
+    Category share covers the last `category_days` days here (the standalone
+    endpoint is all-time), so the scan stays bounded.
+    With start / end every chart covers that range instead.
+    """
+    start_time, end_time = parse_range(start, end)
+    results = await run_rollup(dashboard_pipeline(category_days, start_time, end_time))
+    facets = results[0] if results else {}
+    redis = await get_redis()
+    today, hour = sketch_day()
+
+    dashboard = {
+        "sales_trend": format_sales_trend(facets.get("sales_trend", [])),
+        "revenue": format_revenue(facets.get("revenue", [])),
+        "heatmap": format_heatmap(facets.get("heatmap", [])),
+        "category_share": format_category_share(facets.get("category_share", [])),
+        "calories_trend": format_calories_trend(facets.get("calories_trend", [])),
+        "traffic_prediction": format_traffic(await traffic_forecaster.forecast(await get_database())),
     }
+    users = await unique_users(redis, today, hour)
+    if users is not None:
+        dashboard["unique_users"] = users
+    if CMS_ENABLED:
+        counts = await sketch_dish_counts(redis, await get_engine(), today)
+        if counts is not None:
+            dashboard["dish_counts"] = counts
+    return dashboard
 
 @router.get("/analytics/procurement_guidance")
-async def get_procurement_guidance():
+@swr_cache("procurement_guidance", ttl=1800)
+async def get_procurement_guidance(horizon: int = Query(1, ge=1, le=MAX_HORIZON)):
     """
     Generate procurement guidance based on sales forecast.
-    Uses Linear Regression on last 14 days data to predict next day needs.
+    Fits a linear trend to each dish's last 14 days of sales (all dishes in
+    one least-squares step, see procurement.py) and sums the predicted
+    ingredient needs over the next `horizon` days.
     """
-    from ingredient_map import DISH_INGREDIENTS_MAP
-    import numpy as np
-    try:
-        from sklearn.linear_model import LinearRegression
-    except ImportError:
-        print("Scikit-learn not found, falling back to simple average.")
-        LinearRegression = None
-    
-    # Last 14 days for prediction base (more data for regression)
-    end_date = datetime.now(pytz.UTC)
-    start_date = end_date - timedelta(days=13)
-    
-    database = await get_database()
-    
-    # Get daily sales per dish
-    pipeline = [
-        {
-            "$match": {
-                "action": "order",
-                "timestamp": {"$gte": start_date}
-            }
-        },
-        {
-            "$group": {
-                "_id": {
-                    "dish_id": "$dish_id",
-                    "date": {
-                        "$dateToString": {
-                            "format": "%Y-%m-%d", 
-                            "date": "$timestamp",
-                            "timezone": "Asia/Shanghai"
-                        }
-                    }
-                },
-                "daily_count": {"$sum": 1}
-            }
-        },
-        {"$sort": {"_id.date": 1}}
-    ]
-    
-    sales_data = await database.logs_behavior.aggregate(pipeline).to_list(length=None)
-    
-    # Organize data by dish: {dish_id: {date_str: count}}
-    dish_sales_history = {}
-    all_dates = sorted(list(set([d["_id"]["date"] for d in sales_data])))
-    
-    # Create a date index map for regression (0, 1, 2...)
-    date_to_idx = {date: i for i, date in enumerate(all_dates)}
-    
-    for record in sales_data:
-        dish_id = str(record["_id"]["dish_id"])
-        date = record["_id"]["date"]
-        count = record["daily_count"]
-        
-        if dish_id not in dish_sales_history:
-            dish_sales_history[dish_id] = {}
-        dish_sales_history[dish_id][date] = count
-        
-    # Get dish names
-    dish_ids = [ObjectId(did) for did in dish_sales_history.keys()]
-    dishes = await database.dishes.find({"_id": {"$in": dish_ids}}, {"name": 1}).to_list(length=None)
-    dish_map = {str(d["_id"]): d["name"] for d in dishes}
-    
-    # Calculate ingredient needs based on prediction
-    ingredient_totals = {}
-    
-    # Next day index (if we have N days 0..N-1, next is N)
-    next_day_idx = len(all_dates)
-    
-    for dish_id, history in dish_sales_history.items():
-        dish_name = dish_map.get(dish_id, "")
-        
-        # Prepare X (days) and y (sales)
-        # Fill missing days with 0
-        X = []
-        y = []
-        for date in all_dates:
-            X.append([date_to_idx[date]])
-            y.append(history.get(date, 0))
-            
-        predicted_sales = 0
-        
-        if LinearRegression and len(y) > 1:
-            try:
-                model = LinearRegression()
-                model.fit(X, y)
-                # Predict next day
-                prediction = model.predict([[next_day_idx]])
-                predicted_sales = max(0, prediction[0]) # No negative sales
-            except Exception as e:
-                print(f"Prediction error for {dish_name}: {e}")
-                predicted_sales = sum(y) / len(y) # Fallback to average
-        else:
-            # Fallback if not enough data or no sklearn
-            predicted_sales = sum(y) / len(y) if y else 0
-            
-        # Get ingredients for this dish
-        ingredients = DISH_INGREDIENTS_MAP.get(dish_name, DISH_INGREDIENTS_MAP["default"])
-        
-        for ing_name, amount_per_dish in ingredients.items():
-            total_needed = predicted_sales * amount_per_dish
-            ingredient_totals[ing_name] = ingredient_totals.get(ing_name, 0) + total_needed
-            
-    # Sort by quantity descending
-    sorted_ingredients = sorted(ingredient_totals.items(), key=lambda x: x[1], reverse=True)
-    
-    # Take top 10 for display
-    top_ingredients = sorted_ingredients[:10]
-    
-    return {
-        "ingredients": [i[0] for i in top_ingredients],
-        "quantities": [round(i[1], 1) for i in top_ingredients],
-        "units": ["kg"] * len(top_ingredients)
-    }
+    engine = await get_engine()
+
+    sales_data = await run_rollup([rollup_since(HISTORY_DAYS - 1)] + PROCUREMENT_STAGES)
+
+    today = datetime.now(pytz.timezone('Asia/Shanghai')).date()
+    dish_names = {did: d.get("name", "") for did, d in engine.dishes.items()}
+    return procurement_plan(sales_data, history_dates(today), dish_names, horizon=horizon)
@@ -1,10 +1,25 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from database import get_database, get_redis
+from logs_storage import LOGS_COLLECTION
+from engine_manager import get_engine
+from user_profiles import record_order
+from recommend_cache import invalidate_user
+from popularity import record_order as record_popularity
+from rollups import record_order as record_rollup
+from sketches import record_order as record_sketches
+from live_feed import live_feed, record_order as record_live, sse_events, MAX_UPDATES_PER_SECOND, MIN_UPDATES_PER_SECOND
+from order_logs import build_order_log
+from traffic_forecast import traffic_forecaster
+from analytics_store import analytics_store
+from collaborative_engine import cf_manager
 from models import Dish, LogBehavior
 from pydantic import BaseModel
 from datetime import datetime
 from typing import List
+import asyncio
 import json
+import pytz
 
 router = APIRouter()
 
@@ -56,13 +71,14 @@ async def get_leaderboard():
     # 2. 降级逻辑：Redis 挂了或为空，直接查 MongoDB 聚合统计
     print("Cache Miss: Loading leaderboard from MongoDB")
     pipeline = [
+        {"$match": {"action": "order"}},  # 走 action_dish 索引，避免全表扫描
         {"$group": {"_id": "$dish_id", "count": {"$sum": 1}}},
         {"$sort": {"count": -1}},
         {"$limit": 10}
     ]
     
     # 注意：这里假设 logs_behavior 表中有数据
-    cursor = db.logs_behavior.aggregate(pipeline)
+    cursor = db[LOGS_COLLECTION].aggregate(pipeline)
     top_dishes = await cursor.to_list(length=10)
     
     for item in top_dishes:
@@ -89,21 +105,26 @@ class OrderRequest(BaseModel):
 async def order_dish(order: OrderRequest):
     """
     用户点餐接口。
-    1. 写入 MongoDB 日志 (logs_behavior)
+    1. 写入 MongoDB 日志 (logs_behavior，含菜品快照与本地时间字段)
     2. 更新 Redis 实时销量榜 (ZINCRBY)
+    3. 增量更新用户画像 (user_profiles)、协同过滤矩阵和时段热度榜 (pop:*)，清除该用户的推荐缓存
+    4. 累加小时聚合桶 (order_rollups_hourly)、客流预测的当前小时计数，并追加到内存列式分析库 (若开启)，供管理端统计使用
+    5. 写入独立学生数 HyperLogLog 和菜品 count-min 计数 (sketches.py)
+    6. 累加实时计数器并发布到 live:orders，由 live_feed 合并推送给已连接的看板
     """
     db = await get_database()
     redis = await get_redis()
+    engine = await get_engine()
     
-    # 1. 写入日志
+    # 1. 写入日志：附带菜品快照 (价格/热量/分类) 和本地时间字段，时间戳统一存 UTC
     from bson import ObjectId
-    log_dict = {
-        "user_id": ObjectId(order.user_id),
-        "dish_id": ObjectId(order.dish_id),
-        "action": "order",
-        "timestamp": datetime.now()
-    }
-    await db.logs_behavior.insert_one(log_dict)
+    log_dict = build_order_log(
+        ObjectId(order.user_id),
+        ObjectId(order.dish_id),
+        engine.dishes.get(order.dish_id),
+        datetime.now(pytz.UTC)
+    )
+    await db[LOGS_COLLECTION].insert_one(log_dict)
     
     # 2. 更新 Redis 排行榜
     if redis:
@@ -112,6 +133,30 @@ async def order_dish(order: OrderRequest):
         except Exception as e:
             print(f"Redis Error during order update: {e}")
             # Continue execution, do not fail the order
+
+    # 3. 增量更新用户画像 (user_profiles)，并让推荐缓存失效 (冷却期立即生效)
+    cf_manager.record_order(order.user_id, order.dish_id, log_dict["timestamp"])
+    try:
+        await record_order(db, engine, log_dict["user_id"], log_dict["dish_id"], log_dict["timestamp"])
+    except Exception as e:
+        print(f"Profile update error: {e}")
+    await record_popularity(redis, engine, order.dish_id, log_dict["timestamp"])
+    await invalidate_user(redis, str(log_dict["user_id"]), engine.catalog_version, engine.canteens)
+
+    # 4. 更新小时聚合桶
+    try:
+        await record_rollup(db, log_dict)
+    except Exception as e:
+        print(f"Rollup update error: {e}")
+    traffic_forecaster.record_order(log_dict["timestamp"])
+    analytics_store.append(order.user_id, order.dish_id, log_dict["timestamp"],
+                           log_dict.get("price"), log_dict.get("calories"))
+
+    # 5. 更新近似计数 (独立学生数 / 菜品销量)
+    await record_sketches(redis, order.user_id, order.dish_id, log_dict["timestamp"])
+
+    # 6. 实时推送 (订单速率 / 排行榜 / 当前小时客流)
+    await record_live(redis, order.dish_id, log_dict["timestamp"])
         
     return {"message": "Order placed successfully"}
 
@@ -119,65 +164,18 @@ async def order_dish(order: OrderRequest):
 async def get_traffic_prediction():
     """
     获取食堂实时拥挤度预测及全天趋势。
-    基于历史数据（过去 30 天）计算每小时的平均订单量。
+    由 traffic_forecast 在内存中按星期几 × 小时维护近 4 周的客流画像 (区分工作日/周末)，
+    每小时增量同步一次，请求本身不再查询数据库。
     """
     db = await get_database()
+    forecast = await traffic_forecaster.forecast(db)
     
-    # Last 30 days
-    import pytz
-    from datetime import timedelta
-    
-    end_date = datetime.now(pytz.UTC)
-    start_date = end_date - timedelta(days=30)
-    
-    pipeline = [
-        {
-            "$match": {
-                "action": "order",
-                "timestamp": {"$gte": start_date}
-            }
-        },
-        {
-            "$project": {
-                "hour": {
-                    "$hour": {
-                        "date": "$timestamp",
-                        "timezone": "Asia/Shanghai"
-                    }
-                },
-                "day": {
-                    "$dayOfYear": {
-                        "date": "$timestamp",
-                        "timezone": "Asia/Shanghai"
-                    }
-                }
-            }
-        },
-        {
-            "$group": {
-                "_id": {"day": "$day", "hour": "$hour"},
-                "count": {"$sum": 1}
-            }
-        },
-        {
-            "$group": {
-                "_id": "$_id.hour",
-                "avg_count": {"$avg": "$count"}
-            }
-        },
-        {"$sort": {"_id": 1}}
-    ]
-    
-    results = await db.logs_behavior.aggregate(pipeline).to_list(length=None)
-    
-    # Fill missing hours with 0
-    hours_data = {r["_id"]: r["avg_count"] for r in results}
     hours = list(range(24))
-    predicted_traffic = [int(hours_data.get(h, 0)) for h in hours]
+    hours_data = dict(zip(hours, forecast["hourly"]))
+    predicted_traffic = [int(v) for v in forecast["hourly"]]
     
     # Current status
-    now_shanghai = datetime.now(pytz.timezone('Asia/Shanghai'))
-    current_hour = now_shanghai.hour
+    current_hour = forecast["current_hour"]
     current_val = hours_data.get(current_hour, 0)
     
     # Normalize to 0-100% (Dynamic capacity based on daily max, min 200)
@@ -198,3 +196,38 @@ async def get_traffic_prediction():
         "predicted_trend": predicted_traffic,
         "current_hour": current_hour
     }
+
+# Updates per second a live client may ask for; shared by SSE and WebSocket
+LIVE_RATE = Query(MAX_UPDATES_PER_SECOND, ge=MIN_UPDATES_PER_SECOND, le=MAX_UPDATES_PER_SECOND)
+
+@router.get("/live")
+async def live_stream(request: Request, rate: float = LIVE_RATE):
+    """
+    实时推送 (Server-Sent Events)：订单速率、排行榜变化和当前小时客流。
+    所有连接共享同一个广播器 (live_feed)，每个 tick 只读一次 Redis 计数器，
+    每个客户端每秒最多收到 rate 次更新。
+    """
+    return StreamingResponse(sse_events(request, rate), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.websocket("/live/ws")
+async def live_socket(websocket: WebSocket, rate: float = LIVE_RATE):
+    """与 /live 相同的实时快照，通过 WebSocket 推送；客户端断开后立即停止。"""
+    await websocket.accept()
+    queue = live_feed.subscribe()
+
+    async def send_snapshots():
+        while True:
+            await websocket.send_json(await queue.get())
+            await asyncio.sleep(1 / rate)
+
+    sender = asyncio.create_task(send_snapshots())
+    try:
+        # Reading notices a closed client right away instead of at the next send
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+    except WebSocketDisconnect:
+        pass
+    finally:
+        live_feed.unsubscribe(queue)
+        sender.cancel()
@@ -1,11 +1,25 @@
-from fastapi import APIRouter, HTTPException
-from database import get_database
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query, Response
+from database import get_database, get_redis
+from logs_storage import LOGS_COLLECTION
+from engine_manager import engine_manager, get_engine
+from user_profiles import get_profile_vector, get_profile_vectors, get_cooldown_ids, get_cooldowns
+from recommend_cache import get_cached, set_cached, get_stats
+from materialize import get_materialized, TOP_K, DIVERSITY_ALPHA
+from meal_periods import apply_meal_context, PERIOD_COURSES
+from popularity import current_slot, top_popular, popularity_scores
+from popularity import rebuild as rebuild_popularity
+from collaborative_engine import cf_manager
+from item_similarity import similarity_index
 from models import Dish
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional
 from bson import ObjectId
+from pydantic import BaseModel
 import random
-from collections import defaultdict, Counter
+import asyncio
+import time
+from collections import Counter
 import math
+import numpy as np
 from datetime import datetime, timedelta
 import pytz
 
@@ -57,7 +71,7 @@ async def get_user_preferences(user_id: ObjectId, db) -> Dict:
         {"$limit": 50} # Analyze last 50 orders
     ]
     
-    history = await db.logs_behavior.aggregate(pipeline).to_list(length=50)
+    history = await db[LOGS_COLLECTION].aggregate(pipeline).to_list(length=50)
     
     tag_prefs = Counter()
     cat_prefs = Counter()
@@ -79,81 +93,16 @@ async def calculate_collaborative_score(user_id: str, db) -> Dict[str, float]:
     """
     Calculate collaborative filtering scores.
     Returns dict: {dish_id: score}
+    Exact Jaccard neighbours over all users, from the in-memory
+    user x dish matrix (see collaborative_engine.py).
     """
     try:
-        target_oid = ObjectId(user_id)
+        ObjectId(user_id)
     except:
         return {}
 
-    # Get target user's ordered dishes to exclude or weight
-    target_orders = await db.logs_behavior.find(
-        {"user_id": target_oid, "action": "order"}
-    ).to_list(length=1000)
-    
-    target_dish_ids = set(str(order["dish_id"]) for order in target_orders)
-    
-    # 1. Find similar users (using optimized aggregation from previous step)
-    pipeline = [
-        {
-            "$match": {
-                "action": "order",
-                "user_id": {"$ne": target_oid}
-            }
-        },
-        {
-            "$group": {
-                "_id": {"user_id": "$user_id", "dish_id": "$dish_id"},
-                "count": {"$sum": 1}
-            }
-        },
-        {
-            "$group": {
-                "_id": "$_id.user_id",
-                "dishes": {
-                    "$push": {"dish_id": "$_id.dish_id", "count": "$count"}
-                }
-            }
-        },
-        {"$limit": 100} # Top 100 users
-    ]
-    
-    user_summaries = await db.logs_behavior.aggregate(pipeline).to_list(length=100)
-    
-    # Calculate similarity
-    similarities = []
-    target_vector = Counter([str(order["dish_id"]) for order in target_orders])
-    target_mag = math.sqrt(sum(1 for _ in target_orders)) # Simplified magnitude
-    
-    for summary in user_summaries:
-        other_dishes = {str(d["dish_id"]): d["count"] for d in summary["dishes"]}
-        
-        # Jaccard-like similarity on dish sets for speed
-        intersection = len(target_dish_ids.intersection(other_dishes.keys()))
-        if intersection == 0:
-            continue
-            
-        union = len(target_dish_ids.union(other_dishes.keys()))
-        similarity = intersection / union
-        
-        similarities.append((similarity, other_dishes))
-        
-    # Top 20 similar users
-    similarities.sort(key=lambda x: x[0], reverse=True)
-    top_similar = similarities[:20]
-    
-    # Aggregate scores
-    scores = defaultdict(float)
-    for sim, dishes in top_similar:
-        for dish_id, count in dishes.items():
-            if dish_id not in target_dish_ids:
-                scores[dish_id] += sim * count
-                
-    # Normalize scores to 0-1 range
-    if not scores:
-        return {}
-        
-    max_score = max(scores.values())
-    return {k: v / max_score for k, v in scores.items()}
+    cf_engine = await cf_manager.get(db, engine_manager.catalog_version)
+    return cf_engine.score(user_id)
 
 async def calculate_content_score(user_prefs: Dict, all_dishes: List[Dict]) -> Dict[str, float]:
     """
@@ -191,14 +140,22 @@ async def calculate_content_score(user_prefs: Dict, all_dishes: List[Dict]) -> D
     return {k: v / max_score for k, v in scores.items()}
 
 async def get_popularity_scores(db) -> Dict[str, float]:
-    """Get global popularity scores (0-1)."""
+    """
+    Popularity scores (0-1) for the current meal period and weekday, from the
+    precomputed tables (popularity.py). Falls back to aggregating all logs
+    while the tables are empty.
+    """
+    scores = await popularity_scores(await get_redis(), *current_slot())
+    if scores:
+        return scores
+
     pipeline = [
         {"$match": {"action": "order"}},
         {"$group": {"_id": "$dish_id", "count": {"$sum": 1}}},
         {"$sort": {"count": -1}},
         {"$limit": 50}
     ]
-    popular = await db.logs_behavior.aggregate(pipeline).to_list(length=50)
+    popular = await db[LOGS_COLLECTION].aggregate(pipeline).to_list(length=50)
     
     scores = {}
     if not popular:
@@ -231,89 +188,340 @@ def calculate_diversity_penalty(selected_dishes: List[Dict], candidate_dish: Dic
     else:
         return 0.8
 
+def cold_start_recommendations(engine, cooldown_ids: Set[str], popular: List[Dict], ranges=None) -> List[Dict]:
+    # Cold Start: the most ordered dishes of this meal period and weekday
+    # (popular, from popularity.py) minus the cooldown set.
+    # While the tables are still empty, top up at random from the same partitions
+    recommendations = [d for d in popular if str(d["_id"]) not in cooldown_ids][:TOP_K]
+    if len(recommendations) < TOP_K:
+        chosen = {str(d["_id"]) for d in recommendations}
+        available = [engine.dishes[did] for did in engine.scope_dish_ids(ranges)
+                     if did not in cooldown_ids and did not in chosen]
+        random.shuffle(available)
+        recommendations += available[:TOP_K - len(recommendations)]
+    return recommendations
+
+def catalog_scope(engine, period: str, canteen: Optional[str]):
+    """Partition row ranges to score: the meal period's courses, optionally one canteen."""
+    if canteen is not None and canteen not in engine.canteens:
+        raise HTTPException(status_code=404, detail=f"Unknown canteen: {canteen}")
+    return engine.partition_ranges(canteen, PERIOD_COURSES[period])
+
+def format_recommendations(recommendations: List[Dict]) -> List[Dict]:
+    # Format IDs (copy first: the dish dicts are shared by the engine)
+    recommendations = [dict(r) for r in recommendations]
+    for r in recommendations:
+        r["_id"] = str(r["_id"])
+    return recommendations
+
 # --- Main Endpoints ---
 
+async def blend_signal_recommendations(user_oid: ObjectId, db, engine, cooldown_ids: Set[str],
+                                       weights: Dict[str, float], timings: Dict[str, float],
+                                       top_k: int = 8, ranges=None) -> List[Dict]:
+    """
+    Hybrid mode: collaborative, content and popularity signals are fetched
+    concurrently, blended as arrays over the engine's dish order, and the
+    top dishes are picked greedily with the category diversity penalty.
+    Per-stage durations (ms) are written into `timings`.
+    """
+    async def timed(name, coro):
+        start = time.perf_counter()
+        result = await coro
+        timings[name] = (time.perf_counter() - start) * 1000
+        return result
+
+    start = time.perf_counter()
+    cf_scores, user_prefs, pop_scores = await asyncio.gather(
+        timed("collaborative", calculate_collaborative_score(str(user_oid), db)),
+        timed("preferences", get_user_preferences(user_oid, db)),
+        timed("popularity", get_popularity_scores(db))
+    )
+    timings["signals"] = (time.perf_counter() - start) * 1000
+
+    # Only the dishes in scope (meal period / canteen partitions) are scored
+    dish_ids = engine.scope_dish_ids(ranges)
+    all_dishes = [engine.dishes[did] for did in dish_ids]
+    content_scores = await timed("content", calculate_content_score(user_prefs, all_dishes))
+
+    start = time.perf_counter()
+    signals = {
+        "collaborative": cf_scores,
+        "content": content_scores,
+        "popularity": pop_scores,
+    }
+    total = np.zeros(len(dish_ids))
+    for name, scores in signals.items():
+        if weights.get(name) and scores:
+            total += weights[name] * np.fromiter((scores.get(did, 0.0) for did in dish_ids), dtype=np.float64, count=len(dish_ids))
+
+    candidates = engine.top_candidates(total, engine.exclude_mask(cooldown_ids, ranges))
+
+    # Greedy pick with the diversity penalty; penalties only depend on the category
+    selected = []
+    remaining = list(candidates)
+    while len(selected) < top_k and remaining:
+        penalties = {}
+        best_pos, best_score = 0, -np.inf
+        for pos, idx in enumerate(remaining):
+            dish = all_dishes[idx]
+            category = dish.get("category")
+            if category not in penalties:
+                penalties[category] = calculate_diversity_penalty(selected, dish)
+            adjusted = total[idx] * (1 - penalties[category])
+            if adjusted > best_score:
+                best_pos, best_score = pos, adjusted
+        selected.append(all_dishes[remaining.pop(best_pos)])
+    timings["blend"] = (time.perf_counter() - start) * 1000
+
+    return selected
+
+# Default signal weights for mode=hybrid
+HYBRID_WEIGHTS = {"collaborative": 0.5, "content": 0.3, "popularity": 0.2}
+
 @router.get("/recommend/{user_id}")
-async def get_hybrid_recommendations(user_id: str):
+async def get_hybrid_recommendations(
+    user_id: str,
+    response: Response,
+    mode: str = "vector",
+    w_cf: float = Query(HYBRID_WEIGHTS["collaborative"], ge=0),
+    w_content: float = Query(HYBRID_WEIGHTS["content"], ge=0),
+    w_pop: float = Query(HYBRID_WEIGHTS["popularity"], ge=0),
+    canteen: Optional[str] = None,
+):
     """
     Professional Vector Space Model Recommendation System
     Uses VectorEngine for feature-based matching and MMR for diversity.
+
+    mode=hybrid instead blends collaborative (w_cf), content (w_content) and
+    popularity (w_pop) scores; per-stage timings are reported in the
+    Server-Timing header. Hybrid results are not cached.
+
+    Only the catalog partitions for the current meal period are scored;
+    `canteen` narrows them further to a single canteen.
     """
     db = await get_database()
     try:
         user_oid = ObjectId(user_id)
     except:
         raise HTTPException(status_code=400, detail="Invalid user ID")
+    if mode not in ("vector", "hybrid"):
+        raise HTTPException(status_code=400, detail="mode must be 'vector' or 'hybrid'")
 
     # 1. Fetch Data
-    # Get all dishes
-    all_dishes = await db.dishes.find().to_list(length=1000)
-    
-    # Get user history
-    history = await db.logs_behavior.find(
-        {"user_id": user_oid, "action": "order"}
-    ).sort("timestamp", -1).limit(50).to_list(length=50)
+    # Dishes come from the long-lived engine; only recent orders are per request
+    engine = await get_engine()
+    redis = await get_redis()
+    period, dow = current_slot()
+    ranges = catalog_scope(engine, period, canteen)
+    user_id = str(user_oid)
+
+    # The final list only depends on catalog, history, meal period and canteen
+    if mode == "vector":
+        cached = await get_cached(redis, [user_id], period, engine.catalog_version, canteen)
+        if user_id in cached:
+            return cached[user_id]
+
+        # Then the nightly precomputed list, unless the user ordered since
+        if canteen is None:
+            materialized = await get_materialized(db, engine, [user_oid], period)
+            if user_id in materialized:
+                recommendations = format_recommendations(materialized[user_id])
+                await set_cached(redis, {user_id: recommendations}, period, engine.catalog_version)
+                return recommendations
     
     # Cooldown: Don't recommend dishes ordered in last 3 days
-    cooldown_ids = set()
     now = datetime.now(pytz.UTC)
-    for order in history:
-        ts = order["timestamp"]
-        if ts.tzinfo is None:
-            ts = ts.replace(tzinfo=pytz.UTC)
-        if (now - ts).days < 3:
-            cooldown_ids.add(str(order["dish_id"]))
-
-    # 2. Initialize Vector Engine
-    from vector_engine import VectorEngine
-    engine = VectorEngine(all_dishes)
-    
-    # 3. Build User Profile
-    user_vector = engine.calculate_user_vector(history)
+    recent_orders = await db[LOGS_COLLECTION].find(
+        {"user_id": user_oid, "action": "order", "timestamp": {"$gt": now - timedelta(days=3)}},
+        {"dish_id": 1, "timestamp": 1}
+    ).to_list(length=None)
+    cooldown_ids = get_cooldown_ids(recent_orders, now)
+
+    if mode == "hybrid":
+        timings = {}
+        weights = {"collaborative": w_cf, "content": w_content, "popularity": w_pop}
+        recommendations = await blend_signal_recommendations(user_oid, db, engine, cooldown_ids, weights, timings, ranges=ranges)
+        response.headers["Server-Timing"] = ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())
+        return format_recommendations(recommendations)
+
+    # 2. Load User Profile (maintained incrementally by /api/portal/order)
+    user_vector = await get_profile_vector(db, engine, user_oid)
     
-    # 4. Generate Recommendations
-    if user_vector:
-        # Context Awareness: Adjust user vector based on time of day
-        # This is a "Query Expansion" technique in VSM
-        current_hour = datetime.now(pytz.timezone('Asia/Shanghai')).hour
-        
-        # Modify the vector temporarily for this request
-        # Indices: 0:spicy, 1:sweet, 2:salty, 3:sour, 4:oily, 5:fresh, 6:price, 7:cal, 8:pop
-        
-        if 6 <= current_hour < 10: # Breakfast
-            # Reduce preference for spicy/oily, increase fresh/sweet(porridge)
-            user_vector[0] *= 0.5 # Spicy
-            user_vector[4] *= 0.3 # Oily
-            user_vector[1] *= 1.2 # Sweet
-        elif 17 <= current_hour < 21: # Dinner
-            # Slight preference for lighter food (lower calories)
-            # In our vector, index 7 is "High Calories". So we want to lower it?
-            # Actually index 7 is normalized calories. If user likes high cal, this is high.
-            # To recommend low cal, we should lower this component in the user vector
-            user_vector[7] *= 0.8
+    # 3. Generate Recommendations
+    if user_vector is not None:
+        user_vector = apply_meal_context(user_vector, period)
             
         recommendations = engine.recommend(
             user_vector, 
-            top_k=8, 
-            diversity_alpha=0.75, # High precision, but some diversity
-            exclude_ids=cooldown_ids
+            top_k=TOP_K, 
+            diversity_alpha=DIVERSITY_ALPHA, # High precision, but some diversity
+            exclude_ids=cooldown_ids,
+            ranges=ranges
         )
     else:
-        # Cold Start: Fallback to Popularity + Random
-        # We can use the engine's internal dishes to pick popular ones
-        # For simplicity, just pick random popular ones from all_dishes
-        # Assuming all_dishes are already sorted or we sort them by some metric
-        # Let's just pick random 8 to ensure something shows up
-        available = [d for d in all_dishes if str(d["_id"]) not in cooldown_ids]
-        random.shuffle(available)
-        recommendations = available[:8]
+        popular = await top_popular(redis, engine, period, dow, canteen, ranges, cooldown_ids, k=TOP_K)
+        recommendations = cold_start_recommendations(engine, cooldown_ids, popular, ranges)
 
-    # Format IDs
-    for r in recommendations:
-        r["_id"] = str(r["_id"])
-        
+    recommendations = format_recommendations(recommendations)
+    await set_cached(redis, {user_id: recommendations}, period, engine.catalog_version, canteen)
     return recommendations
 
+class BatchRecommendRequest(BaseModel):
+    user_ids: List[str]
+    canteen: Optional[str] = None
+
+# Upper bound on users per batch call
+MAX_BATCH_USERS = 5000
+
+@router.post("/batch")
+async def get_batch_recommendations(request: BatchRecommendRequest):
+    """
+    Recommendations for many users in one call (kiosks, nightly push).
+    Profiles and recent orders come from one $in query each, all users are scored
+    against the dish matrix together, and MMR then runs per user.
+    Returns {user_id: [dishes]} with the same lists as /recommend/{user_id}.
+    """
+    if len(request.user_ids) > MAX_BATCH_USERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_USERS} users per batch")
+    try:
+        user_oids = [ObjectId(uid) for uid in request.user_ids]
+    except:
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+
+    db = await get_database()
+    redis = await get_redis()
+    engine = await get_engine()
+    period, dow = current_slot()
+    canteen = request.canteen
+    ranges = catalog_scope(engine, period, canteen)
+
+    # Serve what we can from the cache and the nightly lists, compute only the misses
+    user_ids = [str(oid) for oid in user_oids]
+    results = await get_cached(redis, user_ids, period, engine.catalog_version, canteen)
+    if canteen is None:
+        pending = [oid for oid, uid in zip(user_oids, user_ids) if uid not in results]
+        materialized = await get_materialized(db, engine, pending, period)
+        if materialized:
+            materialized = {uid: format_recommendations(recs) for uid, recs in materialized.items()}
+            await set_cached(redis, materialized, period, engine.catalog_version)
+            results.update(materialized)
+    missing = [i for i, uid in enumerate(user_ids) if uid not in results]
+    miss_ids = [user_ids[i] for i in missing]
+    miss_oids = [user_oids[i] for i in missing]
+
+    # Stored profiles and recent orders of every remaining user, one query each
+    now = datetime.now(pytz.UTC)
+    profiles = await get_profile_vectors(db, engine, miss_oids) if miss_oids else {}
+    cooldown_by_user = await get_cooldowns(db, miss_oids, now)
+    cooldowns = [cooldown_by_user[uid] for uid in miss_ids]
+
+    user_vectors = np.zeros((len(miss_ids), len(engine.DIMENSIONS)))
+    valid = np.zeros(len(miss_ids), dtype=bool)
+    for i, uid in enumerate(miss_ids):
+        if uid in profiles:
+            user_vectors[i] = apply_meal_context(profiles[uid].copy(), period)
+            valid[i] = True
+
+    warm = [i for i in range(len(miss_ids)) if valid[i]]
+    warm_results = engine.recommend_batch(
+        user_vectors[warm],
+        top_k=TOP_K,
+        diversity_alpha=DIVERSITY_ALPHA,
+        exclude_ids=[cooldowns[i] for i in warm],
+        ranges=ranges
+    )
+
+    # One popularity read shared by every cold-start user, long enough for any cooldown set
+    cold = [i for i in range(len(miss_ids)) if not valid[i]]
+    popular = []
+    if cold:
+        longest_cooldown = max(len(cooldowns[i]) for i in cold)
+        popular = await top_popular(redis, engine, period, dow, canteen, ranges, k=TOP_K + longest_cooldown)
+
+    computed = {}
+    warm_iter = iter(warm_results)
+    for i, uid in enumerate(miss_ids):
+        if valid[i]:
+            recommendations = next(warm_iter)
+        else:
+            recommendations = cold_start_recommendations(engine, cooldowns[i], popular, ranges)
+        computed[uid] = format_recommendations(recommendations)
+
+    await set_cached(redis, computed, period, engine.catalog_version, canteen)
+    results.update(computed)
+
+    # Keyed by the IDs exactly as the caller sent them
+    return {uid: results[str(oid)] for uid, oid in zip(request.user_ids, user_oids)}
+
+@router.get("/cache/stats")
+async def get_recommendation_cache_stats():
+    """Hit/miss counters of the recommendation result cache."""
+    redis = await get_redis()
+    return await get_stats(redis)
+
+@router.get("/engine")
+async def get_engine_status():
+    """Current VectorEngine catalog version and build time."""
+    if engine_manager.engine is None:
+        await get_engine()
+    return engine_manager.status()
+
+@router.post("/engine/rebuild")
+async def rebuild_engine():
+    """Force a reload of the dish catalog and swap in a new engine."""
+    db = await get_database()
+    redis = await get_redis()
+    await engine_manager.rebuild(db, redis)
+    return engine_manager.status()
+
+@router.post("/popularity/rebuild")
+async def rebuild_popularity_tables(background_tasks: BackgroundTasks):
+    """Recompute the meal-period popularity tables from recent logs in the background."""
+    db = await get_database()
+    redis = await get_redis()
+    if not redis:
+        raise HTTPException(status_code=503, detail="Redis unavailable")
+    engine = await get_engine()
+    background_tasks.add_task(rebuild_popularity, db, redis, engine)
+    return {"message": "Rebuild started"}
+
+@router.get("/similar/{dish_id}")
+async def get_similar_dishes(dish_id: str, limit: int = 10):
+    """
+    "People also ordered": dishes most often ordered in the same meal as
+    this one, answered from the precomputed neighbour lists.
+    """
+    try:
+        ObjectId(dish_id)
+    except:
+        raise HTTPException(status_code=400, detail="Invalid dish ID")
+
+    db = await get_database()
+    engine = await get_engine()
+    neighbors = await similarity_index.get(db, dish_id)
+
+    results = []
+    for n in neighbors:
+        dish = engine.dishes.get(n["dish_id"])
+        if not dish:
+            continue
+        dish = dict(dish)
+        dish["_id"] = str(dish["_id"])
+        dish["similarity"] = n["score"]
+        dish["co_orders"] = n["count"]
+        results.append(dish)
+        if len(results) >= limit:
+            break
+    return results
+
+@router.post("/similar/rebuild")
+async def rebuild_similar_dishes(background_tasks: BackgroundTasks):
+    """Recompute the dish co-occurrence neighbours in the background."""
+    db = await get_database()
+    background_tasks.add_task(similarity_index.rebuild, db)
+    return {"message": "Rebuild started"}
+
 @router.get("/top10/{user_id}")
 async def get_top10(user_id: str):
     """
@@ -334,7 +542,7 @@ async def get_top10(user_id: str):
         {"$limit": 10}
     ]
     
-    top_dishes = await db.logs_behavior.aggregate(pipeline).to_list(length=10)
+    top_dishes = await db[LOGS_COLLECTION].aggregate(pipeline).to_list(length=10)
     
     results = []
     for item in top_dishes:
@@ -1,5 +1,10 @@
 from fastapi import APIRouter, HTTPException
-from database import get_database
+from database import get_database, get_redis
+from logs_storage import LOGS_COLLECTION
+from engine_manager import get_engine
+from user_profiles import PROFILE_COLLECTION
+from recommend_cache import invalidate_user
+from collaborative_engine import cf_manager
 from models import Dish, LogBehavior
 from typing import List, Dict, Any
 from datetime import datetime
@@ -21,7 +26,7 @@ async def get_order_history(user_id: str):
     except:
         return []
         
-    cursor = db.logs_behavior.find(
+    cursor = db[LOGS_COLLECTION].find(
         {"user_id": oid, "action": "order"}
     ).sort("timestamp", -1).limit(50)
     
@@ -81,7 +86,7 @@ async def chat_with_nutritionist(request: ChatRequest):
             try:
                 user_oid = ObjectId(request.user_id)
                 # Get user's recent orders
-                recent_orders = await db.logs_behavior.find(
+                recent_orders = await db[LOGS_COLLECTION].find(
                     {"user_id": user_oid, "action": "order"}
                 ).sort("timestamp", -1).limit(10).to_list(length=10)
                 
@@ -183,7 +188,7 @@ async def get_demo_users():
             {"$sort": {"count": -1}},
             {"$limit": 3}
         ]
-        tags_agg = await db.logs_behavior.aggregate(pipeline).to_list(length=3)
+        tags_agg = await db[LOGS_COLLECTION].aggregate(pipeline).to_list(length=3)
         top_tags = [t["_id"] for t in tags_agg]
         
         # Fallback if no history
@@ -222,7 +227,11 @@ async def clear_order_history(user_id: str):
         raise HTTPException(status_code=403, detail="只有演示用户可以清空历史")
     
     # 删除该用户的所有订单日志
-    result = await db.logs_behavior.delete_many({"user_id": oid})
+    result = await db[LOGS_COLLECTION].delete_many({"user_id": oid})
+    await db[PROFILE_COLLECTION].delete_one({"_id": oid})
+    cf_manager.invalidate()
+    engine = await get_engine()
+    await invalidate_user(await get_redis(), str(oid), engine.catalog_version, engine.canteens)
     
     return {
         "deleted_count": result.deleted_count,
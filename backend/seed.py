@@ -13,10 +13,83 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from backend.database import db as database_instance, get_database
 from backend.models import Dish, User, LogBehavior
+from backend.engine_manager import bump_catalog_version
+from backend.vector_engine import VectorEngine
+from backend.popularity import rebuild as rebuild_popularity
+from backend.rollups import rebuild as rebuild_rollups
+from backend.sketches import rebuild as rebuild_sketches
+from backend.preference_summary import SUMMARY_COLLECTION, add_users
+from backend.item_similarity import NEIGHBOR_COLLECTION, build_neighbors
+from backend.materialize import MATERIALIZED_COLLECTION
+from backend.indexes import ensure_indexes
+from backend.order_logs import build_order_log
+from backend.logs_storage import LOGS_COLLECTION
 
 # Timezone configuration
 TZ_SHANGHAI = pytz.timezone('Asia/Shanghai')
 
+# Seed catalog, also the template for the synthetic catalogs in benchmarks/
+# Breakfast Items (10)
+BREAKFAST_DISHES = [
+    {"name": "鲜肉大包", "category": "面食", "price": 2.5, "calories": 250, "tags": ["早餐", "热销", "面食"]},
+    {"name": "香菇菜包", "category": "面食", "price": 2.0, "calories": 200, "tags": ["早餐", "素食", "健康"]},
+    {"name": "豆浆", "category": "饮品", "price": 1.5, "calories": 100, "tags": ["早餐", "健康", "饮品"]},
+    {"name": "油条", "category": "面食", "price": 2.0, "calories": 300, "tags": ["早餐", "传统", "油炸"]},
+    {"name": "皮蛋瘦肉粥", "category": "面食", "price": 4.0, "calories": 200, "tags": ["早餐", "暖胃", "清淡"]},
+    {"name": "小米粥", "category": "面食", "price": 2.0, "calories": 150, "tags": ["早餐", "健康", "清淡"]},
+    {"name": "茶叶蛋", "category": "小吃", "price": 1.5, "calories": 80, "tags": ["早餐", "蛋白质"]},
+    {"name": "葱油饼", "category": "面食", "price": 3.0, "calories": 350, "tags": ["早餐", "香脆"]},
+    {"name": "生煎包", "category": "面食", "price": 6.0, "calories": 400, "tags": ["早餐", "特色"]},
+    {"name": "豆腐脑(咸)", "category": "小吃", "price": 3.0, "calories": 150, "tags": ["早餐", "传统"]},
+]
+
+# Main Meals (40+)
+MAIN_DISHES = [
+    # Spicy (川菜/湘菜) - Reduced ratio
+    {"name": "麻婆豆腐", "category": "川菜", "price": 8.0, "calories": 400, "tags": ["辣", "下饭", "豆腐"]},
+    {"name": "辣子鸡丁", "category": "川菜", "price": 15.0, "calories": 500, "tags": ["辣", "肉食", "鸡肉"]},
+    {"name": "水煮鱼", "category": "川菜", "price": 28.0, "calories": 600, "tags": ["辣", "海鲜", "大菜"]},
+    {"name": "宫保鸡丁", "category": "川菜", "price": 16.0, "calories": 550, "tags": ["微辣", "经典", "鸡肉"]},
+    {"name": "酸辣土豆丝", "category": "川菜", "price": 8.0, "calories": 250, "tags": ["辣", "素食", "开胃"]},
+    {"name": "小炒肉", "category": "湘菜", "price": 20.0, "calories": 550, "tags": ["辣", "猪肉", "下饭"]},
+    {"name": "剁椒鱼头", "category": "湘菜", "price": 35.0, "calories": 450, "tags": ["辣", "海鲜", "硬菜"]},
+    {"name": "回锅肉", "category": "川菜", "price": 22.0, "calories": 700, "tags": ["微辣", "猪肉", "经典"]},
+
+    # Sweet/Savory (本帮菜/粤菜/江浙菜)
+    {"name": "红烧肉", "category": "本帮菜", "price": 22.0, "calories": 700, "tags": ["甜", "肉食", "经典"]},
+    {"name": "糖醋排骨", "category": "本帮菜", "price": 25.0, "calories": 650, "tags": ["甜", "酸甜", "排骨"]},
+    {"name": "西红柿炒蛋", "category": "本帮菜", "price": 10.0, "calories": 300, "tags": ["家常", "酸甜", "鸡蛋"]},
+    {"name": "狮子头", "category": "本帮菜", "price": 18.0, "calories": 500, "tags": ["咸鲜", "肉食"]},
+    {"name": "干炒牛河", "category": "粤菜", "price": 18.0, "calories": 600, "tags": ["主食", "牛肉", "镬气"]},
+    {"name": "白切鸡", "category": "粤菜", "price": 25.0, "calories": 400, "tags": ["清淡", "鸡肉", "经典"]},
+    {"name": "菠萝咕咾肉", "category": "粤菜", "price": 22.0, "calories": 550, "tags": ["酸甜", "猪肉"]},
+    {"name": "蚝油生菜", "category": "粤菜", "price": 12.0, "calories": 100, "tags": ["清淡", "素食", "健康"]},
+    {"name": "西湖醋鱼", "category": "江浙菜", "price": 30.0, "calories": 400, "tags": ["酸甜", "鱼"]},
+    {"name": "龙井虾仁", "category": "江浙菜", "price": 38.0, "calories": 300, "tags": ["清淡", "海鲜", "精致"]},
+
+    # Healthy/Veg (素菜/轻食)
+    {"name": "清炒时蔬", "category": "素菜", "price": 8.0, "calories": 150, "tags": ["健康", "素食", "清淡"]},
+    {"name": "地三鲜", "category": "素菜", "price": 12.0, "calories": 400, "tags": ["家常", "素食"]},
+    {"name": "荷塘月色", "category": "素菜", "price": 15.0, "calories": 120, "tags": ["健康", "素食", "精致"]},
+    {"name": "水果沙拉", "category": "轻食", "price": 15.0, "calories": 200, "tags": ["健康", "生鲜", "低卡"]},
+    {"name": "鸡胸肉沙拉", "category": "轻食", "price": 18.0, "calories": 300, "tags": ["健康", "低脂", "增肌"]},
+    {"name": "玉米排骨汤", "category": "汤品", "price": 12.0, "calories": 250, "tags": ["健康", "汤", "滋补"]},
+
+    # Staples (面食/主食)
+    {"name": "扬州炒饭", "category": "面食", "price": 15.0, "calories": 500, "tags": ["主食", "米饭"]},
+    {"name": "牛肉面", "category": "面食", "price": 18.0, "calories": 550, "tags": ["主食", "汤面", "热乎"]},
+    {"name": "炸酱面", "category": "面食", "price": 16.0, "calories": 500, "tags": ["主食", "干拌"]},
+    {"name": "咖喱鸡肉饭", "category": "异国料理", "price": 20.0, "calories": 600, "tags": ["主食", "咖喱"]},
+    {"name": "意大利肉酱面", "category": "西餐", "price": 22.0, "calories": 550, "tags": ["主食", "西式"]},
+
+    # Drinks & Snacks
+    {"name": "珍珠奶茶", "category": "饮品", "price": 12.0, "calories": 400, "tags": ["甜", "饮品", "快乐水"]},
+    {"name": "柠檬茶", "category": "饮品", "price": 10.0, "calories": 150, "tags": ["酸甜", "饮品", "解腻"]},
+    {"name": "鲜榨橙汁", "category": "饮品", "price": 15.0, "calories": 120, "tags": ["健康", "饮品", "果汁"]},
+    {"name": "薯条", "category": "小吃", "price": 8.0, "calories": 350, "tags": ["油炸", "零食"]},
+    {"name": "奥尔良烤翅", "category": "小吃", "price": 12.0, "calories": 300, "tags": ["肉食", "小吃"]},
+]
+
 async def seed_data():
     print("🚀 Starting Data Seeding (Phase 6 - Timezone Fix)...")
     start_time = time.time()
@@ -33,74 +106,22 @@ async def seed_data():
     print("🔥 Clearing old data...")
     await db.dishes.delete_many({})
     await db.users.delete_many({})
-    await db.logs_behavior.delete_many({})
+    await db[LOGS_COLLECTION].delete_many({})
+    await db.user_profiles.delete_many({})
+    await db[SUMMARY_COLLECTION].delete_many({})
+    # Derived from the old dishes / logs: neighbour lists and materialized recommendations
+    await db[NEIGHBOR_COLLECTION].delete_many({})
+    await db[MATERIALIZED_COLLECTION].delete_many({})
     if redis:
         await redis.flushall()
+    # Indexes first, so the bulk inserts below build them incrementally
+    await ensure_indexes(db)
 
     # 2. Define Dishes (50+ items, Balanced)
     print("🍱 Seeding Dishes (50+ Items, Balanced)...")
     
-    # Breakfast Items (10)
-    breakfast_dishes = [
-        {"name": "鲜肉大包", "category": "面食", "price": 2.5, "calories": 250, "tags": ["早餐", "热销", "面食"]},
-        {"name": "香菇菜包", "category": "面食", "price": 2.0, "calories": 200, "tags": ["早餐", "素食", "健康"]},
-        {"name": "豆浆", "category": "饮品", "price": 1.5, "calories": 100, "tags": ["早餐", "健康", "饮品"]},
-        {"name": "油条", "category": "面食", "price": 2.0, "calories": 300, "tags": ["早餐", "传统", "油炸"]},
-        {"name": "皮蛋瘦肉粥", "category": "面食", "price": 4.0, "calories": 200, "tags": ["早餐", "暖胃", "清淡"]},
-        {"name": "小米粥", "category": "面食", "price": 2.0, "calories": 150, "tags": ["早餐", "健康", "清淡"]},
-        {"name": "茶叶蛋", "category": "小吃", "price": 1.5, "calories": 80, "tags": ["早餐", "蛋白质"]},
-        {"name": "葱油饼", "category": "面食", "price": 3.0, "calories": 350, "tags": ["早餐", "香脆"]},
-        {"name": "生煎包", "category": "面食", "price": 6.0, "calories": 400, "tags": ["早餐", "特色"]},
-        {"name": "豆腐脑(咸)", "category": "小吃", "price": 3.0, "calories": 150, "tags": ["早餐", "传统"]},
-    ]
-
-    # Main Meals (40+)
-    main_dishes = [
-        # Spicy (川菜/湘菜) - Reduced ratio
-        {"name": "麻婆豆腐", "category": "川菜", "price": 8.0, "calories": 400, "tags": ["辣", "下饭", "豆腐"]},
-        {"name": "辣子鸡丁", "category": "川菜", "price": 15.0, "calories": 500, "tags": ["辣", "肉食", "鸡肉"]},
-        {"name": "水煮鱼", "category": "川菜", "price": 28.0, "calories": 600, "tags": ["辣", "海鲜", "大菜"]},
-        {"name": "宫保鸡丁", "category": "川菜", "price": 16.0, "calories": 550, "tags": ["微辣", "经典", "鸡肉"]},
-        {"name": "酸辣土豆丝", "category": "川菜", "price": 8.0, "calories": 250, "tags": ["辣", "素食", "开胃"]},
-        {"name": "小炒肉", "category": "湘菜", "price": 20.0, "calories": 550, "tags": ["辣", "猪肉", "下饭"]},
-        {"name": "剁椒鱼头", "category": "湘菜", "price": 35.0, "calories": 450, "tags": ["辣", "海鲜", "硬菜"]},
-        {"name": "回锅肉", "category": "川菜", "price": 22.0, "calories": 700, "tags": ["微辣", "猪肉", "经典"]},
-
-        # Sweet/Savory (本帮菜/粤菜/江浙菜)
-        {"name": "红烧肉", "category": "本帮菜", "price": 22.0, "calories": 700, "tags": ["甜", "肉食", "经典"]},
-        {"name": "糖醋排骨", "category": "本帮菜", "price": 25.0, "calories": 650, "tags": ["甜", "酸甜", "排骨"]},
-        {"name": "西红柿炒蛋", "category": "本帮菜", "price": 10.0, "calories": 300, "tags": ["家常", "酸甜", "鸡蛋"]},
-        {"name": "狮子头", "category": "本帮菜", "price": 18.0, "calories": 500, "tags": ["咸鲜", "肉食"]},
-        {"name": "干炒牛河", "category": "粤菜", "price": 18.0, "calories": 600, "tags": ["主食", "牛肉", "镬气"]},
-        {"name": "白切鸡", "category": "粤菜", "price": 25.0, "calories": 400, "tags": ["清淡", "鸡肉", "经典"]},
-        {"name": "菠萝咕咾肉", "category": "粤菜", "price": 22.0, "calories": 550, "tags": ["酸甜", "猪肉"]},
-        {"name": "蚝油生菜", "category": "粤菜", "price": 12.0, "calories": 100, "tags": ["清淡", "素食", "健康"]},
-        {"name": "西湖醋鱼", "category": "江浙菜", "price": 30.0, "calories": 400, "tags": ["酸甜", "鱼"]},
-        {"name": "龙井虾仁", "category": "江浙菜", "price": 38.0, "calories": 300, "tags": ["清淡", "海鲜", "精致"]},
-
-        # Healthy/Veg (素菜/轻食)
-        {"name": "清炒时蔬", "category": "素菜", "price": 8.0, "calories": 150, "tags": ["健康", "素食", "清淡"]},
-        {"name": "地三鲜", "category": "素菜", "price": 12.0, "calories": 400, "tags": ["家常", "素食"]},
-        {"name": "荷塘月色", "category": "素菜", "price": 15.0, "calories": 120, "tags": ["健康", "素食", "精致"]},
-        {"name": "水果沙拉", "category": "轻食", "price": 15.0, "calories": 200, "tags": ["健康", "生鲜", "低卡"]},
-        {"name": "鸡胸肉沙拉", "category": "轻食", "price": 18.0, "calories": 300, "tags": ["健康", "低脂", "增肌"]},
-        {"name": "玉米排骨汤", "category": "汤品", "price": 12.0, "calories": 250, "tags": ["健康", "汤", "滋补"]},
-
-        # Staples (面食/主食)
-        {"name": "扬州炒饭", "category": "面食", "price": 15.0, "calories": 500, "tags": ["主食", "米饭"]},
-        {"name": "牛肉面", "category": "面食", "price": 18.0, "calories": 550, "tags": ["主食", "汤面", "热乎"]},
-        {"name": "炸酱面", "category": "面食", "price": 16.0, "calories": 500, "tags": ["主食", "干拌"]},
-        {"name": "咖喱鸡肉饭", "category": "异国料理", "price": 20.0, "calories": 600, "tags": ["主食", "咖喱"]},
-        {"name": "意大利肉酱面", "category": "西餐", "price": 22.0, "calories": 550, "tags": ["主食", "西式"]},
-        
-        # Drinks & Snacks
-        {"name": "珍珠奶茶", "category": "饮品", "price": 12.0, "calories": 400, "tags": ["甜", "饮品", "快乐水"]},
-        {"name": "柠檬茶", "category": "饮品", "price": 10.0, "calories": 150, "tags": ["酸甜", "饮品", "解腻"]},
-        {"name": "鲜榨橙汁", "category": "饮品", "price": 15.0, "calories": 120, "tags": ["健康", "饮品", "果汁"]},
-        {"name": "薯条", "category": "小吃", "price": 8.0, "calories": 350, "tags": ["油炸", "零食"]},
-        {"name": "奥尔良烤翅", "category": "小吃", "price": 12.0, "calories": 300, "tags": ["肉食", "小吃"]},
-    ]
-
+    breakfast_dishes = BREAKFAST_DISHES
+    main_dishes = MAIN_DISHES
     all_dishes_data = breakfast_dishes + main_dishes
     
     # Insert Dishes
@@ -124,6 +145,11 @@ async def seed_data():
             await redis.set(f"dish:{res.inserted_id}", dish.model_dump_json())
 
     print(f"✅ Inserted {len(breakfast_ids)} breakfast items and {len(main_ids)} main items.")
+    # Logs carry a snapshot of the dish they ordered (see order_logs.py)
+    dish_docs = {d["_id"]: d for d in await db.dishes.find().to_list(length=None)}
+
+    # Tell running backends to rebuild their VectorEngine
+    await bump_catalog_version(redis)
 
     # 3. Create Users
     print("👥 Seeding Users...")
@@ -144,6 +170,8 @@ async def seed_data():
         })
     
     await db.users.insert_many(users)
+    # Running totals behind the admin preference radar
+    await add_users(db, users)
     user_ids = [u["_id"] for u in await db.users.find().to_list(length=100)]
 
     # 4. Generate Logs (Realistic Patterns with Timezone Fix)
@@ -206,21 +234,16 @@ async def seed_data():
         # 3. Determine User (ONLY regular users, not demo users)
         uid = random.choice(regular_user_ids)
         
-        log = {
-            "user_id": uid,
-            "dish_id": did,
-            "action": "order",
-            "timestamp": log_time_utc # Store as UTC
-        }
+        log = build_order_log(uid, did, dish_docs.get(did), log_time_utc)  # Store as UTC
         logs.append(log)
         
         if len(logs) >= 5000:
-            await db.logs_behavior.insert_many(logs)
+            await db[LOGS_COLLECTION].insert_many(logs)
             logs = []
             print(f"   Inserted {i+1} logs...")
 
     if logs:
-        await db.logs_behavior.insert_many(logs)
+        await db[LOGS_COLLECTION].insert_many(logs)
         logs = []
 
     # 4.2 Generate Specific History for Demo Users (Distinctive Profiles)
@@ -291,15 +314,10 @@ async def seed_data():
             log_time_shanghai = base_date.replace(hour=hour, minute=random.randint(0, 59), second=random.randint(0, 59), microsecond=0)
             log_time_utc = log_time_shanghai.astimezone(pytz.UTC)
             
-            demo_logs.append({
-                "user_id": u["_id"],
-                "dish_id": did,
-                "action": "order",
-                "timestamp": log_time_utc
-            })
+            demo_logs.append(build_order_log(u["_id"], did, dish_docs.get(did), log_time_utc))
             
     if demo_logs:
-        await db.logs_behavior.insert_many(demo_logs)
+        await db[LOGS_COLLECTION].insert_many(demo_logs)
         print(f"   Inserted {len(demo_logs)} demo user logs.")
 
     # 5. Rebuild Redis Leaderboard
@@ -309,10 +327,27 @@ async def seed_data():
             {"$match": {"action": "order"}},
             {"$group": {"_id": "$dish_id", "count": {"$sum": 1}}}
         ]
-        agg_res = await db.logs_behavior.aggregate(pipeline).to_list(length=None)
+        agg_res = await db[LOGS_COLLECTION].aggregate(pipeline).to_list(length=None)
         for item in agg_res:
             await redis.zadd("rank:daily:sales", {str(item["_id"]): item["count"]})
 
+        # Meal-period popularity tables used for cold-start recommendations
+        engine = VectorEngine(await db.dishes.find().to_list(length=None))
+        await rebuild_popularity(db, redis, engine)
+
+        # Unique-student HyperLogLogs and per-dish sketches for the dashboard
+        await rebuild_sketches(db, redis)
+
+    # 6. Rebuild hourly rollups for the admin analytics
+    print("📈 Rebuilding Hourly Rollups...")
+    buckets = await rebuild_rollups(db)
+    print(f"   Built {buckets} hourly buckets.")
+
+    # 7. Rebuild dish co-occurrence neighbours (/recommend/similar)
+    print("🔗 Rebuilding Dish Neighbours...")
+    dishes = await build_neighbors(db)
+    print(f"   Built neighbours for {dishes} dishes.")
+
     duration = time.time() - start_time
     print(f"✅ Seeding Completed in {duration:.2f} seconds!")
     
@@ -0,0 +1,51 @@
+"""
+`python backend/export.py --output -` must write nothing but the export to
+stdout: database.connect_db() prints its connect messages, which would
+otherwise become the first bytes of the stream.
+"""
+import asyncio
+import json
+import sys
+from datetime import datetime
+
+import pytz
+
+import export
+
+ROW = {
+    "timestamp": datetime(2024, 5, 1, 4, 30, tzinfo=pytz.UTC),
+    "user_id": "u1", "dish_id": "d1", "dish_name": "宫保鸡丁", "category": "川菜",
+    "price": 12.5, "calories": 650, "action": "order",
+    "local_date": "2024-05-01", "local_hour": 12, "dow": 2,
+}
+
+
+def run_export(monkeypatch, fmt):
+    async def load_catalog(db):
+        return {}
+
+    async def log_batches(db, catalog, start=None, end=None, action="order", batch_size=export.EXPORT_BATCH_SIZE):
+        yield [ROW]
+
+    monkeypatch.setattr(export, "load_catalog", load_catalog)
+    monkeypatch.setattr(export, "log_batches", log_batches)
+    monkeypatch.setattr(sys, "argv", ["export.py", "--format", fmt, "--output", "-"])
+    asyncio.run(export.main())
+
+
+def test_ndjson_stdout_starts_with_first_record(monkeypatch, capsysbinary):
+    run_export(monkeypatch, "ndjson")
+    out, err = capsysbinary.readouterr()
+    first = json.loads(out.decode("utf-8").splitlines()[0])
+    assert first["dish_id"] == "d1"
+    assert first["timestamp"] == ROW["timestamp"].isoformat()
+    assert b"Connected to MongoDB" in err
+
+
+def test_csv_stdout_starts_with_header(monkeypatch, capsysbinary):
+    run_export(monkeypatch, "csv")
+    out, err = capsysbinary.readouterr()
+    lines = out.decode("utf-8").splitlines()
+    assert lines[0] == "﻿" + ",".join(export.EXPORT_FIELDS)
+    assert lines[1].startswith(ROW["timestamp"].isoformat())
+    assert b"Exported" in err
@@ -0,0 +1,132 @@
+"""
+Hourly traffic forecast shared by /api/portal/traffic_prediction and
+/api/admin/analytics/traffic_prediction.
+
+Each process keeps the orders per local hour of the last FORECAST_DAYS
+complete days (a days×24 grid) in memory, filled from order_rollups_hourly.
+The grid is synced incrementally: at most once per REFRESH_INTERVAL only the
+buckets since the last sync are re-read, and /api/portal/order bumps the
+current hour in between, right after it updates the rollup.
+
+The forecast for a weekday and hour is that weekday's mean, shrunk towards
+the mean of its day type (weekdays Mon-Fri vs. weekend) because a 4-week
+window holds only 4 samples per weekday:
+
+    w = n_dow / (n_dow + SHRINKAGE_DAYS)
+    forecast = w * mean_dow + (1 - w) * mean_day_type
+
+Days without orders count as zero traffic.
+"""
+import asyncio
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional
+
+import numpy as np
+import pytz
+
+from meal_periods import TZ_SHANGHAI, local_fields
+from rollups import ROLLUP_COLLECTION, hour_start
+
+# Complete local days in the window (4 of each weekday)
+FORECAST_DAYS = 28
+# Seconds between incremental syncs from the rollups
+REFRESH_INTERVAL = 3600
+# Pseudo-days of day-type mean mixed into each weekday's mean
+SHRINKAGE_DAYS = 4.0
+
+WEEKEND = (5, 6)
+
+
+def day_type(dow: int) -> str:
+    return "weekend" if dow in WEEKEND else "weekday"
+
+
+class TrafficForecaster:
+    def __init__(self):
+        # local_date -> orders per local hour; holds the window plus today
+        self.days: Dict[str, np.ndarray] = {}
+        self.synced_hour: Optional[datetime] = None  # UTC hour the next sync starts from
+        self.synced_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def _bump(self, local_date: str, local_hour: int, count: int, replace: bool = False):
+        hours = self.days.setdefault(local_date, np.zeros(24, dtype=np.int64))
+        hours[local_hour] = count if replace else hours[local_hour] + count
+
+    def _window(self, today: date) -> list:
+        return [today - timedelta(days=FORECAST_DAYS - i) for i in range(FORECAST_DAYS)]
+
+    async def sync(self, db):
+        """Re-read buckets from the last synced hour on (everything on the first call)."""
+        now = datetime.now(pytz.UTC)
+        today = now.astimezone(TZ_SHANGHAI).date()
+        if self.synced_hour is None:
+            first_day = TZ_SHANGHAI.localize(datetime.combine(self._window(today)[0], datetime.min.time()))
+            since = first_day.astimezone(pytz.UTC)
+        else:
+            since = self.synced_hour
+
+        pipeline = [
+            {"$match": {"hour_start": {"$gte": since}}},
+            {"$group": {"_id": {"date": "$local_date", "hour": "$local_hour"}, "count": {"$sum": "$count"}}}
+        ]
+        async for row in db[ROLLUP_COLLECTION].aggregate(pipeline):
+            # Buckets are authoritative: overwrite what record_order added meanwhile
+            self._bump(row["_id"]["date"], row["_id"]["hour"], row["count"], replace=True)
+
+        oldest = self._window(today)[0].strftime("%Y-%m-%d")
+        self.days = {d: hours for d, hours in self.days.items() if d >= oldest}
+        self.synced_hour = hour_start(now)
+        self.synced_at = time.monotonic()
+
+    async def ensure_fresh(self, db):
+        if self.synced_at is None or time.monotonic() - self.synced_at > REFRESH_INTERVAL:
+            async with self._lock:
+                if self.synced_at is None or time.monotonic() - self.synced_at > REFRESH_INTERVAL:
+                    await self.sync(db)
+
+    def record_order(self, timestamp: datetime):
+        """Count one new order (called from /api/portal/order after the rollup update)."""
+        if self.synced_at is None:
+            return
+        fields = local_fields(timestamp)
+        self._bump(fields["local_date"], fields["local_hour"], 1)
+
+    def profiles(self, today: date) -> np.ndarray:
+        """7×24 forecast, row = weekday (0 = Monday)."""
+        window = self._window(today)
+        grid = np.array([self.days.get(d.strftime("%Y-%m-%d"), np.zeros(24, dtype=np.int64)) for d in window],
+                        dtype=np.float64)
+        dows = np.array([d.weekday() for d in window])
+
+        sums = np.zeros((7, 24))
+        np.add.at(sums, dows, grid)
+        n = np.bincount(dows, minlength=7).astype(np.float64)
+        mean_dow = sums / np.maximum(n, 1)[:, None]
+
+        weekend = np.isin(np.arange(7), WEEKEND)
+        type_mean = {
+            is_weekend: sums[weekend == is_weekend].sum(axis=0) / max(n[weekend == is_weekend].sum(), 1)
+            for is_weekend in (False, True)
+        }
+        w = (n / (n + SHRINKAGE_DAYS))[:, None]
+        prior = np.array([type_mean[bool(weekend[d])] for d in range(7)])
+        return w * mean_dow + (1 - w) * prior
+
+    async def forecast(self, db) -> Dict:
+        """Today's hourly forecast plus what has actually been ordered so far today."""
+        await self.ensure_fresh(db)
+        now = datetime.now(TZ_SHANGHAI)
+        today = now.date()
+        dow = today.weekday()
+        return {
+            "dow": dow,
+            "day_type": day_type(dow),
+            "hourly": self.profiles(today)[dow].tolist(),
+            "today": self.days.get(today.strftime("%Y-%m-%d"), np.zeros(24, dtype=np.int64)).tolist(),
+            "current_hour": now.hour,
+        }
+
+
+traffic_forecaster = TrafficForecaster()
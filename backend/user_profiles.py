@@ -0,0 +1,297 @@
+"""
+Incrementally maintained, time-decayed user profile vectors.
+
+Each user has one document in `user_profiles`:
+
+    {
+        "_id": user_id,
+        "catalog_version": <engine catalog version the sums were built with>,
+        "vector_sum": [...],   # sum of dish_vector * w(t) over all orders
+        "weight_sum": float,   # sum of w(t)
+        "order_count": int,
+        "last_order_at": datetime
+    }
+
+with w(t) = exp((t - PROFILE_EPOCH) / 7 days). Because every order is
+weighted relative to a fixed epoch, a new order is a plain `$inc` (no
+read-modify-write), and the decay relative to "now" is a common factor of
+both sums that cancels when normalizing: vector_sum / weight_sum is exactly
+the exp(-age / 7 days) weighted mean of the user's dish vectors.
+
+Float64 holds exp(x) up to x ~ 709, i.e. ~13 years after the epoch; move
+PROFILE_EPOCH forward and run `rebuild` well before then.
+
+Usage:
+    python backend/user_profiles.py rebuild
+    python backend/user_profiles.py check [--sample 200] [--min-cosine 0.98]
+"""
+import argparse
+import asyncio
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+import pytz
+from pymongo import ReplaceOne
+
+from logs_storage import LOGS_COLLECTION
+
+PROFILE_COLLECTION = "user_profiles"
+DECAY_DAYS = 7.0
+PROFILE_EPOCH = datetime(2024, 1, 1, tzinfo=pytz.UTC)
+
+# Logs processed per chunk when rebuilding from logs_behavior
+REBUILD_BATCH_SIZE = 50000
+
+# Dishes ordered this recently are not recommended again
+COOLDOWN_DAYS = 3
+
+
+def decay_weight(ts: datetime) -> float:
+    """Order weight relative to PROFILE_EPOCH."""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=pytz.UTC)
+    return math.exp((ts - PROFILE_EPOCH).total_seconds() / (DECAY_DAYS * 86400))
+
+
+def profile_vector(doc: Optional[Dict]) -> Optional[np.ndarray]:
+    """Normalized user vector from a stored profile, O(dimensions)."""
+    if not doc or not doc.get("weight_sum"):
+        return None
+    return np.asarray(doc["vector_sum"], dtype=np.float64) / doc["weight_sum"]
+
+
+def is_current(doc: Optional[Dict], engine) -> bool:
+    return bool(doc) and doc.get("catalog_version") == engine.catalog_version
+
+
+async def record_order(db, engine, user_oid, dish_id, timestamp: datetime):
+    """
+    Fold one new order into the user's stored profile.
+    Call after the log has been written: if the profile is missing or was
+    built against another catalog version it is rebuilt from the logs.
+    The $inc only applies to a profile whose last order is older than this
+    one; a profile rebuilt meanwhile from logs that already hold this order
+    does not match, and the rebuild below (idempotent) is the only writer.
+    """
+    idx = engine.dish_index.get(str(dish_id))
+    if idx is None:
+        return
+
+    # MongoDB keeps milliseconds: compare against the timestamp as stored in the log
+    timestamp = timestamp.replace(microsecond=timestamp.microsecond // 1000 * 1000)
+    weight = decay_weight(timestamp)
+    dish_vec = engine.matrix[idx]
+    inc = {f"vector_sum.{i}": float(dish_vec[i]) * weight for i in range(len(dish_vec))}
+    inc["weight_sum"] = weight
+    inc["order_count"] = 1
+
+    result = await db[PROFILE_COLLECTION].update_one(
+        {"_id": user_oid, "catalog_version": engine.catalog_version, "last_order_at": {"$lt": timestamp}},
+        {"$inc": inc, "$max": {"last_order_at": timestamp}}
+    )
+    if result.matched_count == 0:
+        # Missing, stale, already holding this order, or a newer order won the race
+        await rebuild_profiles(db, engine, [user_oid])
+
+
+async def get_profile_vectors(db, engine, user_oids: List) -> Dict[str, np.ndarray]:
+    """
+    Profile vectors for the given users, keyed by str(user_id).
+    Missing or stale profiles are rebuilt from the logs on the way.
+    Users without any (known) orders are absent from the result.
+    """
+    docs = await db[PROFILE_COLLECTION].find({"_id": {"$in": user_oids}}).to_list(length=None)
+    by_user = {d["_id"]: d for d in docs if is_current(d, engine)}
+
+    stale = [oid for oid in user_oids if oid not in by_user]
+    if stale:
+        for doc in await rebuild_profiles(db, engine, stale):
+            by_user[doc["_id"]] = doc
+
+    vectors = {}
+    for oid, doc in by_user.items():
+        vector = profile_vector(doc)
+        if vector is not None:
+            vectors[str(oid)] = vector
+    return vectors
+
+
+async def get_profile_vector(db, engine, user_oid) -> Optional[np.ndarray]:
+    return (await get_profile_vectors(db, engine, [user_oid])).get(str(user_oid))
+
+
+def get_cooldown_ids(history: List[Dict], now: datetime) -> Set[str]:
+    """Dishes ordered in the last 3 days are not recommended again."""
+    cooldown_ids = set()
+    for order in history:
+        ts = order["timestamp"]
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=pytz.UTC)
+        if (now - ts).days < COOLDOWN_DAYS:
+            cooldown_ids.add(str(order["dish_id"]))
+    return cooldown_ids
+
+
+async def get_cooldowns(db, user_oids: List, now: datetime) -> Dict[str, Set[str]]:
+    """Cooldown dish IDs of many users from one $in query, keyed by str(user_id)."""
+    if not user_oids:
+        return {}
+    recent_orders = await db[LOGS_COLLECTION].find(
+        {"user_id": {"$in": user_oids}, "action": "order", "timestamp": {"$gt": now - timedelta(days=COOLDOWN_DAYS)}},
+        {"user_id": 1, "dish_id": 1, "timestamp": 1}
+    ).to_list(length=None)
+    recent_by_user = defaultdict(list)
+    for order in recent_orders:
+        recent_by_user[str(order["user_id"])].append(order)
+    return {str(oid): get_cooldown_ids(recent_by_user[str(oid)], now) for oid in user_oids}
+
+
+async def rebuild_profiles(db, engine, user_oids: List = None) -> List[Dict]:
+    """
+    Recompute profiles from logs_behavior (all users when user_oids is None)
+    and replace the stored documents. Returns the new documents.
+    """
+    match = {"action": "order"}
+    if user_oids is not None:
+        match["user_id"] = {"$in": user_oids}
+    cursor = db[LOGS_COLLECTION].find(match, {"user_id": 1, "dish_id": 1, "timestamp": 1})
+
+    dims = len(engine.DIMENSIONS)
+    user_pos = {}
+    sums = np.zeros((0, dims), dtype=np.float64)
+    weights = np.zeros(0, dtype=np.float64)
+    counts = np.zeros(0, dtype=np.int64)
+    last_order = {}
+
+    def flush(owners, rows, ws):
+        nonlocal sums, weights, counts
+        if len(user_pos) > len(weights):
+            grow = len(user_pos) - len(weights)
+            sums = np.vstack([sums, np.zeros((grow, dims))])
+            weights = np.concatenate([weights, np.zeros(grow)])
+            counts = np.concatenate([counts, np.zeros(grow, dtype=np.int64)])
+        if not owners:
+            return
+        owners = np.asarray(owners)
+        ws = np.asarray(ws)
+        np.add.at(sums, owners, ws[:, None] * engine.matrix[rows].astype(np.float64))
+        weights += np.bincount(owners, weights=ws, minlength=len(weights))
+        counts += np.bincount(owners, minlength=len(counts))
+
+    owners, rows, ws = [], [], []
+    async for log in cursor:
+        idx = engine.dish_index.get(str(log["dish_id"]))
+        if idx is None:
+            continue
+        uid = log["user_id"]
+        pos = user_pos.setdefault(uid, len(user_pos))
+        ts = log["timestamp"]
+        owners.append(pos)
+        rows.append(idx)
+        ws.append(decay_weight(ts))
+        if uid not in last_order or ts > last_order[uid]:
+            last_order[uid] = ts
+        if len(owners) >= REBUILD_BATCH_SIZE:
+            flush(owners, rows, ws)
+            owners, rows, ws = [], [], []
+    flush(owners, rows, ws)
+
+    docs = []
+    for uid, pos in user_pos.items():
+        docs.append({
+            "_id": uid,
+            "catalog_version": engine.catalog_version,
+            "vector_sum": sums[pos].tolist(),
+            "weight_sum": float(weights[pos]),
+            "order_count": int(counts[pos]),
+            "last_order_at": last_order[uid]
+        })
+
+    if docs:
+        for start in range(0, len(docs), 1000):
+            await db[PROFILE_COLLECTION].bulk_write(
+                [ReplaceOne({"_id": d["_id"]}, d, upsert=True) for d in docs[start:start + 1000]],
+                ordered=False
+            )
+    # Users whose orders are gone (e.g. cleared history) lose their profile
+    if user_oids is not None:
+        empty = [oid for oid in user_oids if oid not in user_pos]
+        if empty:
+            await db[PROFILE_COLLECTION].delete_many({"_id": {"$in": empty}})
+    return docs
+
+
+async def check_consistency(db, engine, sample: int, min_cosine: float) -> bool:
+    """
+    Compare stored profiles against VectorEngine.calculate_user_vector on the
+    last 50 orders. They are not expected to be bit-identical: the stored
+    profile decays continuously over all orders, the engine function floors
+    ages to whole days and only looks at the last 50.
+    """
+    docs = await db[PROFILE_COLLECTION].aggregate([{"$sample": {"size": sample}}]).to_list(length=None)
+    if not docs:
+        print("No profiles found. Run `rebuild` first.")
+        return False
+
+    worst_cosine = 1.0
+    max_abs = 0.0
+    stale = 0
+    failed = 0
+    for doc in docs:
+        if not is_current(doc, engine):
+            stale += 1
+            continue
+        history = await db[LOGS_COLLECTION].find(
+            {"user_id": doc["_id"], "action": "order"}
+        ).sort("timestamp", -1).limit(50).to_list(length=50)
+        expected = engine.calculate_user_vector(history)
+        got = profile_vector(doc)
+        if expected is None or got is None:
+            if (expected is None) != (got is None):
+                failed += 1
+            continue
+
+        cosine = engine.cosine_similarity(expected, got)
+        worst_cosine = min(worst_cosine, cosine)
+        max_abs = max(max_abs, float(np.abs(expected - got).max()))
+        if cosine < min_cosine:
+            failed += 1
+            print(f"  user {doc['_id']}: cosine {cosine:.4f}")
+
+    print(f"Checked {len(docs)} profiles: worst cosine {worst_cosine:.4f}, "
+          f"max abs diff {max_abs:.4f}, stale {stale}, failed {failed}")
+    return failed == 0
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Maintain user_profiles")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="Recompute every profile from logs_behavior")
+    check = sub.add_parser("check", help="Compare stored profiles with calculate_user_vector")
+    check.add_argument("--sample", type=int, default=200)
+    check.add_argument("--min-cosine", type=float, default=0.98)
+    args = parser.parse_args()
+
+    from database import db as database_instance
+    from engine_manager import engine_manager
+
+    await database_instance.connect_db()
+    db = database_instance.db
+    try:
+        engine = await engine_manager.rebuild(db, database_instance.redis_client)
+        if args.command == "rebuild":
+            docs = await rebuild_profiles(db, engine)
+            await db[PROFILE_COLLECTION].delete_many({"catalog_version": {"$ne": engine.catalog_version}})
+            print(f"Rebuilt {len(docs)} user profiles (catalog v{engine.catalog_version})")
+        else:
+            ok = await check_consistency(db, engine, args.sample, args.min_cosine)
+            raise SystemExit(0 if ok else 1)
+    finally:
+        await database_instance.close_db()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,15 +1,15 @@
-import math
 from datetime import datetime
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Sequence, Tuple
+import numpy as np
 import pytz
 
 class VectorEngine:
     """
-    A pure Python implementation of a Vector Space Model recommendation engine.
+    A NumPy implementation of a Vector Space Model recommendation engine.
     Features:
     - 9-dimensional feature space for dishes
     - Time-decayed user profiling
-    - Cosine similarity
+    - Cosine similarity (one matrix-vector product per catalog partition)
     - MMR (Maximal Marginal Relevance) for diversity
     """
 
@@ -19,13 +19,26 @@ class VectorEngine:
         'price_sensitivity', 'health_conscious', 'popularity'
     ]
     
+    # Number of most relevant dishes MMR chooses from
+    CANDIDATE_POOL = 50
+
+    # Max users x dishes scores held at once by recommend_batch (64 MB of float32)
+    BATCH_SCORE_CELLS = 1 << 24
+
+    # Catalog partitions are (canteen, course). Dishes without a canteen
+    # belong to the default one; dishes tagged 早餐 form the breakfast course.
+    DEFAULT_CANTEEN = "main"
+    COURSES = ["breakfast", "main"]
+
     def __init__(self, all_dishes: List[Dict]):
         """
         Initialize the engine with all available dishes.
         Pre-computes feature vectors for all dishes.
         """
         self.dishes = {str(d['_id']): d for d in all_dishes}
-        self.dish_vectors = {}
+
+        # Catalog version this engine was built from (set by EngineManager)
+        self.catalog_version = 0
         
         # Pre-compute global stats for normalization
         prices = [d.get('price', 0) for d in all_dishes]
@@ -36,9 +49,68 @@ class VectorEngine:
         self.max_cal = max(calories) if calories else 1
         self.min_cal = min(calories) if calories else 0
         
-        # Build vectors
-        for dish in all_dishes:
-            self.dish_vectors[str(dish['_id'])] = self._extract_features(dish)
+        # Build vectors: row i of the matrix belongs to dish_ids[i].
+        # Rows are grouped by partition so each partition is one contiguous
+        # slice of the matrix (catalog order is kept inside a partition).
+        self.dish_ids = sorted(self.dishes.keys(), key=lambda did: self.partition_key(self.dishes[did]))
+        self.dish_index = {did: i for i, did in enumerate(self.dish_ids)}
+        self.partitions: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        for i, did in enumerate(self.dish_ids):
+            key = self.partition_key(self.dishes[did])
+            start, _ = self.partitions.get(key, (i, i))
+            self.partitions[key] = (start, i + 1)
+        self.canteens = sorted({canteen for canteen, _ in self.partitions})
+        self.matrix = np.zeros((len(self.dish_ids), len(self.DIMENSIONS)), dtype=np.float32)
+        for i, did in enumerate(self.dish_ids):
+            self.matrix[i] = self._extract_features(self.dishes[did])
+
+        # Unit-length rows so cosine similarity is a plain dot product.
+        # Zero vectors stay zero, which gives them a similarity of 0.
+        self.norms = np.linalg.norm(self.matrix, axis=1)
+        safe_norms = np.where(self.norms > 0, self.norms, 1.0).astype(np.float32)
+        self.unit_matrix = np.ascontiguousarray(self.matrix / safe_norms[:, None])
+
+    @classmethod
+    def partition_key(cls, dish: Dict) -> Tuple[str, str]:
+        canteen = dish.get('canteen') or cls.DEFAULT_CANTEEN
+        course = 'breakfast' if '早餐' in dish.get('tags', []) else 'main'
+        return (canteen, course)
+
+    def partition_ranges(self, canteen: str = None, courses: List[str] = None) -> Optional[List[Tuple[int, int]]]:
+        """
+        Row ranges (start, end) of the partitions matching the canteen and
+        courses, in row order. None means the whole catalog.
+        """
+        if canteen is None and courses is None:
+            return None
+        return sorted(
+            rows for (c, course), rows in self.partitions.items()
+            if (canteen is None or c == canteen) and (courses is None or course in courses)
+        )
+
+    def scope_dish_ids(self, ranges: Optional[List[Tuple[int, int]]] = None) -> List[str]:
+        if ranges is None:
+            return self.dish_ids
+        return [did for start, end in ranges for did in self.dish_ids[start:end]]
+
+    def scope_mask(self, ranges: Optional[List[Tuple[int, int]]] = None) -> Optional[np.ndarray]:
+        """Full-catalog boolean mask that is True outside the given ranges."""
+        if ranges is None:
+            return None
+        mask = np.ones(len(self.dish_ids), dtype=bool)
+        for start, end in ranges:
+            mask[start:end] = False
+        return mask
+
+    def _to_global(self, local: np.ndarray, ranges: Optional[List[Tuple[int, int]]]) -> np.ndarray:
+        """Map positions within the concatenated ranges back to matrix rows."""
+        if ranges is None:
+            return local
+        starts = np.array([start for start, _ in ranges])
+        sizes = np.array([end - start for start, end in ranges])
+        ends = np.cumsum(sizes)
+        which = np.searchsorted(ends, local, side='right')
+        return starts[which] + local - (ends[which] - sizes[which])
 
     def _extract_features(self, dish: Dict) -> List[float]:
         """
@@ -96,59 +168,168 @@ class VectorEngine:
         
         return vector
 
-    def calculate_user_vector(self, history: List[Dict]) -> List[float]:
+    def calculate_user_vector(self, history: List[Dict]) -> Optional[np.ndarray]:
         """
         Build user profile vector based on order history with time decay.
         """
         if not history:
             return None
             
-        user_vector = [0.0] * len(self.DIMENSIONS)
-        total_weight = 0.0
+        vectors, valid = self.calculate_user_vectors([history])
+        return vectors[0] if valid[0] else None
         
+    def calculate_user_vectors(self, histories: List[List[Dict]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Batch version of calculate_user_vector.
+        Returns (vectors, valid): one row per history, and a mask of the rows
+        that have a profile (the others would have returned None).
+        """
+        vectors = np.zeros((len(histories), len(self.DIMENSIONS)), dtype=np.float64)
         now = datetime.now(pytz.UTC)
+        owners = []
+        rows = []
+        days = []
         
-        for order in history:
-            dish_id = str(order['dish_id'])
-            if dish_id not in self.dish_vectors:
-                continue
+        for pos, history in enumerate(histories):
+            for order in history or []:
+                idx = self.dish_index.get(str(order['dish_id']))
+                if idx is None:
+                    continue
+                ts = order['timestamp']
+                if ts.tzinfo is None:
+                    ts = ts.replace(tzinfo=pytz.UTC)
+                owners.append(pos)
+                rows.append(idx)
+                days.append((now - ts).days)
                 
-            # Time Decay Weight
-            ts = order['timestamp']
-            if ts.tzinfo is None:
-                ts = ts.replace(tzinfo=pytz.UTC)
+        if not rows:
+            return vectors, np.zeros(len(histories), dtype=bool)
                 
-            days_ago = (now - ts).days
-            # Decay: Recent orders matter much more. Half-life approx 7 days.
-            weight = math.exp(-days_ago / 7.0)
-            
-            dish_vec = self.dish_vectors[dish_id]
-            
-            for i in range(len(self.DIMENSIONS)):
-                user_vector[i] += dish_vec[i] * weight
-                
-            total_weight += weight
-            
-        if total_weight == 0:
-            return None
+        # Decay: Recent orders matter much more. Half-life approx 7 days.
+        owners = np.asarray(owners)
+        weights = np.exp(-np.asarray(days, dtype=np.float64) / 7.0)
+        np.add.at(vectors, owners, weights[:, None] * self.matrix[rows].astype(np.float64))
+        total_weight = np.bincount(owners, weights=weights, minlength=len(histories))
             
+        valid = total_weight > 0
         # Normalize
-        return [x / total_weight for x in user_vector]
-
-    def cosine_similarity(self, v1: List[float], v2: List[float]) -> float:
+        vectors[valid] /= total_weight[valid][:, None]
+        return vectors, valid
+            
+    def cosine_similarity(self, v1: Sequence[float], v2: Sequence[float]) -> float:
         """
         Calculate cosine similarity between two vectors.
         """
-        dot_product = sum(a * b for a, b in zip(v1, v2))
-        norm_a = math.sqrt(sum(a * a for a in v1))
-        norm_b = math.sqrt(sum(b * b for b in v2))
+        a = np.asarray(v1, dtype=np.float64)
+        b = np.asarray(v2, dtype=np.float64)
+        norm_a = np.linalg.norm(a)
+        norm_b = np.linalg.norm(b)
         
         if norm_a == 0 or norm_b == 0:
             return 0.0
             
-        return dot_product / (norm_a * norm_b)
+        return float(a @ b / (norm_a * norm_b))
+
+    def relevance(self, user_vector: Sequence[float], ranges: Optional[List[Tuple[int, int]]] = None) -> np.ndarray:
+        """
+        Cosine similarity of the user vector against every dish, or only
+        against the dishes in the given row ranges (concatenated).
+        """
+        u = np.asarray(user_vector, dtype=np.float32)
+        norm = np.linalg.norm(u)
+        if norm == 0:
+            size = len(self.dish_ids) if ranges is None else sum(end - start for start, end in ranges)
+            return np.zeros(size, dtype=np.float32)
+        u = u / norm
+        if ranges is None:
+            return self.unit_matrix @ u
+        return np.concatenate([self.unit_matrix[start:end] @ u for start, end in ranges] or [np.zeros(0, dtype=np.float32)])
+
+    def relevance_batch(self, user_vectors: np.ndarray, ranges: Optional[List[Tuple[int, int]]] = None) -> np.ndarray:
+        """Cosine similarity of many users against every dish (or the ranges), one row per user."""
+        U = np.asarray(user_vectors, dtype=np.float32)
+        norms = np.linalg.norm(U, axis=1)
+        U = U / np.where(norms > 0, norms, 1.0)[:, None]
+        if ranges is None:
+            return U @ self.unit_matrix.T
+        return np.hstack([U @ self.unit_matrix[start:end].T for start, end in ranges] or [np.zeros((len(U), 0), dtype=np.float32)])
+
+    def exclude_mask(self, exclude_ids: set = None, ranges: Optional[List[Tuple[int, int]]] = None) -> Optional[np.ndarray]:
+        """
+        Boolean mask of dishes to skip, or None when nothing is excluded.
+        With ranges, the mask covers only the dishes in those ranges.
+        """
+        if not exclude_ids:
+            return None
+        rows = [self.dish_index[did] for did in exclude_ids if did in self.dish_index]
+        if not rows:
+            return None
+        mask = np.zeros(len(self.dish_ids), dtype=bool)
+        mask[rows] = True
+        if ranges is not None:
+            mask = np.concatenate([mask[start:end] for start, end in ranges] or [np.zeros(0, dtype=bool)])
+        return mask
+
+    def top_candidates(self, relevance: np.ndarray, mask: np.ndarray = None, k: int = None) -> np.ndarray:
+        """
+        Indices of the k most relevant dishes, best first.
+        Uses a partial selection so only the k winners get sorted; ties keep
+        catalog order, like the stable sort this replaced.
+        """
+        k = k or self.CANDIDATE_POOL
+        allowed = np.flatnonzero(~mask) if mask is not None else np.arange(len(relevance))
+        scores = relevance[allowed]
+        if len(allowed) > k:
+            part = np.argpartition(-scores, k - 1)[:k]
+            # argpartition picks arbitrarily among ties at the cut-off;
+            # re-select those in catalog order
+            cutoff = scores[part].min()
+            above = np.flatnonzero(scores > cutoff)
+            ties = np.flatnonzero(scores == cutoff)[:k - len(above)]
+            part = np.concatenate([above, ties])
+            allowed, scores = allowed[part], scores[part]
+        order = np.lexsort((allowed, -scores))
+        return allowed[order]
+
+    def mmr_select(self, candidates: np.ndarray, user_vector: Sequence[float], top_k: int, diversity_alpha: float) -> List[int]:
+        """
+        Run MMR over the candidate rows.
+        The float32 scan only picks the pool: the pool is re-scored in float64
+        so near-ties resolve exactly as the pure-Python engine resolved them.
+        Pairwise similarities come from one Gram matrix, and the max
+        similarity to the selected set is updated incrementally after each pick.
+        """
+        if len(candidates) == 0:
+            return []
+        u = np.asarray(user_vector, dtype=np.float64)
+        u_norm = np.linalg.norm(u)
+        cand_vecs = self.matrix[candidates].astype(np.float64)
+        cand_norms = np.linalg.norm(cand_vecs, axis=1)
+        cand_unit = cand_vecs / np.where(cand_norms > 0, cand_norms, 1.0)[:, None]
+
+        rel = cand_unit @ (u / u_norm) if u_norm > 0 else np.zeros(len(candidates))
+        order = np.lexsort((candidates, -rel))
+        candidates, rel, cand_unit = candidates[order], rel[order], cand_unit[order]
+        gram = cand_unit @ cand_unit.T
+
+        max_sim_to_selected = np.zeros(len(candidates), dtype=np.float64)
+        available = np.ones(len(candidates), dtype=bool)
+        selected = []
 
-    def recommend(self, user_vector: List[float], top_k: int = 8, diversity_alpha: float = 0.7, exclude_ids: set = None) -> List[Dict]:
+        while len(selected) < top_k and available.any():
+            # MMR Formula
+            mmr = diversity_alpha * rel - (1 - diversity_alpha) * max_sim_to_selected
+            mmr[~available] = -np.inf
+            best = int(np.argmax(mmr))
+
+            selected.append(int(candidates[best]))
+            available[best] = False
+            np.maximum(max_sim_to_selected, gram[:, best], out=max_sim_to_selected)
+
+        return selected
+
+    def recommend(self, user_vector: Sequence[float], top_k: int = 8, diversity_alpha: float = 0.7, exclude_ids: set = None,
+                  ranges: Optional[List[Tuple[int, int]]] = None) -> List[Dict]:
         """
         Get recommendations using MMR (Maximal Marginal Relevance).
         
@@ -157,57 +338,50 @@ class VectorEngine:
             top_k: Number of recommendations to return.
             diversity_alpha: 0-1. Higher = More relevance, Lower = More diversity.
             exclude_ids: Set of dish IDs to exclude (e.g. recently ordered).
+            ranges: Partition row ranges to score (see partition_ranges).
+                Only these dishes are touched; None scores the whole catalog.
         """
-        if not user_vector:
+        if user_vector is None or len(user_vector) == 0 or not self.dish_ids:
             # Cold start: Return random popular dishes (simplified here)
             # In real app, caller handles cold start or we return top popularity
             return []
             
-        candidates = []
-        for did, vec in self.dish_vectors.items():
-            if exclude_ids and did in exclude_ids:
-                continue
+        relevance = self.relevance(user_vector, ranges)
+        return self._recommend_from_relevance(relevance, ranges, user_vector, top_k, diversity_alpha, exclude_ids)
                 
-            sim = self.cosine_similarity(user_vector, vec)
-            candidates.append({
-                'id': did,
-                'dish': self.dishes[did],
-                'vector': vec,
-                'relevance': sim
-            })
+    def recommend_batch(self, user_vectors: np.ndarray, top_k: int = 8, diversity_alpha: float = 0.7, exclude_ids: List[set] = None,
+                        ranges: Optional[List[Tuple[int, int]]] = None) -> List[List[Dict]]:
+        """
+        recommend() for many users at once. All users are scored against all
+        dishes in scope in a single matrix product; candidate selection and
+        MMR then run per user on their own row.
+        """
+        scope_size = len(self.dish_ids) if ranges is None else sum(end - start for start, end in ranges)
+        if len(user_vectors) == 0 or scope_size == 0:
+            return [[] for _ in range(len(user_vectors))]
+
+        # Users are scored in chunks so the score matrix stays bounded
+        # (one chunk covers every user unless the catalog is huge)
+        chunk = max(1, self.BATCH_SCORE_CELLS // scope_size)
+        results = []
+        for start in range(0, len(user_vectors), chunk):
+            relevance = self.relevance_batch(user_vectors[start:start + chunk], ranges)
+            for offset, row in enumerate(relevance):
+                i = start + offset
+                excluded = exclude_ids[i] if exclude_ids else None
+                results.append(self._recommend_from_relevance(row, ranges, user_vectors[i], top_k, diversity_alpha, excluded))
+        return results
+
+    def _recommend_from_relevance(self, relevance: np.ndarray, ranges, user_vector, top_k: int, diversity_alpha: float, exclude_ids: set = None) -> List[Dict]:
+        if len(relevance) == 0:
+            return []
             
         # Filter candidates with very low relevance to speed up MMR
-        candidates.sort(key=lambda x: x['relevance'], reverse=True)
-        candidates = candidates[:50] # Top 50 relevant candidates
+        candidates = self.top_candidates(relevance, self.exclude_mask(exclude_ids, ranges))
+        candidates = self._to_global(candidates, ranges)
         
         # MMR Selection
-        selected = []
+        selected = self.mmr_select(candidates, user_vector, top_k, diversity_alpha)
         
-        while len(selected) < top_k and candidates:
-            best_mmr_score = -float('inf')
-            best_idx = -1
-            
-            for i, cand in enumerate(candidates):
-                # Relevance part
-                relevance = cand['relevance']
-                
-                # Diversity part (Max similarity to already selected)
-                max_sim_to_selected = 0.0
-                for sel in selected:
-                    sim = self.cosine_similarity(cand['vector'], sel['vector'])
-                    if sim > max_sim_to_selected:
-                        max_sim_to_selected = sim
-                        
-                # MMR Formula
-                mmr = diversity_alpha * relevance - (1 - diversity_alpha) * max_sim_to_selected
-                
-                if mmr > best_mmr_score:
-                    best_mmr_score = mmr
-                    best_idx = i
-            
-            if best_idx != -1:
-                selected.append(candidates.pop(best_idx))
-            else:
-                break
-                
-        return [s['dish'] for s in selected]
+        return [self.dishes[self.dish_ids[i]] for i in selected]
+            
\ No newline at end of file